@@ -0,0 +1,261 @@
+import argparse
+import sqlite3
+import time
+from array import array
+from datetime import date, timedelta
+from itertools import compress
+from tabulate import tabulate
+
+from database import ConnectionManager, DB_FILE, LINE_TOTAL_SQL
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional, without it the same figures are worked out in plain Python, only slower
+    np = None
+
+# Days of bills read per query while loading
+CHUNK_DAYS = 31
+# bill_items rows converted to columns per fetchmany call
+CHUNK_ROWS = 50000
+
+COLUMNS = ("bill_id", "day", "hour", "weekday", "product_id", "quantity", "amount_cents")
+BILL_COLUMNS = ("bill_id", "day", "hour", "weekday", "items", "amount_cents")
+WEEKDAYS = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+EPOCH = date(1970, 1, 1)
+# True for a bill_date starting with a real YYYY-MM-DD date, migrated bills may have '' or worse
+VALID_DATE_SQL = "date({0}, '+0 days') = substr({0}, 1, 10)"
+
+# One row per bill line, with the bill date already split into day number, hour and weekday.
+# The unary + keeps the planner on the bill_date index instead of scanning bill_items by id.
+HISTORY_QUERY = f'''
+    SELECT bi.bill_id,
+        CAST(strftime('%s', substr(b.bill_date, 1, 10)) AS INTEGER) / 86400,
+        CAST(substr(b.bill_date, 12, 2) AS INTEGER),
+        CAST(strftime('%w', b.bill_date) AS INTEGER),
+        bi.product_id, bi.quantity, {LINE_TOTAL_SQL}
+    FROM bills b JOIN bill_items bi ON bi.bill_id = b.bill_id
+    WHERE b.bill_date >= ? AND b.bill_date < ? AND +b.bill_id > ? AND +b.bill_id <= ?
+        AND {VALID_DATE_SQL.format("b.bill_date")}
+'''
+
+def day_number(day):
+    """Return days since 1970-01-01 for a YYYY-MM-DD date"""
+    return (date.fromisoformat(day[:10]) - EPOCH).days
+
+def group_sum(keys, values=None):
+    """Return {key: sum of values}, or {key: rows} without values"""
+    if np is not None:
+        unique, inverse = np.unique(keys, return_inverse=True)
+        if values is None:
+            sums = np.bincount(inverse)
+        else:
+            sums = np.rint(np.bincount(inverse, weights=values)).astype(np.int64)
+        return dict(zip(unique.tolist(), sums.tolist()))
+    sums = {}
+    if values is None:
+        for key in keys:
+            sums[key] = sums.get(key, 0) + 1
+    else:
+        for key, value in zip(keys, values):
+            sums[key] = sums.get(key, 0) + value
+    return sums
+
+def per_bill(columns):
+    """Collapse bill line columns into one row per bill with its item count and amount"""
+    if np is not None:
+        bill_ids, first, inverse = np.unique(columns["bill_id"], return_index=True, return_inverse=True)
+        return {
+            "bill_id": bill_ids,
+            "day": columns["day"][first],
+            "hour": columns["hour"][first],
+            "weekday": columns["weekday"][first],
+            "items": np.rint(np.bincount(inverse, weights=columns["quantity"])).astype(np.int64),
+            "amount_cents": np.rint(np.bincount(inverse, weights=columns["amount_cents"])).astype(np.int64)
+        }
+    bills = {}
+    for bill_id, day, hour, weekday, quantity, amount in zip(
+        columns["bill_id"], columns["day"], columns["hour"], columns["weekday"],
+        columns["quantity"], columns["amount_cents"]
+    ):
+        bill = bills.get(bill_id)
+        if bill is None:
+            bills[bill_id] = [day, hour, weekday, quantity, amount]
+        else:
+            bill[3] += quantity
+            bill[4] += amount
+    rows = [(bill_id, *bill) for bill_id, bill in bills.items()]
+    return dict(zip(BILL_COLUMNS, map(list, zip(*rows)))) if rows else {name: [] for name in BILL_COLUMNS}
+
+class SalesHistory:
+    """Columnar copy of the bill lines since a start date, extended as new bills are committed"""
+    
+    def __init__(self, since=None):
+        self.since = since
+        # Highest bill read so far, results are only valid for this bill_id
+        self.max_bill_id = 0
+        self.rows = 0
+        self.names = {}
+        self.results = {}
+        if np is not None:
+            self.data = np.empty((0, len(COLUMNS)), dtype=np.int64)
+            # Chunks read since the last query, joined onto data when it is next used
+            self.blocks = []
+        else:
+            self.data = {name: array("q") for name in COLUMNS}
+    
+    def update(self, conn):
+        """Read the bills committed since the last update and return the number of new bill lines"""
+        max_bill_id = conn.execute("SELECT COALESCE(MAX(bill_id), 0) FROM bills").fetchone()[0]
+        if max_bill_id == self.max_bill_id:
+            return 0
+        
+        first, last = conn.execute(
+            f"SELECT MIN(bill_date), MAX(bill_date) FROM bills WHERE bill_id > ? AND bill_id <= ? "
+            f"AND {VALID_DATE_SQL.format('bill_date')}",
+            (self.max_bill_id, max_bill_id)
+        ).fetchone()
+        added = 0
+        if first is not None:
+            day = date.fromisoformat(max(first, self.since or "")[:10])
+            last_day = date.fromisoformat(last[:10])
+            # Date ranges keep each query on the bill_date index and each batch of rows small
+            while day <= last_day:
+                next_day = day + timedelta(days=CHUNK_DAYS)
+                cursor = conn.execute(
+                    HISTORY_QUERY, (day.isoformat(), next_day.isoformat(), self.max_bill_id, max_bill_id)
+                )
+                while True:
+                    rows = cursor.fetchmany(CHUNK_ROWS)
+                    if not rows:
+                        break
+                    self.append(rows)
+                    added += len(rows)
+                day = next_day
+        
+        self.names = dict(conn.execute("SELECT product_id, name FROM products"))
+        self.max_bill_id = max_bill_id
+        self.results.clear()
+        return added
+    
+    def append(self, rows):
+        """Add a batch of HISTORY_QUERY rows to the columns"""
+        self.rows += len(rows)
+        if np is not None:
+            self.blocks.append(np.array(rows, dtype=np.int64))
+            return
+        for name, values in zip(COLUMNS, zip(*rows)):
+            self.data[name].extend(values)
+    
+    def columns(self, start=None, end=None):
+        """Return {column: values} for the bill lines dated between start and end"""
+        first = day_number(start) if start else None
+        last = day_number(end) if end else None
+        if np is not None:
+            if self.blocks:
+                self.data = np.concatenate([self.data] + self.blocks)
+                self.blocks = []
+            data = self.data
+            if first is not None or last is not None:
+                days = data[:, 1]
+                mask = np.ones(len(data), dtype=bool)
+                if first is not None:
+                    mask &= days >= first
+                if last is not None:
+                    mask &= days <= last
+                data = data[mask]
+            return {name: data[:, index] for index, name in enumerate(COLUMNS)}
+        
+        if first is None and last is None:
+            return self.data
+        keep = [
+            (first is None or day >= first) and (last is None or day <= last)
+            for day in self.data["day"]
+        ]
+        return {name: list(compress(values, keep)) for name, values in self.data.items()}
+    
+    def cached(self, key, compute):
+        """Return a result computed since the last update, computing it if needed"""
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+    
+    def bills(self, start=None, end=None):
+        """Return one row per bill as {column: values}"""
+        return self.cached(("bills", start, end), lambda: per_bill(self.columns(start, end)))
+    
+    def basket_sizes(self, start=None, end=None):
+        """Return (items in the bill, bills) for each basket size"""
+        return self.cached(
+            ("basket_sizes", start, end),
+            lambda: sorted(group_sum(self.bills(start, end)["items"]).items())
+        )
+    
+    def top_products(self, start=None, end=None, limit=10):
+        """Return (product_id, name, quantity, amount) for the best sellers by amount"""
+        def compute():
+            columns = self.columns(start, end)
+            quantity = group_sum(columns["product_id"], columns["quantity"])
+            amount = group_sum(columns["product_id"], columns["amount_cents"])
+            best = sorted(amount, key=amount.get, reverse=True)[:limit]
+            return [
+                (product_id, self.names.get(product_id), quantity[product_id], amount[product_id] / 100)
+                for product_id in best
+            ]
+        return self.cached(("top_products", start, end, limit), compute)
+    
+    def sales_by(self, period, start=None, end=None):
+        """Return (hour or weekday number, bills, amount) for each period with sales"""
+        def compute():
+            bills = self.bills(start, end)
+            counts = group_sum(bills[period])
+            amounts = group_sum(bills[period], bills["amount_cents"])
+            return [(key, counts[key], amounts[key] / 100) for key in sorted(counts)]
+        return self.cached(("sales_by", period, start, end), compute)
+    
+    def hourly_sales(self, start=None, end=None):
+        """Return (hour, bills, amount), the busiest hours are the peaks"""
+        return self.sales_by("hour", start, end)
+    
+    def weekday_sales(self, start=None, end=None):
+        """Return (weekday, bills, amount) from Sunday to Saturday"""
+        return [(WEEKDAYS[day], bills, amount) for day, bills, amount in self.sales_by("weekday", start, end)]
+
+def print_analytics(history, start=None, end=None, limit=10):
+    """Print basket sizes, hourly and weekday sales and the top sellers"""
+    baskets = history.basket_sizes(start, end)
+    bills = sum(count for size, count in baskets)
+    items = sum(size * count for size, count in baskets)
+    print("\n=== BASKET SIZES ===")
+    print(tabulate(baskets, headers=['Items', 'Bills'], tablefmt='grid'))
+    if bills:
+        print(f"{bills} bills, {items / bills:.2f} items per bill")
+    print("\n=== BY HOUR ===")
+    print(tabulate(history.hourly_sales(start, end), headers=['Hour', 'Bills', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+    print("\n=== BY WEEKDAY ===")
+    print(tabulate(history.weekday_sales(start, end), headers=['Day', 'Bills', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+    print("\n=== TOP PRODUCTS ===")
+    print(tabulate(history.top_products(start, end, limit), headers=['ID', 'Name', 'Quantity', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Basket sizes, busy hours and top sellers from the bill history")
+    parser.add_argument("--since", help="first day, YYYY-MM-DD")
+    parser.add_argument("--until", help="last day, YYYY-MM-DD")
+    parser.add_argument("--top", type=int, default=10, help="number of top products")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args()
+    
+    db = ConnectionManager(args.db)
+    try:
+        history = SalesHistory(args.since)
+        started = time.perf_counter()
+        with db.reader() as conn:
+            history.update(conn)
+        loaded = time.perf_counter()
+        print_analytics(history, args.since, args.until, args.top)
+        print(f"\nLoaded {history.rows} bill lines in {loaded - started:.2f}s, "
+              f"analysed in {time.perf_counter() - loaded:.3f}s ({'numpy' if np is not None else 'pure Python'})")
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
+    finally:
+        db.close()
\ No newline at end of file
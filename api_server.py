@@ -0,0 +1,431 @@
+import argparse
+import asyncio
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from analytics import SalesHistory
+from bill_queue import BillQueue, BillReplayer
+from billing_engine import BillingEngine, BillingError, OutOfStockError, PAGE_SIZE, SEARCH_LIMIT
+from database import ConnectionManager, DB_FILE, READER_POOL_SIZE
+import receipts
+import sales_summary
+from sql_stats import query_stats
+
+HOST = "127.0.0.1"
+PORT = 8080
+# Kept apart from the till's queue so each process replays only its own bills
+QUEUE_FILE = 'api_bill_queue.jsonl'
+# Threads running engine calls, one per pooled reader so a request never waits for a connection
+WORKERS = READER_POOL_SIZE
+# Seconds a catalogue response is served from memory before it is read again
+CACHE_SECONDS = 2.0
+# Cached responses kept before the cache is emptied, searches make the keys unbounded
+CACHE_SIZE = 1000
+MAX_PAGE_SIZE = 500
+MAX_BODY_BYTES = 1024 * 1024
+# Seconds an idle keep-alive connection stays open
+IDLE_TIMEOUT = 30
+JSON_TYPE = "application/json"
+RECEIPT_TYPES = {"text": "text/plain; charset=utf-8", "pdf": "application/pdf"}
+
+class ApiError(Exception):
+    """Raised by a handler to answer with an HTTP error status"""
+    
+    def __init__(self, status, message, **details):
+        self.status = status
+        self.payload = dict(details, error=message)
+        super().__init__(message)
+
+class RawResponse:
+    """A handler result sent as it is instead of as JSON"""
+    
+    def __init__(self, data, content_type):
+        self.data = data
+        self.content_type = content_type
+
+def product_json(product):
+    """Return a (product_id, name, category, price_cents, stock) row as a dict"""
+    product_id, name, category, price_cents, stock = product[:5]
+    return {
+        "product_id": product_id,
+        "name": name,
+        "category": category,
+        "price": price_cents / 100,
+        "price_cents": price_cents,
+        "stock": stock
+    }
+
+def cart_json(cart):
+    """Return the priced lines and totals of a Cart as a dict"""
+    return {
+        "lines": [
+            {
+                "product_id": line.product_id,
+                "name": line.name,
+                "quantity": line.quantity,
+                "price_cents": line.price_cents,
+                "discount_cents": line.discount_cents,
+                "tax_cents": line.tax_cents,
+                "promotion_id": line.promotion_id,
+                "total_cents": line.total_cents
+            }
+            for line in cart
+        ],
+        "total_items": cart.total_items,
+        "discount_cents": cart.discount_cents,
+        "tax_cents": cart.tax_cents,
+        "total_cents": cart.total_cents,
+        "total_amount": cart.total_amount
+    }
+
+def query_int(query, name, default, maximum=None, minimum=1):
+    """Read a whole number of at least minimum from the query string"""
+    value = query.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be a whole number")
+    if value < minimum:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be at least {minimum}")
+    return min(value, maximum) if maximum else value
+
+def query_date(query, name):
+    """Read a YYYY-MM-DD date from the query string, or None if it is not given"""
+    value = query.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be a date as YYYY-MM-DD")
+
+def cart_lines(body):
+    """Return the "lines" list of a cart or bill request"""
+    lines = body.get("lines")
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        raise ApiError(HTTPStatus.BAD_REQUEST, 'lines must be a list of {"product_id" or "sku", "quantity"} objects')
+    return lines
+
+class ApiServer:
+    """JSON API over a BillingEngine, an asyncio request loop in front of a thread pool of engine calls"""
+    
+    def __init__(self, db_file=DB_FILE, queue=None, workers=WORKERS, cache_seconds=CACHE_SECONDS):
+        self.db = ConnectionManager(db_file, readers=workers)
+        self.engine = BillingEngine(self.db, queue=queue)
+        self.replayer = BillReplayer(self.engine) if queue is not None else None
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="api")
+        self.cache_seconds = cache_seconds
+        # request target -> (expiry, encoded body) for catalogue reads
+        self.cache = {}
+        # Bumped on every bill so a read that started before the commit is not cached after it
+        self.cache_generation = 0
+        # Bill history for the analytics reports, extended with new bills before each one
+        self.history = SalesHistory()
+        self.history_lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "cache_hits": 0, "started": time.time()}
+        
+        self.routes = []
+        for method, pattern, handler in [
+            ("GET", r"/products", self.list_products),
+            ("GET", r"/products/search", self.search_products),
+            ("GET", r"/products/sku/(?P<code>[^/]+)", self.product_by_sku),
+            ("GET", r"/products/(?P<product_id>\d+)", self.product),
+            ("GET", r"/customers/(?P<phone>[^/]+)", self.customer),
+            ("POST", r"/cart/price", self.price_cart),
+            ("POST", r"/bills", self.create_bill),
+            ("GET", r"/bills/(?P<bill_id>\d+)/receipt", self.receipt),
+            ("GET", r"/reports/(?P<report>daily|payments|categories|top)", self.report),
+            ("GET", r"/reports/(?P<report>baskets|hours|weekdays)", self.analytics),
+            ("GET", r"/stock/alerts", self.stock_alerts),
+            ("GET", r"/status", self.status)
+        ]:
+            self.routes.append((method, re.compile(pattern + "$"), handler))
+    
+    def route(self, method, path):
+        """Return the handler and path arguments for a request"""
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match:
+                if route_method == method:
+                    return handler, match.groupdict()
+                allowed = True
+        if allowed:
+            raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed on {path}")
+        raise ApiError(HTTPStatus.NOT_FOUND, f"No such endpoint {path}")
+    
+    def list_products(self, query, body):
+        limit = query_int(query, "limit", PAGE_SIZE, MAX_PAGE_SIZE)
+        before = query_int(query, "before", None)
+        products = self.engine.products_page(
+            query.get("category", ""), query_int(query, "after", 0, minimum=0), before, limit
+        )
+        return {
+            "products": [product_json(product) for product in products],
+            "next_after": products[-1][0] if len(products) == limit else None
+        }
+    
+    def search_products(self, query, body):
+        limit = query_int(query, "limit", SEARCH_LIMIT, MAX_PAGE_SIZE)
+        # An empty search lists every product, so the page size applies here too
+        products = self.engine.search_products(query.get("q", ""), limit)[:limit]
+        return {"products": [product_json(product) for product in products]}
+    
+    def product(self, query, body, product_id):
+        product = self.engine.get_product(int(product_id))
+        if product is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Product {product_id} does not exist")
+        return product_json(product)
+    
+    def product_by_sku(self, query, body, code):
+        product = self.engine.get_product_by_sku(code)
+        if product is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No product with code {code}")
+        return product_json(product)
+    
+    def customer(self, query, body, phone):
+        customer = self.engine.get_customer_by_phone(phone)
+        if customer is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No customer with phone {phone}")
+        customer_id, name, phone, total_bill_cents = customer
+        return {"customer_id": customer_id, "name": name, "phone": phone, "total_bill_cents": total_bill_cents}
+    
+    def price_cart(self, query, body):
+        return cart_json(self.engine.build_cart(cart_lines(body)))
+    
+    def create_bill(self, query, body):
+        cart = self.engine.build_cart(cart_lines(body))
+        bill = self.engine.generate_bill(
+            str(body.get("customer_name") or ""), str(body.get("customer_phone") or ""),
+            str(body.get("payment_method") or "Cash"), cart
+        )
+        # Stock has changed, so cached catalogue pages are out of date
+        self.cache_generation += 1
+        self.cache.clear()
+        return (HTTPStatus.ACCEPTED if bill["queued"] else HTTPStatus.CREATED), bill
+    
+    def receipt(self, query, body, bill_id):
+        output_format = query.get("format", "text")
+        if output_format not in RECEIPT_TYPES:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"format must be one of {', '.join(RECEIPT_TYPES)}")
+        width = query_int(query, "width", receipts.RECEIPT_WIDTH, receipts.RECEIPT_WIDTH * 2)
+        with self.db.reader() as conn:
+            receipt = receipts.render_receipt(conn, int(bill_id), output_format, max(width, 20))
+        if receipt is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No bill {bill_id}")
+        if isinstance(receipt, str):
+            receipt = receipt.encode("utf-8")
+        return RawResponse(receipt, RECEIPT_TYPES[output_format])
+    
+    def report(self, query, body, report):
+        start = query_date(query, "start")
+        end = query_date(query, "end")
+        with self.db.reader() as conn:
+            if report == "daily":
+                rows = sales_summary.daily_totals(conn, start, end)
+                return {"days": [{"date": d, "bills": b, "amount": a} for d, b, a in rows]}
+            if report == "payments":
+                rows = sales_summary.payment_totals(conn, start, end)
+                return {"payments": [{"payment_method": m, "bills": b, "amount": a} for m, b, a in rows]}
+            if report == "categories":
+                rows = sales_summary.category_totals(conn, start, end)
+                return {"categories": [{"category": c, "quantity": q, "amount": a} for c, q, a in rows]}
+            rows = sales_summary.top_products(conn, start, end, query_int(query, "limit", 10, MAX_PAGE_SIZE))
+            return {"products": [{"product_id": p, "name": n, "quantity": q, "amount": a} for p, n, q, a in rows]}
+    
+    def analytics(self, query, body, report):
+        start = query_date(query, "start")
+        end = query_date(query, "end")
+        with self.history_lock:
+            with self.db.reader() as conn:
+                self.history.update(conn)
+            if report == "baskets":
+                return {"baskets": [{"items": i, "bills": b} for i, b in self.history.basket_sizes(start, end)]}
+            if report == "hours":
+                return {"hours": [{"hour": h, "bills": b, "amount": a} for h, b, a in self.history.hourly_sales(start, end)]}
+            return {"weekdays": [{"weekday": d, "bills": b, "amount": a} for d, b, a in self.history.weekday_sales(start, end)]}
+    
+    def stock_alerts(self, query, body):
+        alerts = self.engine.stock_alerts()
+        for alert in alerts:
+            # JSON has no infinity, a product that is not selling has no days of cover figure
+            if math.isinf(alert["days_of_cover"]):
+                alert["days_of_cover"] = None
+        return {"alerts": alerts}
+    
+    def status(self, query, body):
+        return {
+            "requests": self.stats["requests"],
+            "errors": self.stats["errors"],
+            "cache_hits": self.stats["cache_hits"],
+            "uptime_seconds": time.time() - self.stats["started"],
+            "queue": self.engine.queue.status() if self.engine.queue is not None else None,
+            "locks": self.db.lock_stats(),
+            "sql": [
+                {"statement": sql, "count": count, "total_ms": total_ms, "avg_ms": avg_ms, "max_ms": max_ms, "rows": rows}
+                for sql, count, total_ms, avg_ms, max_ms, rows in query_stats.summary(10)
+            ]
+        }
+    
+    def call(self, handler, args, query, body):
+        """Run a handler on a worker thread and return (status, encoded body, content type)"""
+        try:
+            result = handler(query, body, **args)
+            status = HTTPStatus.OK
+            if isinstance(result, tuple):
+                status, result = result
+            if isinstance(result, RawResponse):
+                return status, result.data, result.content_type
+        except ApiError as e:
+            status, result = e.status, e.payload
+        except OutOfStockError as e:
+            status, result = HTTPStatus.CONFLICT, {"error": str(e), "short_lines": e.short_lines}
+        except BillingError as e:
+            status, result = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except sqlite3.OperationalError as e:
+            status, result = HTTPStatus.SERVICE_UNAVAILABLE, {"error": f"Database unavailable: {e}"}
+        except Exception as e:
+            status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"An error occurred: {e}"}
+        return status, json.dumps(result, default=str).encode("utf-8"), JSON_TYPE
+    
+    async def dispatch(self, method, target, body):
+        """Answer one request, from the catalogue cache when possible"""
+        self.stats["requests"] += 1
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip("/") or "/"
+        cacheable = method == "GET" and path.startswith("/products") and self.cache_seconds > 0
+        if cacheable:
+            cached = self.cache.get(target)
+            if cached is not None and cached[0] > time.monotonic():
+                self.stats["cache_hits"] += 1
+                return HTTPStatus.OK, cached[1], JSON_TYPE
+        
+        try:
+            handler, args = self.route(method, path)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                body = json.loads(body) if body else {}
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST, "Request body is not valid JSON")
+            if not isinstance(body, dict):
+                raise ApiError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+        except ApiError as e:
+            self.stats["errors"] += 1
+            return e.status, json.dumps(e.payload).encode("utf-8"), JSON_TYPE
+        
+        generation = self.cache_generation
+        status, data, content_type = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.call, handler, args, query, body
+        )
+        if status >= 400:
+            self.stats["errors"] += 1
+        elif cacheable and generation == self.cache_generation:
+            if len(self.cache) >= CACHE_SIZE:
+                self.cache.clear()
+            self.cache[target] = (time.monotonic() + self.cache_seconds, data)
+        return status, data, content_type
+    
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one client connection until it closes or goes idle"""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    self.send(writer, HTTPStatus.BAD_REQUEST, b'{"error": "Bad request"}', False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    self.send(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, b'{"error": "Request body too large"}', False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                status, data, content_type = await self.dispatch(method.upper(), target, body)
+                self.send(writer, status, data, keep_alive, content_type)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    @staticmethod
+    def send(writer, status, data, keep_alive, content_type=JSON_TYPE):
+        """Write a response, JSON unless another content type is given"""
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+        )
+    
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        """Accept connections until cancelled"""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        if self.replayer is not None:
+            self.replayer.start()
+        if ready:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+    
+    def close(self):
+        """Stop the replayer and worker threads and close the database"""
+        if self.replayer is not None:
+            self.replayer.stop()
+        self.executor.shutdown()
+        self.engine.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local JSON API for web and handheld billing clients")
+    parser.add_argument("--host", default=HOST, help="address to listen on, 0.0.0.0 for other devices")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads and pooled connections for engine calls")
+    parser.add_argument("--cache-seconds", type=float, default=CACHE_SECONDS, help="catalogue response cache lifetime")
+    parser.add_argument("--no-queue", action="store_true", help="fail bills instead of queueing them when the database is unavailable")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args()
+    
+    try:
+        api = ApiServer(args.db, None if args.no_queue else BillQueue(QUEUE_FILE), args.workers, args.cache_seconds)
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
+    else:
+        try:
+            asyncio.run(api.serve(
+                args.host, args.port,
+                ready=lambda server: print(f"Serving on http://{args.host}:{args.port}")
+            ))
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            print(f"Cannot listen on {args.host}:{args.port}: {e}")
+        finally:
+            api.close()
\ No newline at end of file
@@ -0,0 +1,282 @@
+import argparse
+import glob
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import date, datetime
+
+from database import ConnectionManager, DB_FILE, connect
+
+ARCHIVE_DIR = 'archive'
+# Months kept in the live database, counting the current one
+KEEP_MONTHS = 3
+# Bills copied or deleted per statement, tills only ever wait for one batch
+ARCHIVE_BATCH = 2000
+ARCHIVED_TABLES = ["bills", "bill_items"]
+
+BACKUP_DIR = 'backups'
+# Pages copied per backup step and seconds between steps, so tills can write in between
+BACKUP_PAGES = 256
+BACKUP_PAUSE = 0.005
+BACKUP_KEEP = 7
+
+def next_month(month):
+    """Return the YYYY-MM after a YYYY-MM"""
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12}-{number % 12 + 1:02d}"
+
+def first_kept_month(keep_months=KEEP_MONTHS, today=None):
+    """Return the oldest YYYY-MM that stays in the live database"""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - (keep_months - 1)
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+def archive_path(month, archive_dir=ARCHIVE_DIR):
+    """Return the compressed archive file of a month"""
+    return os.path.join(archive_dir, f"bills-{month}.db.gz")
+
+def archived_months(archive_dir=ARCHIVE_DIR):
+    """Return the YYYY-MM of every archive file, oldest first"""
+    months = []
+    for path in glob.glob(os.path.join(archive_dir, "bills-*.db.gz")):
+        match = re.search(r"bills-(\d{4}-\d{2})\.db\.gz$", path)
+        if match:
+            months.append(match.group(1))
+    return sorted(months)
+
+def compress_file(source, target):
+    """Gzip a file and move it into place only once it is complete on disk"""
+    partial = target + ".part"
+    with open(source, "rb") as src, gzip.open(partial, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(partial, target)
+
+def decompress_file(source, target):
+    """Gunzip a file"""
+    with gzip.open(source, "rb") as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def table_columns(conn, table, schema="main"):
+    """Return (name, declared type, default) for each column of a table"""
+    return [(row[1], row[2], row[4]) for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def create_archive_tables(archive, conn):
+    """Create the archived tables like the live ones, adding columns that later migrations introduced"""
+    for table in ARCHIVED_TABLES:
+        existing = {name for name, kind, default in table_columns(archive, table)}
+        if not existing:
+            sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+            archive.execute(sql)
+            continue
+        for name, kind, default in table_columns(conn, table):
+            if name not in existing:
+                archive.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {name} {kind}" + (f" DEFAULT {default}" if default is not None else "")
+                )
+    archive.execute("CREATE INDEX IF NOT EXISTS idx_bills_bill_date ON bills(bill_date)")
+    archive.execute("CREATE INDEX IF NOT EXISTS idx_bill_items_bill_id ON bill_items(bill_id)")
+
+def archive_month(db, month, archive_dir=ARCHIVE_DIR, batch_size=ARCHIVE_BATCH, progress=None):
+    """Move one month of bills and their items into its compressed archive file and return the bills moved"""
+    start, end = f"{month}-01", f"{next_month(month)}-01"
+    path = archive_path(month, archive_dir)
+    work = path[:-len(".gz")] + ".tmp"
+    os.makedirs(archive_dir, exist_ok=True)
+    if os.path.exists(work):
+        os.remove(work)
+    # Bills dated in a month that was already archived, such as replayed ones, are added to its file
+    if os.path.exists(path):
+        decompress_file(path, work)
+    
+    with db.reader() as conn:
+        bill_ids = [row[0] for row in conn.execute(
+            "SELECT bill_id FROM bills WHERE bill_date >= ? AND bill_date < ? ORDER BY bill_id", (start, end)
+        )]
+        if not bill_ids:
+            if os.path.exists(work):
+                os.remove(work)
+            return 0
+        
+        archive = sqlite3.connect(work)
+        try:
+            create_archive_tables(archive, conn)
+            for table in ARCHIVED_TABLES:
+                columns = [name for name, kind, default in table_columns(conn, table)]
+                names = ", ".join(columns)
+                placeholders = ", ".join("?" * len(columns))
+                for offset in range(0, len(bill_ids), batch_size):
+                    batch = bill_ids[offset:offset + batch_size]
+                    rows = conn.execute(
+                        f"SELECT {names} FROM {table} WHERE bill_id IN ({', '.join('?' * len(batch))})", batch
+                    ).fetchall()
+                    archive.executemany(f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({placeholders})", rows)
+                if progress:
+                    progress(f"  {month}: copied {table}")
+            archive.commit()
+            
+            archived = archive.execute(
+                "SELECT COUNT(*) FROM bills WHERE bill_id IN (SELECT value FROM json_each(?))", (str(bill_ids),)
+            ).fetchone()[0]
+            if archived != len(bill_ids):
+                raise sqlite3.DatabaseError(f"{month}: archive holds {archived} of {len(bill_ids)} bills")
+            archive.execute("VACUUM")
+        finally:
+            archive.close()
+    
+    compress_file(work, path)
+    os.remove(work)
+    
+    # Only now that the archive is safely on disk do the bills leave the live database
+    for offset in range(0, len(bill_ids), batch_size):
+        batch = bill_ids[offset:offset + batch_size]
+        placeholders = ", ".join("?" * len(batch))
+        with db.transaction() as conn:
+            conn.execute(f"DELETE FROM bill_items WHERE bill_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM bills WHERE bill_id IN ({placeholders})", batch)
+    return len(bill_ids)
+
+def archive_closed_months(db_file=DB_FILE, keep_months=KEEP_MONTHS, archive_dir=ARCHIVE_DIR, progress=None):
+    """Archive every month older than the kept ones and return {month: bills moved}"""
+    cutoff = f"{first_kept_month(keep_months)}-01"
+    db = ConnectionManager(db_file)
+    try:
+        with db.reader() as conn:
+            months = [row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(bill_date, 1, 7) FROM bills WHERE bill_date < ? ORDER BY 1", (cutoff,)
+            )]
+        moved = {}
+        for month in months:
+            if progress:
+                progress(f"Archiving {month}")
+            moved[month] = archive_month(db, month, archive_dir, progress=progress)
+        return moved
+    finally:
+        db.close()
+
+def cached_month(month, archive_dir=ARCHIVE_DIR):
+    """Return an uncompressed copy of a month's archive, unpacking it again if the archive changed"""
+    cache_dir = os.path.join(archive_dir, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    path = archive_path(month, archive_dir)
+    cached = os.path.join(cache_dir, f"bills-{month}.db")
+    if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(path):
+        decompress_file(path, cached + ".part")
+        os.replace(cached + ".part", cached)
+    return cached
+
+def attach_archives(conn, start=None, end=None, archive_dir=ARCHIVE_DIR):
+    """Attach the archived months overlapping a date range to a read connection and return them"""
+    # Temporary views named bills and bill_items then shadow the live tables on this connection only,
+    # so the existing report queries see archived and live bills together
+    months = [
+        month for month in archived_months(archive_dir)
+        if (not start or next_month(month) > start[:7]) and (not end or month <= end[:7])
+    ]
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")} - {"main", "temp"}
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - len(attached)
+    wanted = [month for month in months if f"archive_{month.replace('-', '_')}" not in attached]
+    if len(wanted) > limit:
+        raise ValueError(f"{len(months)} archived months in range, at most {limit} can be opened at once; narrow the date range")
+    for month in wanted:
+        conn.execute(f"ATTACH DATABASE ? AS archive_{month.replace('-', '_')}", (cached_month(month, archive_dir),))
+    
+    for table in ARCHIVED_TABLES:
+        columns = table_columns(conn, table)
+        selects = [f"SELECT {', '.join(name for name, kind, default in columns)} FROM main.{table}"]
+        for month in months:
+            schema = f"archive_{month.replace('-', '_')}"
+            present = {name for name, kind, default in table_columns(conn, table, schema)}
+            # Archives written before a migration get the new column's default
+            selects.append("SELECT " + ", ".join(
+                name if name in present else f"{default if default is not None else 'NULL'} AS {name}"
+                for name, kind, default in columns
+            ) + f" FROM {schema}.{table}")
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+        conn.execute(f"CREATE TEMP VIEW {table} AS " + " UNION ALL ".join(selects))
+    return months
+
+def backup_database(db_file=DB_FILE, backup_dir=BACKUP_DIR, pages=BACKUP_PAGES, pause=BACKUP_PAUSE,
+                    keep=BACKUP_KEEP, progress=None):
+    """Copy the live database a few pages at a time into a compressed, timestamped backup and return its path"""
+    os.makedirs(backup_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(db_file))[0]
+    path = os.path.join(backup_dir, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz")
+    work = path[:-len(".gz")] + ".tmp"
+    started = time.perf_counter()
+    
+    def step(status, remaining, total):
+        if progress:
+            progress(f"  {total - remaining}/{total} pages")
+        # Each step is a short read, the pause lets tills commit between them
+        time.sleep(pause)
+    
+    source = connect(db_file)
+    target = sqlite3.connect(work)
+    try:
+        source.backup(target, pages=pages, progress=step)
+        result = target.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"backup failed its check: {result}")
+    finally:
+        target.close()
+        source.close()
+    
+    compress_file(work, path)
+    os.remove(work)
+    
+    if keep:
+        # Timestamped names sort oldest first
+        for old in sorted(glob.glob(os.path.join(backup_dir, f"{name}-*.db.gz")))[:-keep]:
+            os.remove(old)
+    return {"path": path, "bytes": os.path.getsize(path), "seconds": time.perf_counter() - started}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive closed months of bills and back up the shop database")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    archive = commands.add_parser("archive", help="move closed months of bills into compressed monthly files")
+    archive.add_argument("--keep-months", type=int, default=KEEP_MONTHS, help="months kept live, counting this one")
+    archive.add_argument("--dir", default=ARCHIVE_DIR, help="archive directory")
+    archive.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards (blocks the tills)")
+    
+    listing = commands.add_parser("list", help="show the archived months")
+    listing.add_argument("--dir", default=ARCHIVE_DIR, help="archive directory")
+    
+    backup = commands.add_parser("backup", help="take an online compressed backup")
+    backup.add_argument("--dir", default=BACKUP_DIR, help="backup directory")
+    backup.add_argument("--pages", type=int, default=BACKUP_PAGES, help="pages per step, -1 copies in one step")
+    backup.add_argument("--keep", type=int, default=BACKUP_KEEP, help="backups to keep, 0 keeps all")
+    
+    restore = commands.add_parser("restore", help="unpack a backup to a new database file")
+    restore.add_argument("backup")
+    restore.add_argument("target")
+    args = parser.parse_args()
+    
+    try:
+        if args.command == "archive":
+            started = time.perf_counter()
+            moved = archive_closed_months(args.db, args.keep_months, args.dir, progress=print)
+            print(f"Archived {sum(moved.values())} bills from {len(moved)} months in {time.perf_counter() - started:.1f}s")
+            if args.vacuum:
+                conn = connect(args.db)
+                conn.execute("VACUUM")
+                conn.close()
+        elif args.command == "list":
+            for month in archived_months(args.dir):
+                print(f"{month}  {os.path.getsize(archive_path(month, args.dir)) / 1024:.0f} KB")
+        elif args.command == "backup":
+            result = backup_database(args.db, args.dir, args.pages, keep=args.keep)
+            print(f"Backed up to {result['path']} ({result['bytes'] / 1024:.0f} KB) in {result['seconds']:.1f}s")
+        elif os.path.exists(args.target):
+            print(f"{args.target} already exists, restore to a new file")
+        else:
+            decompress_file(args.backup, args.target)
+            print(f"Restored {args.backup} to {args.target}")
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}")
\ No newline at end of file
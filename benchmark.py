@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from billing_engine import BillingEngine, OutOfStockError
+from database import ConnectionManager, get_connection
+from sales_summary import category_totals, daily_totals, rebuild_summaries, top_products
+from sql_stats import enable_slow_log, query_stats
+import view_data
+
+WORDS = [
+    "Cotton", "Denim", "Silk", "Linen", "Wool", "Khadi", "Rayon", "Chiffon",
+    "Kurta", "Saree", "Shirt", "Jeans", "Dress", "Jacket", "Blazer", "Skirt",
+    "Slim", "Regular", "Printed", "Striped", "Floral", "Classic", "Summer", "Winter"
+]
+CATEGORIES = ["T-Shirt", "Pants", "Dress", "Shirt", "Shorts", "Kurta", "Saree", "Jacket"]
+PAYMENT_METHODS = ["Cash", "Credit Card", "Debit Card", "Mobile Payment"]
+
+# Basket sizes: (weight, smallest, largest) lines per bill, mostly small with a few wholesale bills
+BASKET_MIX = [(70, 1, 3), (25, 4, 10), (4, 11, 50), (1, 100, 300)]
+CHUNK_SIZE = 10000
+
+def product_rows(count, rng):
+    """Yield synthetic product rows"""
+    for number in range(count):
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(WORDS)} {number}"
+        yield (
+            name,
+            rng.choice(CATEGORIES),
+            rng.randint(9900, 299900),
+            10 ** 6,
+            f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+            f"890{number:010d}"
+        )
+
+def basket_size(rng):
+    """Pick the number of lines of a bill from BASKET_MIX"""
+    weights = [weight for weight, smallest, largest in BASKET_MIX]
+    weight, smallest, largest = rng.choices(BASKET_MIX, weights)[0]
+    return rng.randint(smallest, largest)
+
+def seed_database(db_file, products=10000, bills=10000, days=365, seed=1):
+    """Create a cloth_shop.db shaped database with synthetic products and sales history"""
+    rng = random.Random(seed)
+    conn = get_connection(db_file)
+    cursor = conn.cursor()
+    
+    cursor.execute("SELECT COUNT(*) FROM products")
+    existing = cursor.fetchone()[0]
+    rows = product_rows(products, rng)
+    while True:
+        chunk = [row for _, row in zip(range(CHUNK_SIZE), rows)]
+        if not chunk:
+            break
+        cursor.executemany(
+            "INSERT INTO products (name, category, price_cents, stock, description, sku) VALUES (?, ?, ?, ?, ?, ?)",
+            chunk
+        )
+        conn.commit()
+    
+    cursor.execute("SELECT product_id, price_cents FROM products")
+    catalogue = cursor.fetchall()
+    cursor.execute("SELECT COALESCE(MAX(bill_id), 0) FROM bills")
+    next_bill_id = cursor.fetchone()[0] + 1
+    
+    start = datetime.now() - timedelta(days=days)
+    for first in range(0, bills, CHUNK_SIZE):
+        bill_rows = []
+        item_rows = []
+        for bill_id in range(next_bill_id + first, next_bill_id + min(first + CHUNK_SIZE, bills)):
+            lines = rng.sample(catalogue, min(basket_size(rng), len(catalogue)))
+            total = 0
+            for product_id, price in lines:
+                quantity = rng.randint(1, 3)
+                total += price * quantity
+                item_rows.append((bill_id, product_id, quantity, price))
+            bill_date = start + timedelta(seconds=rng.randint(0, days * 86400))
+            bill_rows.append((
+                bill_id, f"Customer {rng.randint(1, 5000)}", bill_date.strftime("%Y-%m-%d %H:%M:%S"),
+                total, rng.choice(PAYMENT_METHODS)
+            ))
+        cursor.executemany(
+            "INSERT INTO bills (bill_id, customer_name, bill_date, total_cents, payment_method) VALUES (?, ?, ?, ?, ?)",
+            bill_rows
+        )
+        cursor.executemany(
+            "INSERT INTO bill_items (bill_id, product_id, quantity, price_cents) VALUES (?, ?, ?, ?)",
+            item_rows
+        )
+        conn.commit()
+    conn.close()
+    
+    db = ConnectionManager(db_file)
+    try:
+        rebuild_summaries(db)
+    finally:
+        db.close()
+    return {"products": existing + products, "bills": bills}
+
+def copy_database(source, target):
+    """Copy a database with the sqlite backup API, so the benchmark's bills never reach the original"""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def percentile(samples, fraction):
+    """Return a percentile of a sorted list of samples"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+def summarize(samples):
+    """Return count, throughput and latency percentiles in milliseconds for timings in seconds"""
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "ops_per_sec": len(samples) / total if total else 0.0,
+        "mean_ms": total / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "max_ms": samples[-1] * 1000 if samples else 0.0
+    }
+
+def timed(samples, fn, *args):
+    """Call fn(*args), add its duration to samples and return its result"""
+    started = time.perf_counter()
+    result = fn(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+def run_benchmark(db_file, baskets=200, searches=500, reports=20, report_rows=100000, seed=2):
+    """Replay searches, baskets and reports against a database and return timing statistics"""
+    rng = random.Random(seed)
+    timings = {"search": [], "add_to_cart": [], "scan": [], "commit": [], "report_daily": [], "report_stream": []}
+    
+    engine = BillingEngine(ConnectionManager(db_file))
+    try:
+        with engine.db.reader() as conn:
+            product_ids = [row[0] for row in conn.execute("SELECT product_id FROM products")]
+            skus = [row[0] for row in conn.execute("SELECT sku FROM products WHERE sku IS NOT NULL")]
+        # Load the product cache up front, like a till that has been running for a while
+        engine.product_cache()
+        
+        for _ in range(searches):
+            word = rng.choice(WORDS)
+            term = word[:rng.randint(3, len(word))] if rng.random() < 0.7 else f"{word} {rng.choice(WORDS)}"
+            timed(timings["search"], engine.search_products, term)
+        
+        started = time.perf_counter()
+        lines = 0
+        for _ in range(baskets):
+            for _ in range(basket_size(rng)):
+                if skus and rng.random() < 0.5:
+                    timed(timings["scan"], engine.scan, f"{rng.randint(1, 3)}*{rng.choice(skus)}")
+                else:
+                    timed(timings["add_to_cart"], engine.add_item, rng.choice(product_ids), rng.randint(1, 3))
+            lines += len(engine.cart)
+            try:
+                timed(timings["commit"], engine.generate_bill, "Benchmark", "", rng.choice(PAYMENT_METHODS))
+            except OutOfStockError:
+                engine.clear_cart()
+        checkout_seconds = time.perf_counter() - started
+        
+        with engine.db.reader() as conn:
+            for _ in range(reports):
+                timed(timings["report_daily"], lambda: (
+                    daily_totals(conn), category_totals(conn), top_products(conn)
+                ))
+    finally:
+        engine.close()
+    
+    with open(os.devnull, "w") as sink:
+        timed(
+            timings["report_stream"], view_data.view_database,
+            ["bill_items"], None, report_rows, "jsonl", sink, view_data.PAGE_SIZE, False, db_file
+        )
+    
+    results = {name: summarize(samples) for name, samples in timings.items()}
+    results["checkout"] = {
+        "baskets": baskets,
+        "lines": lines,
+        "seconds": checkout_seconds,
+        "baskets_per_sec": baskets / checkout_seconds if checkout_seconds else 0.0
+    }
+    results["report_stream"]["rows"] = report_rows
+    return results
+
+def compare(results, previous):
+    """Return the change in p95 latency for each operation against an earlier run"""
+    changes = {}
+    for name, stats in results.items():
+        old = previous.get("results", previous).get(name, {})
+        if "p95_ms" in stats and old.get("p95_ms"):
+            changes[name] = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+    return changes
+
+def main(argv=None):
+    """Seed or open a database, run the benchmark and print or save the results"""
+    parser = argparse.ArgumentParser(description="Benchmark search, checkout and reporting")
+    parser.add_argument("--db", help="database to benchmark a temporary copy of (default: a new seeded temporary database)")
+    parser.add_argument("--products", type=int, default=10000, help="products to seed")
+    parser.add_argument("--bills", type=int, default=10000, help="historical bills to seed")
+    parser.add_argument("--baskets", type=int, default=200, help="bills to replay")
+    parser.add_argument("--searches", type=int, default=500, help="searches to replay")
+    parser.add_argument("--report-rows", type=int, default=100000, help="bill_items rows to stream in the report test")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON results to compare p95 latency against")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary database")
+    parser.add_argument("--sql-stats", action="store_true", help="print per-statement SQL stats after the run")
+    parser.add_argument("--slow-log", help="log statements slower than --slow-ms to this file")
+    parser.add_argument("--slow-ms", type=float, default=50, help="slow statement threshold in milliseconds")
+    args = parser.parse_args(argv)
+    
+    workdir = tempfile.mkdtemp(prefix="cloth_shop_bench_")
+    db_file = os.path.join(workdir, "cloth_shop.db")
+    seeded = None
+    try:
+        if args.db:
+            # The benchmark commits real bills, so it runs on a copy
+            copy_database(args.db, db_file)
+            print(f"Copied {args.db} to {db_file}")
+        else:
+            started = time.perf_counter()
+            seeded = seed_database(db_file, args.products, args.bills, seed=args.seed)
+            seeded["seconds"] = time.perf_counter() - started
+            print(f"Seeded {db_file} with {args.products} products and {args.bills} bills in {seeded['seconds']:.1f}s")
+        
+        if args.slow_log:
+            enable_slow_log(args.slow_log, args.slow_ms)
+        # Only the replayed workload is counted, not the seeding
+        query_stats.reset()
+        results = run_benchmark(db_file, args.baskets, args.searches, report_rows=args.report_rows, seed=args.seed + 1)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "database": {"file": args.db} if args.db else {"seeded": seeded},
+        "results": results
+    }
+    
+    print(f"{'operation':<15}{'count':>8}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in results.items():
+        if "p50_ms" in stats:
+            print(f"{name:<15}{stats['count']:>8}{stats['ops_per_sec']:>12.1f}"
+                  f"{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+    print(f"checkout: {results['checkout']['baskets_per_sec']:.1f} baskets/s over {results['checkout']['lines']} lines")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            changes = compare(results, json.load(f))
+        report["p95_change_percent"] = changes
+        for name, change in changes.items():
+            print(f"{name:<15} p95 {change:+.1f}%")
+    
+    if args.sql_stats:
+        print(query_stats.format_summary())
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+QUEUE_FILE = 'bill_queue.jsonl'
+# Seconds between attempts to drain the queue into the shop database
+REPLAY_INTERVAL = 5.0
+
+class BillQueue:
+    """Append-only local journal of bills that could not be written to the shop database yet"""
+    
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        # Byte offset of the first bill not yet replayed, kept in a side file
+        self.checkpoint_path = path + ".done"
+        self.lock = threading.Lock()
+        self.entries = deque()
+        self.offset = 0
+        self.replayed = 0
+        self.last_error = None
+        self.recover()
+    
+    def recover(self):
+        """Load the bills still waiting from disk, dropping a half-written last line"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.checkpoint_path) as f:
+                self.offset = int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            self.offset = 0
+        
+        with open(self.path, "rb") as f:
+            data = f.read()
+        # A line without its newline was never acknowledged to the cashier, so it is safe to drop
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(complete)
+        if self.offset > complete:
+            self.offset = 0
+        
+        position = self.offset
+        for line in data[self.offset:complete].splitlines(keepends=True):
+            end = position + len(line)
+            self.entries.append((end, json.loads(line)))
+            position = end
+    
+    def append(self, entry):
+        """Write a bill to the journal and wait until it is on disk"""
+        entry = dict(entry, queued_at=time.time())
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self.lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                end = f.tell()
+            self.entries.append((end, entry))
+        return entry
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def peek(self):
+        """Return the oldest waiting bill, or None"""
+        with self.lock:
+            return self.entries[0][1] if self.entries else None
+    
+    def pop(self):
+        """Mark the oldest waiting bill as written to the shop database"""
+        with self.lock:
+            end, entry = self.entries.popleft()
+            self.replayed += 1
+            self.last_error = None
+            if self.entries:
+                self.offset = end
+                temporary = self.checkpoint_path + ".tmp"
+                with open(temporary, "w") as f:
+                    f.write(str(end))
+                os.replace(temporary, self.checkpoint_path)
+            else:
+                # Nothing left, start both files again; replaying a bill twice is harmless if this is interrupted
+                self.offset = 0
+                if os.path.exists(self.checkpoint_path):
+                    os.remove(self.checkpoint_path)
+                open(self.path, "wb").close()
+    
+    def status(self):
+        """Return the backlog size, seconds the oldest bill has waited and the last replay error"""
+        with self.lock:
+            oldest = self.entries[0][1]["queued_at"] if self.entries else None
+            return {
+                "backlog": len(self.entries),
+                "lag_seconds": time.time() - oldest if oldest else 0.0,
+                "replayed": self.replayed,
+                "last_error": self.last_error
+            }
+
+class BillReplayer:
+    """Background thread that drains a BillQueue through a BillingEngine"""
+    
+    def __init__(self, engine, interval=REPLAY_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self.wake_event = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="bill-replayer", daemon=True)
+    
+    def start(self):
+        """Start draining, beginning with whatever a previous session left behind"""
+        self.thread.start()
+    
+    def wake(self):
+        """Try to drain now instead of waiting for the next interval"""
+        self.wake_event.set()
+    
+    def run(self):
+        while not self.stopped:
+            self.engine.replay_queue()
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+    
+    def stop(self):
+        """Stop after the bill being replayed, if any"""
+        self.stopped = True
+        self.wake_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
\ No newline at end of file
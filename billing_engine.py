@@ -0,0 +1,609 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from database import ConnectionManager, PRODUCT_COLUMNS, QUEUE_BUSY_TIMEOUT_MS, is_unavailable_error, prune_change_log
+from cart import Cart, CartLine
+from customers import CustomerDirectory, normalize_phone, record_purchase
+from pricing import PriceRules
+from product_cache import ProductCache
+from sales_summary import record_bill
+from stock_monitor import StockMonitor
+
+JOINED_PRODUCT_COLUMNS = "p.product_id, p.name, p.category, p.price_cents, p.stock"
+SEARCH_LIMIT = 50
+PAGE_SIZE = 100
+
+# Scans kept for the scans per second figure
+SCAN_WINDOW = 50
+
+# Rows changed by other processes since the last check above which the caches are reloaded in full
+REFRESH_LIMIT = 5000
+
+# bm25 column weights for name, category and description
+SEARCH_RANK = "bm25(products_fts, 10.0, 5.0, 1.0)"
+
+class BillingError(Exception):
+    """Raised when a cart or bill operation cannot be completed"""
+
+class OutOfStockError(BillingError):
+    """Raised when a bill asks for more of a product than is in stock"""
+    
+    def __init__(self, short_lines):
+        self.short_lines = short_lines
+        super().__init__("Not enough stock for:\n" + "\n".join(
+            f"{line['name']}: requested {line['requested']}, available {line['available']}"
+            for line in short_lines
+        ))
+
+class BillingEngine:
+    """Product lookup, cart and bill commit logic without any GUI dependency"""
+    
+    def __init__(self, db=None, products=None, customers=None, stock=None, queue=None, pricing=None,
+                 background_refresh=False):
+        # Engines sharing a ConnectionManager should share its ProductCache, CustomerDirectory, StockMonitor and PriceRules as well
+        self.db = db if db is not None else ConnectionManager()
+        self.conn = self.db.conn
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name='products_fts'")
+        self.full_text_search = self.cursor.fetchone() is not None
+        self.products = products if products is not None else ProductCache()
+        self.customers = customers if customers is not None else CustomerDirectory()
+        self.stock = stock if stock is not None else StockMonitor()
+        self.pricing = pricing if pricing is not None else PriceRules()
+        # Optional BillQueue, without one a bill that cannot be written raises instead of waiting on disk
+        self.queue = queue
+        self.data_version = None
+        # Last change_log row applied to the caches
+        self.change_id = None
+        # When set, reads use the loaded caches as they are and refresh_caches() keeps them current from a background thread
+        self.background_refresh = background_refresh
+        self.cache_lock = threading.Lock()
+        self.cart = Cart(self.pricing)
+        self.scan_times = deque(maxlen=SCAN_WINDOW)
+        self.scan_count = 0
+        self.scan_seconds = 0.0
+    
+    def check_data_version(self):
+        """Bring the caches up to date if another process changed the database"""
+        if self.background_refresh:
+            return
+        # All writes from this process go through the writer, so only other processes bump its data_version
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            with self.db.reader() as conn:
+                # One snapshot, so a reloaded stock monitor's change marker matches the rollups it read
+                conn.execute("BEGIN")
+                self.apply_changes(conn.cursor())
+            self.data_version = data_version
+    
+    def refresh_caches(self):
+        """Apply other processes' changes and load any cache not loaded yet, for a background thread to call"""
+        with self.cache_lock, self.db.reader() as conn:
+            # A reader, so the refresh never waits on a bill being written
+            conn.execute("BEGIN")
+            cursor = conn.cursor()
+            self.apply_changes(cursor)
+            for cache in (self.products, self.customers, self.pricing):
+                if not cache.loaded:
+                    cache.load(cursor)
+            if not self.stock.loaded:
+                self.stock.load(cursor)
+                self.stock.change_id = self.change_id
+    
+    def reload_caches(self, cursor, change_id):
+        """Reload every loaded cache, swapping each new copy in so other threads keep reading the old one meanwhile"""
+        for cache in (self.products, self.customers, self.pricing):
+            if cache.loaded:
+                cache.load(cursor)
+        if self.stock.loaded:
+            self.stock.load(cursor)
+            self.stock.change_id = change_id
+    
+    def apply_changes(self, cursor):
+        """Patch the caches with the rows change_log lists since the last check"""
+        cursor.execute("SELECT MIN(change_id), MAX(change_id) FROM change_log")
+        oldest, newest = cursor.fetchone()
+        newest = newest or 0
+        last, self.change_id = self.change_id, newest
+        if last is None or (oldest is not None and oldest > last + 1) or newest - last > REFRESH_LIMIT:
+            # First check, too far behind, or the rows since the last check were pruned
+            self.reload_caches(cursor, newest)
+            return
+        if newest == last:
+            return
+        
+        changed = {}
+        bills = []
+        cursor.execute(
+            "SELECT change_id, table_name, row_id FROM change_log WHERE change_id > ? AND change_id <= ?", (last, newest)
+        )
+        for change_id, table, row_id in cursor.fetchall():
+            changed.setdefault(table, set()).add(row_id)
+            # Bills already in the rollups the stock monitor loaded are not added again
+            if table == "bills" and change_id > self.stock.change_id:
+                bills.append(row_id)
+        
+        if changed.get("products") and self.products.loaded:
+            self.products.refresh(cursor, changed["products"])
+        if changed.get("customers") and self.customers.loaded:
+            self.customers.refresh(cursor, changed["customers"])
+        if changed.get("promotions") or changed.get("tax_slabs"):
+            # A handful of rows, cheaper to recompile than to patch
+            if self.pricing.loaded:
+                self.pricing.load(cursor)
+        if bills and self.stock.loaded:
+            cursor.execute(
+                "SELECT b.bill_uuid, b.bill_date, bi.product_id, bi.quantity FROM bills b "
+                "JOIN bill_items bi ON bi.bill_id = b.bill_id WHERE b.bill_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(bills),)
+            )
+            lines = {}
+            for bill_uuid, bill_date, product_id, quantity in cursor.fetchall():
+                lines.setdefault((bill_uuid, bill_date), []).append(CartLine(product_id, None, None, 0, quantity))
+            for (bill_uuid, bill_date), items in lines.items():
+                self.stock.record(bill_date, items, bill_uuid)
+    
+    def product_cache(self):
+        """Return the product cache, reloading it if it is stale"""
+        if self.background_refresh and self.products.loaded:
+            return self.products
+        with self.cache_lock:
+            self.check_data_version()
+            if not self.products.loaded:
+                with self.db.reader() as conn:
+                    self.products.load(conn.cursor())
+        return self.products
+    
+    def customer_directory(self):
+        """Return the customer phone index, reloading it if it is stale"""
+        if self.background_refresh and self.customers.loaded:
+            return self.customers
+        with self.cache_lock:
+            self.check_data_version()
+            if not self.customers.loaded:
+                with self.db.reader() as conn:
+                    self.customers.load(conn.cursor())
+        return self.customers
+    
+    def stock_monitor(self):
+        """Return the sales velocity window, reloading it if it is stale"""
+        if self.background_refresh and self.stock.loaded:
+            return self.stock
+        with self.cache_lock:
+            self.check_data_version()
+            if not self.stock.loaded:
+                with self.db.reader() as conn:
+                    # One snapshot, so the change marker matches the rollups that were read
+                    conn.execute("BEGIN")
+                    cursor = conn.cursor()
+                    self.stock.load(cursor)
+                    self.stock.change_id = cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM change_log").fetchone()[0]
+        return self.stock
+    
+    def price_rules(self):
+        """Return the compiled promotions and tax slabs, reloading them if they are stale"""
+        if self.background_refresh and self.pricing.loaded:
+            return self.pricing
+        with self.cache_lock:
+            self.check_data_version()
+            if not self.pricing.loaded:
+                with self.db.reader() as conn:
+                    self.pricing.load(conn.cursor())
+        return self.pricing
+    
+    def price_cart(self, now=None):
+        """Price again the cart lines whose promotions started or ended, or every line after new rules, and return those that changed"""
+        self.price_rules()
+        return self.cart.refresh(now)
+    
+    def stock_alerts(self, product_ids=None):
+        """Return low-stock alerts with reorder suggestions, for all products or only the given ones"""
+        monitor = self.stock_monitor()
+        products = self.product_cache()
+        if product_ids is None:
+            rows = list(products.products.values())
+        else:
+            rows = [product for product in map(products.get, product_ids) if product is not None]
+        with self.cache_lock:
+            return monitor.alerts(rows)
+    
+    def get_customer_by_phone(self, phone):
+        """Return (customer_id, name, phone, total_bill_cents) for a phone number, or None"""
+        return self.customer_directory().get(phone)
+    
+    def complete_customers(self, prefix):
+        """Return the customers whose phone number starts with prefix"""
+        return self.customer_directory().complete(prefix)
+    
+    def get_product(self, product_id):
+        """Return a single product row or None"""
+        return self.product_cache().get(product_id)
+    
+    def filter_products(self, category=""):
+        """Return products in a category, or all products if no category is given"""
+        return self.product_cache().filter(category)
+    
+    def products_page(self, category="", after_id=0, before_id=None, limit=PAGE_SIZE):
+        """Return a page of products ordered by id, after after_id or before before_id"""
+        conditions = []
+        params = []
+        if category:
+            conditions.append("category = ?")
+            params.append(category)
+        if before_id is not None:
+            conditions.append("product_id < ?")
+            params.append(int(before_id))
+            order = "DESC"
+        else:
+            conditions.append("product_id > ?")
+            params.append(int(after_id))
+            order = "ASC"
+        params.append(limit)
+        
+        with self.db.reader() as conn:
+            products = conn.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE {' AND '.join(conditions)} "
+                f"ORDER BY product_id {order} LIMIT ?",
+                params
+            ).fetchall()
+        if before_id is not None:
+            products.reverse()
+        return products
+    
+    def search_products(self, search_term, limit=SEARCH_LIMIT):
+        """Search products by name, category and description, best matches first"""
+        search_term = search_term.strip()
+        if not search_term:
+            return self.filter_products("")
+        
+        # Name word prefixes are answered from memory, anything else goes to the index
+        products = self.product_cache().search(search_term, limit)
+        if products:
+            return products
+        
+        # Trigram search needs at least three characters per word
+        words = [word for word in search_term.split() if len(word) >= 3]
+        with self.db.reader() as conn:
+            if self.full_text_search and words:
+                query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+                cursor = conn.execute(
+                    f"""SELECT {JOINED_PRODUCT_COLUMNS}
+                    FROM products_fts JOIN products p ON p.product_id = products_fts.rowid
+                    WHERE products_fts MATCH ?
+                    ORDER BY {SEARCH_RANK}
+                    LIMIT ?""",
+                    (query, limit)
+                )
+            else:
+                # Short terms are matched as a name prefix when full-text search is available
+                pattern = f"{search_term}%" if self.full_text_search else f"%{search_term}%"
+                cursor = conn.execute(
+                    f"SELECT {PRODUCT_COLUMNS} FROM products WHERE name LIKE ? ORDER BY name LIMIT ?",
+                    (pattern, limit)
+                )
+            return cursor.fetchall()
+    
+    @property
+    def total_items(self):
+        """Number of items in the cart"""
+        return self.cart.total_items
+    
+    @property
+    def total_amount(self):
+        """Total amount of the cart"""
+        return self.cart.total_amount
+    
+    @property
+    def total_discount(self):
+        """Promotion discounts on the cart"""
+        return self.cart.discount_cents / 100
+    
+    @property
+    def total_tax(self):
+        """Tax on the cart"""
+        return self.cart.tax_cents / 100
+    
+    def get_item(self, product_id):
+        """Return the cart line for a product, or None if it is not in the cart"""
+        return self.cart.get(product_id)
+    
+    def add_item(self, product_id, quantity):
+        """Add a quantity of a product to the cart and return the cart line"""
+        if quantity <= 0:
+            raise BillingError("Quantity must be a positive number")
+        
+        self.price_rules()
+        line = self.cart.get(product_id)
+        if line is not None:
+            return self.cart.set_quantity(product_id, line.quantity + quantity)
+        
+        product = self.get_product(product_id)
+        if product is None:
+            raise BillingError(f"Product {product_id} does not exist")
+        return self.cart.add(product, quantity)
+    
+    def get_product_by_sku(self, sku):
+        """Return the product with a SKU or barcode, or None"""
+        product = self.product_cache().get_by_sku(sku)
+        if product is not None or self.background_refresh:
+            # A cache kept current in the background already holds every SKU
+            return product
+        
+        # Not cached yet, the sku index makes this a single lookup
+        with self.db.reader() as conn:
+            row = conn.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE sku = ?", (sku,)
+            ).fetchone()
+        if row is not None:
+            with self.cache_lock:
+                self.products.put(row, sku)
+        return row
+    
+    def scan(self, code):
+        """Add a scanned SKU or barcode to the cart, "N*code" adds N of it, and return the cart line"""
+        started = time.perf_counter()
+        code = code.strip()
+        quantity = 1
+        if "*" in code:
+            count, code = code.split("*", 1)
+            code = code.strip()
+            try:
+                quantity = int(count)
+            except ValueError:
+                raise BillingError(f"Invalid quantity in scan: {count}")
+        if not code:
+            raise BillingError("Nothing scanned")
+        
+        product = self.get_product_by_sku(code)
+        if product is None:
+            raise BillingError(f"No product with code {code}")
+        line = self.add_item(product[0], quantity)
+        
+        finished = time.perf_counter()
+        self.scan_count += 1
+        self.scan_seconds += finished - started
+        self.scan_times.append(finished)
+        return line
+    
+    def scan_rate(self):
+        """Return recent scans per second, measured over the last SCAN_WINDOW scans"""
+        if len(self.scan_times) < 2:
+            return 0.0
+        elapsed = self.scan_times[-1] - self.scan_times[0]
+        return (len(self.scan_times) - 1) / elapsed if elapsed > 0 else 0.0
+    
+    def scan_ms(self):
+        """Return the average time the engine spent on a scan since the till started, in milliseconds"""
+        return self.scan_seconds / self.scan_count * 1000 if self.scan_count else 0.0
+    
+    def remove_item(self, product_id):
+        """Remove a product from the cart"""
+        return self.cart.remove(product_id)
+    
+    def clear_cart(self):
+        """Remove every line from the cart"""
+        self.cart.clear()
+    
+    def build_cart(self, lines):
+        """Return a new Cart from [{"product_id" or "sku", "quantity"}] dicts, for clients that keep their own cart"""
+        cart = Cart(self.price_rules())
+        for line in lines:
+            quantity = line.get("quantity", 1)
+            # JSON true and false are ints to Python
+            if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity <= 0:
+                raise BillingError("Quantity must be a positive number")
+            if line.get("sku"):
+                product = self.get_product_by_sku(str(line["sku"]))
+            else:
+                try:
+                    product = self.get_product(line.get("product_id"))
+                except (TypeError, ValueError):
+                    product = None
+            if product is None:
+                raise BillingError(f"No product {line.get('sku') or line.get('product_id')}")
+            cart.add(product, quantity)
+        return cart
+    
+    def generate_bill(self, customer_name, customer_phone="", payment_method="Cash", cart=None):
+        """Save the cart, or the given Cart, as a bill and return it with commit timings, queueing it if the database is unavailable"""
+        cart = self.cart if cart is None else cart
+        if not cart:
+            raise BillingError("No items in the bill to generate")
+        
+        customer_name = customer_name.strip()
+        customer_phone = normalize_phone(customer_phone)
+        if not customer_name:
+            raise BillingError("Please enter customer name")
+        
+        # Promotions are those running when the bill is made
+        now = datetime.now()
+        self.price_rules()
+        cart.reprice(now)
+        items = list(cart)
+        # The uuid lets a queued bill be replayed any number of times but written only once
+        entry = {
+            "bill_uuid": str(uuid.uuid4()),
+            "bill_date": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "customer_name": customer_name,
+            "customer_phone": customer_phone,
+            "payment_method": payment_method,
+            "lines": [
+                [
+                    item.product_id, item.name, item.category, item.price_cents, item.quantity,
+                    item.discount_cents, item.tax_cents, item.promotion_id
+                ]
+                for item in items
+            ]
+        }
+        timings = {}
+        started = time.perf_counter()
+        bill_id = customer = None
+        if self.queue is not None and len(self.queue):
+            # Already offline, keep queueing so bills reach the database in order
+            self.queue.append(entry)
+        else:
+            try:
+                # With a queue to fall back on, waiting out a long lock only keeps the customer at the till
+                bill_id, customer = self.write_bill(entry, items, timings, wait=self.queue is None)
+            except sqlite3.OperationalError as e:
+                if self.queue is None or not is_unavailable_error(e):
+                    raise
+                # Locked, slow or missing database, keep the sale on local disk for the replayer
+                self.queue.append(entry)
+                self.queue.last_error = str(e)
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        
+        # The caches are patched under the lock a background refresh swaps them under
+        with self.cache_lock:
+            # Patch the cached stock of the products that were sold
+            for item in items:
+                product = self.products.get(item.product_id)
+                if product is not None:
+                    self.products.set_stock(product[0], product[4] - item.quantity)
+            
+            if customer is not None and self.customers.loaded:
+                self.customers.put(customer)
+            
+            # Roll the sale into the velocity window instead of rescanning bill history
+            if self.stock.loaded:
+                self.stock.record(entry["bill_date"], items, entry["bill_uuid"])
+        
+        bill = {
+            "bill_id": bill_id,
+            "bill_uuid": entry["bill_uuid"],
+            "queued": bill_id is None,
+            "customer_id": customer[0] if customer else None,
+            "bill_date": entry["bill_date"],
+            "total_items": cart.total_items,
+            "total_amount": cart.total_amount,
+            "total_cents": cart.total_cents,
+            "discount_cents": cart.discount_cents,
+            "tax_cents": cart.tax_cents,
+            "lines": len(items),
+            "timings": timings
+        }
+        cart.clear()
+        return bill
+    
+    def write_bill(self, entry, items, timings, replay=False, wait=True):
+        """Write a bill in one transaction and return (bill_id, customer), filling in commit timings"""
+        started = time.perf_counter()
+        # wait=False tries the write lock once, briefly, for callers that can queue the bill instead
+        transaction = self.db.transaction() if wait else self.db.transaction(QUEUE_BUSY_TIMEOUT_MS, retries=0)
+        # The transaction takes the write lock up front so no other till can sell the same stock
+        with transaction as conn:
+            locked = time.perf_counter()
+            timings["lock_wait_ms"] = (locked - started) * 1000
+            cursor = conn.cursor()
+            
+            if replay:
+                # The bill may have been written before the till lost track of it
+                cursor.execute("SELECT bill_id FROM bills WHERE bill_uuid = ?", (entry["bill_uuid"],))
+                existing = cursor.fetchone()
+                if existing:
+                    return existing[0], None
+                # The goods have already left the shop, so stock is taken even if it goes below zero
+                cursor.executemany(
+                    "UPDATE products SET stock = stock - ? WHERE product_id = ?",
+                    [(item.quantity, item.product_id) for item in items]
+                )
+            else:
+                # Reserve stock, a line only updates if enough is left
+                cursor.executemany(
+                    "UPDATE products SET stock = stock - ? WHERE product_id = ? AND stock >= ?",
+                    [(item.quantity, item.product_id, item.quantity) for item in items]
+                )
+                if cursor.rowcount != len(items):
+                    conn.rollback()
+                    raise OutOfStockError(self.find_short_lines(items))
+            reserved = time.perf_counter()
+            timings["reserve_ms"] = (reserved - locked) * 1000
+            
+            # Add the bill to the customer's lifetime total
+            total_cents = sum(item.total_cents for item in items)
+            customer = None
+            customer_name = entry["customer_name"]
+            customer_phone = entry["customer_phone"]
+            if customer_phone:
+                customer_id, total_bill = record_purchase(cursor, customer_name, customer_phone, total_cents)
+                customer = (customer_id, customer_name, customer_phone, total_bill)
+            
+            # Save bill to database
+            cursor.execute(
+                "INSERT INTO bills (bill_uuid, customer_id, customer_name, bill_date, total_cents, payment_method) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry["bill_uuid"], customer[0] if customer else None, customer_name,
+                    entry["bill_date"], total_cents, entry["payment_method"]
+                )
+            )
+            bill_id = cursor.lastrowid
+            
+            # Save bill items
+            cursor.executemany(
+                "INSERT INTO bill_items (bill_id, product_id, quantity, price_cents, discount_cents, tax_cents, promotion_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        bill_id, item.product_id, item.quantity, item.price_cents,
+                        item.discount_cents, item.tax_cents, item.promotion_id
+                    )
+                    for item in items
+                ]
+            )
+            
+            # Keep the daily rollups in step with the bill
+            record_bill(cursor, entry["bill_date"], entry["payment_method"], total_cents, items)
+            prune_change_log(cursor)
+            written = time.perf_counter()
+            timings["write_ms"] = (written - reserved) * 1000
+        timings["commit_ms"] = (time.perf_counter() - written) * 1000
+        return bill_id, customer
+    
+    def replay_queue(self):
+        """Write queued bills to the database oldest first, stopping at the first one that still fails"""
+        if self.queue is None:
+            return 0
+        replayed = 0
+        while True:
+            entry = self.queue.peek()
+            if entry is None:
+                return replayed
+            items = [CartLine(*line) for line in entry["lines"]]
+            try:
+                bill_id, customer = self.write_bill(entry, items, {}, replay=True)
+            except sqlite3.Error as e:
+                self.queue.last_error = str(e)
+                return replayed
+            self.queue.pop()
+            replayed += 1
+            with self.cache_lock:
+                if customer is not None and self.customers.loaded:
+                    self.customers.put(customer)
+    
+    def find_short_lines(self, items):
+        """Return the cart lines that ask for more than the current stock"""
+        with self.cache_lock, self.db.reader() as conn:
+            found = self.products.refresh(conn.cursor(), [item.product_id for item in items])
+        stock = {product[0]: product for product in found}
+        short_lines = []
+        for item in items:
+            product = stock.get(item.product_id)
+            available = product[4] if product else 0
+            if item.quantity > available:
+                short_lines.append({
+                    "product_id": item.product_id,
+                    "name": item.name,
+                    "requested": item.quantity,
+                    "available": available
+                })
+        return short_lines
+    
+    def close(self):
+        """Close the database connections"""
+        self.db.close()
\ No newline at end of file
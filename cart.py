@@ -0,0 +1,164 @@
+class CartLine:
+    """One product line of a bill, priced in whole cents"""
+    
+    __slots__ = (
+        "product_id", "name", "category", "price_cents", "quantity",
+        "discount_cents", "tax_cents", "promotion_id", "total_cents", "row_id"
+    )
+    
+    def __init__(self, product_id, name, category, price_cents, quantity=0,
+                 discount_cents=0, tax_cents=0, promotion_id=None):
+        self.product_id = product_id
+        self.name = name
+        self.category = category
+        self.price_cents = int(price_cents)
+        self.quantity = quantity
+        # Set by PriceRules, the total is what the customer pays for the line
+        self.discount_cents = discount_cents
+        self.tax_cents = tax_cents
+        self.promotion_id = promotion_id
+        self.total_cents = self.price_cents * quantity - discount_cents + tax_cents
+        # Treeview item showing this line, set by the GUI
+        self.row_id = None
+    
+    @property
+    def price(self):
+        """Unit price in money units"""
+        return self.price_cents / 100
+    
+    @property
+    def total(self):
+        """Line total in money units"""
+        return self.total_cents / 100
+    
+    def as_dict(self):
+        """Return the line as a plain dict"""
+        return {
+            "product_id": self.product_id,
+            "name": self.name,
+            "category": self.category,
+            "price": self.price,
+            "quantity": self.quantity,
+            "discount": self.discount_cents / 100,
+            "tax": self.tax_cents / 100,
+            "total": self.total
+        }
+
+class Cart:
+    """Bill lines indexed by product id, with totals kept up to date by deltas"""
+    
+    def __init__(self, pricing=None):
+        # Optional PriceRules, without them every line is charged at list price
+        self.pricing = pricing
+        self.lines = {}
+        self.total_items = 0
+        self.total_cents = 0
+        self.discount_cents = 0
+        self.tax_cents = 0
+        # (rules generation, running promotion ids) when the lines were last priced together
+        self.priced = None
+    
+    @property
+    def total_amount(self):
+        """Cart total in money units"""
+        return self.total_cents / 100
+    
+    def __iter__(self):
+        return iter(self.lines.values())
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    def __bool__(self):
+        return bool(self.lines)
+    
+    def get(self, product_id):
+        """Return the line for a product, or None if it is not in the cart"""
+        return self.lines.get(int(product_id))
+    
+    def add(self, product, quantity):
+        """Add a quantity of a product row to the cart and return its line"""
+        product_id, name, category, price_cents, stock = product
+        line = self.lines.get(product_id)
+        if line is None:
+            line = self.lines[product_id] = CartLine(product_id, name, category, price_cents)
+        self.set_quantity(product_id, line.quantity + quantity)
+        return line
+    
+    def set_quantity(self, product_id, quantity):
+        """Change the quantity of a line, updating the totals by the difference"""
+        line = self.lines[int(product_id)]
+        self.total_items += quantity - line.quantity
+        line.quantity = quantity
+        self.price(line)
+        return line
+    
+    def price(self, line, clock=None):
+        """Price one line and move the cart totals by the difference"""
+        total, discount, tax = line.total_cents, line.discount_cents, line.tax_cents
+        if self.pricing is not None and self.pricing.loaded:
+            self.pricing.price_line(line, clock or self.pricing.clock())
+        else:
+            line.discount_cents = line.tax_cents = 0
+            line.promotion_id = None
+            line.total_cents = line.price_cents * line.quantity
+        self.total_cents += line.total_cents - total
+        self.discount_cents += line.discount_cents - discount
+        self.tax_cents += line.tax_cents - tax
+    
+    def reprice(self, now=None):
+        """Price every line again, for promotions that start or end while the cart is open, and return the lines that changed"""
+        clock = self.pricing.clock(now) if self.pricing is not None else None
+        if self.pricing is not None and self.pricing.loaded:
+            self.priced = (self.pricing.generation, self.pricing.active_promotions(clock))
+        return self.price_lines(self.lines.values(), clock)
+    
+    def refresh(self, now=None):
+        """Price again only the lines whose promotions started or ended since the last pricing, and return the lines that changed"""
+        if self.pricing is None or not self.pricing.loaded:
+            return []
+        clock = self.pricing.clock(now)
+        priced = (self.pricing.generation, self.pricing.active_promotions(clock))
+        if priced == self.priced:
+            return []
+        if self.priced is None or self.priced[0] != priced[0]:
+            # New rules or tax slabs can change any line
+            lines = list(self.lines.values())
+        else:
+            # Each line is priced on its own, so only lines that could take a promotion that switched are affected
+            switched = self.priced[1] ^ priced[1]
+            lines = [
+                line for line in self.lines.values()
+                if any(promotion.promotion_id in switched
+                       for promotion in self.pricing.promotions_for(line.product_id, line.category))
+            ]
+        self.priced = priced
+        return self.price_lines(lines, clock)
+    
+    def price_lines(self, lines, clock):
+        """Price the given lines and return those whose totals changed"""
+        changed = []
+        for line in lines:
+            total = line.total_cents
+            self.price(line, clock)
+            if line.total_cents != total:
+                changed.append(line)
+        return changed
+    
+    def remove(self, product_id):
+        """Remove a line from the cart and return it, or None if it was not there"""
+        line = self.lines.pop(int(product_id), None)
+        if line is not None:
+            self.total_items -= line.quantity
+            self.total_cents -= line.total_cents
+            self.discount_cents -= line.discount_cents
+            self.tax_cents -= line.tax_cents
+        return line
+    
+    def clear(self):
+        """Remove every line"""
+        self.lines = {}
+        self.total_items = 0
+        self.total_cents = 0
+        self.discount_cents = 0
+        self.tax_cents = 0
\ No newline at end of file
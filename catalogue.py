@@ -0,0 +1,231 @@
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from database import ConnectionManager, DB_FILE, create_search_triggers, drop_search_triggers
+import view_data
+
+# Rows written per transaction, other tills can commit bills between chunks
+CHUNK_SIZE = 5000
+MAX_ERRORS_SHOWN = 20
+
+# Columns an import row can change on an existing product, each only when the file has it
+UPDATABLE_COLUMNS = ["name", "category", "price_cents", "stock", "description", "sku"]
+# (match column, updated columns) -> upsert statement
+upserts = {}
+
+def upsert_sql(key, columns):
+    """Return the upsert matching on key that only overwrites the given columns"""
+    sql = upserts.get((key, columns))
+    if sql is None:
+        sql = upserts[(key, columns)] = f'''
+            INSERT INTO products (product_id, name, category, price_cents, stock, description, sku)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT({key}) DO UPDATE SET
+                {", ".join(f"{column} = excluded.{column}" for column in UPDATABLE_COLUMNS if column in columns)}
+        '''
+    return sql
+
+def file_format(path, output_format=None):
+    """Return csv or jsonl, from the option if given or else the file extension"""
+    if output_format:
+        return output_format
+    return "jsonl" if path.lower().endswith((".jsonl", ".json", ".ndjson")) else "csv"
+
+def read_rows(f, input_format):
+    """Yield (line number, dict) for each row of a CSV or JSONL file"""
+    if input_format == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f"invalid JSON: {e}")
+            continue
+        yield line_number, row if isinstance(row, dict) else ValueError("not a JSON object")
+
+def parse_cents(value):
+    """Convert a money amount such as '149.99' to whole cents"""
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"invalid price {value!r}")
+    if not amount.is_finite() or amount < 0:
+        raise ValueError(f"invalid price {value!r}")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def parse_product(row):
+    """Validate one import row and return ((product_id, name, category, price_cents, stock, description, sku), columns to update)"""
+    def text(field):
+        value = row.get(field)
+        return str(value).strip() if value is not None else ""
+    
+    name = text("name")
+    if not name:
+        raise ValueError("name is required")
+    if text("price") == "":
+        raise ValueError("price is required")
+    price_cents = parse_cents(row["price"])
+    try:
+        # A new product without a stock figure starts at 0, an existing one keeps its stock
+        stock = int(text("stock") or 0)
+    except ValueError:
+        raise ValueError(f"invalid stock {row.get('stock')!r}")
+    if stock < 0:
+        raise ValueError("stock cannot be negative")
+    product_id = text("product_id")
+    if product_id and not product_id.isdigit():
+        raise ValueError(f"invalid product_id {product_id!r}")
+    # Every CSV row has every header, so a blank cell counts as not given rather than as NULL
+    columns = frozenset(
+        ["name", "price_cents"]
+        + [field for field in ("category", "description", "stock") if text(field)]
+        + (["sku"] if product_id and text("sku") else [])
+    )
+    return (
+        int(product_id) if product_id else None,
+        name,
+        text("category") or None,
+        price_cents,
+        stock,
+        text("description") or None,
+        text("sku") or None
+    ), columns
+
+def write_chunk(db, chunk):
+    """Upsert a chunk of (line number, product, columns) in one transaction and return (line number, error) for rejected rows"""
+    # Rows with an id match on it, rows with only a SKU match on the SKU, the rest are new products.
+    # Rows are grouped by the columns their file gave, so a missing column never overwrites stored values.
+    errors = []
+    with db.transaction() as conn:
+        skus = [product[6] for line_number, product, columns in chunk if product[0] is not None and product[6]]
+        owners = dict(conn.execute(
+            "SELECT sku, product_id FROM products WHERE sku IN (SELECT value FROM json_each(?))", (json.dumps(skus),)
+        )) if skus else {}
+        groups = {}
+        for line_number, product, columns in chunk:
+            if product[0] is not None:
+                owner = owners.get(product[6])
+                if owner is not None and owner != product[0]:
+                    errors.append((line_number, f"sku {product[6]} belongs to product {owner}, not {product[0]}"))
+                    continue
+                groups.setdefault(("product_id", columns), []).append(product)
+            elif product[6]:
+                groups.setdefault(("sku", columns), []).append(product)
+            else:
+                groups.setdefault(("product_id", columns), []).append(product)
+        for (key, columns), rows in groups.items():
+            conn.executemany(upsert_sql(key, columns), rows)
+    return errors
+
+def import_products(path, input_format=None, db_file=DB_FILE, chunk_size=CHUNK_SIZE, progress=None):
+    """Stream products from a CSV or JSONL file into the catalogue and return import statistics"""
+    input_format = file_format(path, input_format)
+    stats = {"rows": 0, "imported": 0, "errors": [], "seconds": 0.0}
+    started = time.perf_counter()
+    
+    db = ConnectionManager(db_file)
+    try:
+        # Per-row search index updates are the slowest part of a big load, so they wait until the end
+        with db.transaction() as conn:
+            drop_search_triggers(conn)
+            conn.execute("DROP INDEX IF EXISTS idx_products_category")
+        try:
+            with open(path, newline="", encoding="utf-8") as f:
+                chunk = []
+                for line_number, row in read_rows(f, input_format):
+                    stats["rows"] += 1
+                    try:
+                        if isinstance(row, Exception):
+                            raise row
+                        chunk.append((line_number,) + parse_product(row))
+                    except ValueError as e:
+                        stats["errors"].append((line_number, str(e)))
+                        continue
+                    if len(chunk) >= chunk_size:
+                        errors = write_chunk(db, chunk)
+                        stats["errors"].extend(errors)
+                        stats["imported"] += len(chunk) - len(errors)
+                        chunk = []
+                        if progress:
+                            elapsed = time.perf_counter() - started
+                            progress(f"{stats['imported']} rows, {stats['imported'] / elapsed:.0f} rows/s")
+                if chunk:
+                    errors = write_chunk(db, chunk)
+                    stats["errors"].extend(errors)
+                    stats["imported"] += len(chunk) - len(errors)
+        finally:
+            if progress:
+                progress("Rebuilding indexes")
+            with db.transaction() as conn:
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE name='products_fts'").fetchone():
+                    create_search_triggers(conn)
+                    conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    finally:
+        db.close()
+    
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_sec"] = stats["imported"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+def export_products(out, output_format="csv", db_file=DB_FILE):
+    """Stream the catalogue with current stock to a CSV or JSONL file object and return export statistics"""
+    started = time.perf_counter()
+    rows = 0
+    conn = view_data.open_database(db_file)
+    try:
+        columns, batches = view_data.stream_rows(conn, "products")
+        
+        def counted():
+            nonlocal rows
+            for batch in batches:
+                rows += len(batch)
+                yield batch
+        
+        if output_format == "jsonl":
+            view_data.write_jsonl(columns, counted(), out)
+        else:
+            view_data.write_csv(columns, counted(), out)
+    finally:
+        conn.close()
+    
+    seconds = time.perf_counter() - started
+    return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import or export the product catalogue")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", help="CSV or JSONL file, - exports to the screen")
+    parser.add_argument("--format", dest="file_format", choices=["csv", "jsonl"],
+                        help="file format (default: from the file extension)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per import transaction")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args()
+    
+    try:
+        if args.command == "import":
+            stats = import_products(args.file, args.file_format, args.db, args.chunk_size, progress=print)
+            print(f"Imported {stats['imported']} of {stats['rows']} rows in {stats['seconds']:.1f}s "
+                  f"({stats['rows_per_sec']:.0f} rows/s)")
+            for line_number, message in stats["errors"][:MAX_ERRORS_SHOWN]:
+                print(f"  line {line_number}: {message}")
+            if len(stats["errors"]) > MAX_ERRORS_SHOWN:
+                print(f"  ... {len(stats['errors']) - MAX_ERRORS_SHOWN} more rejected rows")
+        elif args.file == "-":
+            export_products(sys.stdout, args.file_format or "csv", args.db)
+        else:
+            with open(args.file, "w", newline="", encoding="utf-8") as f:
+                stats = export_products(f, file_format(args.file, args.file_format), args.db)
+            print(f"Exported {stats['rows']} products in {stats['seconds']:.1f}s ({stats['rows_per_sec']:.0f} rows/s)")
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
\ No newline at end of file
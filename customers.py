@@ -0,0 +1,83 @@
+from bisect import bisect_left
+
+def normalize_phone(phone):
+    """Keep only the digits of a phone number, and a leading +"""
+    phone = (phone or "").strip()
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    return "+" + digits if phone.startswith("+") and digits else digits
+
+def record_purchase(cursor, name, phone, amount_cents):
+    """Add a bill to the customer's lifetime total, creating the customer if new, and return (customer_id, total_bill_cents)"""
+    cursor.execute(
+        '''
+        INSERT INTO customers (name, phone, total_bill_cents)
+        VALUES (?, ?, ?)
+        ON CONFLICT(phone) DO UPDATE SET
+            name = excluded.name,
+            total_bill_cents = total_bill_cents + excluded.total_bill_cents
+        RETURNING customer_id, total_bill_cents
+        ''',
+        (name, phone, amount_cents)
+    )
+    return cursor.fetchone()
+
+class CustomerDirectory:
+    """In-memory phone index of the customers table for instant lookup and autocomplete"""
+    
+    def __init__(self):
+        self.by_phone = {}
+        self.sorted_phones = []
+        self.phones_dirty = False
+        self.loaded = False
+    
+    def load(self, cursor):
+        """Load every customer, replacing the cached copy"""
+        by_phone = {}
+        cursor.execute("SELECT customer_id, name, phone, total_bill_cents FROM customers")
+        for customer in cursor:
+            by_phone[customer[2]] = customer
+        self.by_phone = by_phone
+        self.phones_dirty = True
+        self.loaded = True
+    
+    def refresh(self, cursor, customer_ids):
+        """Re-read the given customers from the database and patch them in place"""
+        customer_ids = [int(customer_id) for customer_id in customer_ids]
+        if not customer_ids:
+            return
+        placeholders = ", ".join("?" * len(customer_ids))
+        cursor.execute(
+            f"SELECT customer_id, name, phone, total_bill_cents FROM customers WHERE customer_id IN ({placeholders})",
+            customer_ids
+        )
+        # The tills only ever add customers or update their totals, phone numbers are not changed
+        for customer in cursor.fetchall():
+            self.put(customer)
+    
+    def put(self, customer):
+        """Add or replace one (customer_id, name, phone, total_bill_cents) row"""
+        if customer[2] not in self.by_phone:
+            self.phones_dirty = True
+        self.by_phone[customer[2]] = tuple(customer)
+    
+    def get(self, phone):
+        """Return the customer with this phone number, or None"""
+        return self.by_phone.get(normalize_phone(phone))
+    
+    def complete(self, prefix, limit=10):
+        """Return customers whose phone number starts with prefix"""
+        prefix = normalize_phone(prefix)
+        if not prefix:
+            return []
+        if self.phones_dirty:
+            self.sorted_phones = sorted(self.by_phone)
+            self.phones_dirty = False
+        matches = []
+        index = bisect_left(self.sorted_phones, prefix)
+        while index < len(self.sorted_phones) and len(matches) < limit:
+            phone = self.sorted_phones[index]
+            if not phone.startswith(prefix):
+                break
+            matches.append(self.by_phone[phone])
+            index += 1
+        return matches
\ No newline at end of file
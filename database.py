@@ -0,0 +1,653 @@
+import argparse
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from sql_stats import InstrumentedConnection
+
+DB_FILE = 'cloth_shop.db'
+
+# Several tills share one database file, so wait for locks instead of failing at once
+BUSY_TIMEOUT_MS = 5000
+WRITE_RETRIES = 5
+RETRY_BACKOFF = 0.05
+# A till that can queue bills tries the write lock once for this long, then queues the bill instead of waiting
+QUEUE_BUSY_TIMEOUT_MS = 200
+READER_POOL_SIZE = 4
+
+# Prices are whole cents
+PRODUCT_COLUMNS = "product_id, name, category, price_cents, stock"
+# What the customer paid for a bill_items row bi, after its promotion and with its tax
+LINE_TOTAL_SQL = "bi.quantity * bi.price_cents - bi.discount_cents + bi.tax_cents"
+
+# Rows copied per statement when a migration rebuilds a table
+COPY_BATCH_SIZE = 10000
+
+# change_log rows kept, a till further behind than this reloads its caches in full
+CHANGE_LOG_KEEP = 50000
+# Tables whose changes are logged for other processes' caches, with the key column recorded
+LOGGED_TABLES = {
+    "products": "product_id",
+    "customers": "customer_id",
+    "bills": "bill_id",
+    "promotions": "promotion_id",
+    "tax_slabs": "tax_slab_id"
+}
+
+def get_connection(db_file=DB_FILE, busy_timeout=BUSY_TIMEOUT_MS):
+    """Open a connection to the shop database and make sure the tables exist"""
+    conn = connect(db_file, busy_timeout)
+    create_database(conn)
+    return conn
+
+def connect(db_file=DB_FILE, busy_timeout=BUSY_TIMEOUT_MS):
+    """Open an instrumented connection in WAL mode with the busy timeout set"""
+    conn = sqlite3.connect(
+        db_file, timeout=busy_timeout / 1000, check_same_thread=False, factory=InstrumentedConnection
+    )
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    # WAL lets readers carry on while one till writes, NORMAL sync is safe in WAL mode
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def is_locked_error(error):
+    """Return True if a sqlite3 error means another connection holds the lock"""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+def is_unavailable_error(error):
+    """Return True if a sqlite3 error means the database cannot be written right now, rather than a bad query"""
+    message = str(error).lower()
+    return is_locked_error(error) or "disk i/o" in message or "unable to open" in message or "readonly" in message
+
+class ConnectionManager:
+    """Shared access to one store database: a pool of readers and one serialized writer"""
+    
+    def __init__(self, db_file=DB_FILE, readers=READER_POOL_SIZE, busy_timeout=BUSY_TIMEOUT_MS,
+                 retries=WRITE_RETRIES):
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+        self.retries = retries
+        self.max_readers = readers
+        
+        self.conn = get_connection(db_file, busy_timeout)
+        self.writer_lock = threading.RLock()
+        
+        self.readers = LifoQueue()
+        self.readers_open = 0
+        self.readers_lock = threading.Lock()
+        
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "transactions": 0,
+            "lock_waits": 0,
+            "lock_wait_ms": 0.0,
+            "max_lock_wait_ms": 0.0,
+            "retries": 0,
+            "failures": 0
+        }
+    
+    @contextmanager
+    def reader(self):
+        """Borrow a read connection from the pool"""
+        try:
+            conn = self.readers.get_nowait()
+        except Empty:
+            conn = None
+            with self.readers_lock:
+                if self.readers_open < self.max_readers:
+                    self.readers_open += 1
+                    conn = connect(self.db_file, self.busy_timeout)
+            if conn is None:
+                conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.readers.put(conn)
+    
+    @contextmanager
+    def transaction(self, busy_timeout=None, retries=None):
+        """Run a write transaction on the writer, retrying with backoff while the database is locked"""
+        retries = self.retries if retries is None else retries
+        started = time.perf_counter()
+        with self.writer_lock:
+            if busy_timeout is not None:
+                self.conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+            attempt = 0
+            try:
+                while True:
+                    try:
+                        self.conn.execute("BEGIN IMMEDIATE")
+                        break
+                    except sqlite3.OperationalError as e:
+                        if not is_locked_error(e) or attempt >= retries:
+                            self.record_wait(started, attempt, failed=True)
+                            raise
+                        attempt += 1
+                        time.sleep(RETRY_BACKOFF * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+            finally:
+                # In WAL mode only taking the write lock waits, the rest of the transaction runs with the usual timeout
+                if busy_timeout is not None:
+                    self.conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+            self.record_wait(started, attempt)
+            
+            try:
+                yield self.conn
+            except BaseException:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
+            else:
+                self.conn.commit()
+    
+    def record_wait(self, started, retries, failed=False):
+        """Add one lock acquisition to the lock-wait statistics"""
+        waited = (time.perf_counter() - started) * 1000
+        with self.stats_lock:
+            self.stats["transactions"] += 1
+            self.stats["retries"] += retries
+            self.stats["lock_wait_ms"] += waited
+            self.stats["max_lock_wait_ms"] = max(self.stats["max_lock_wait_ms"], waited)
+            # Anything over a millisecond means another writer held the lock
+            if waited >= 1 or retries:
+                self.stats["lock_waits"] += 1
+            if failed:
+                self.stats["failures"] += 1
+    
+    def lock_stats(self):
+        """Return a copy of the lock-wait statistics"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["avg_lock_wait_ms"] = stats["lock_wait_ms"] / stats["transactions"] if stats["transactions"] else 0.0
+        return stats
+    
+    def close(self):
+        """Close the writer and every pooled reader"""
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except Empty:
+                break
+        self.conn.close()
+
+def schema_version(conn):
+    """Return the schema version recorded in the database, 0 if it has none"""
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+def create_database(conn, progress=None):
+    """Create a new database or migrate an existing one to SCHEMA_VERSION, reporting steps to progress"""
+    # Up to date databases skip the schema checks, which keeps till startup fast
+    version = schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(f"Database schema version {version} is newer than this program supports")
+    
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    conn.commit()
+    
+    # Each migration is one transaction, so a failed or interrupted step leaves the previous version intact
+    for number, description, migration in MIGRATIONS:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Another till may have migrated while this one waited for the lock
+            if schema_version(conn) < number:
+                if progress:
+                    progress(f"Migrating to version {number}: {description}")
+                migration(conn, progress)
+                cursor.execute("DELETE FROM schema_version")
+                cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (number,))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def create_base_schema(conn, progress=None):
+    """Create the original tables, indexes and sample products if they don't exist"""
+    cursor = conn.cursor()
+    
+    # Create products table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT,
+            price REAL NOT NULL,
+            stock INTEGER NOT NULL,
+            description TEXT,
+            sku TEXT
+        )
+    ''')
+    
+    # Databases created before scan mode have no sku column yet
+    cursor.execute("PRAGMA table_info(products)")
+    if "sku" not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE products ADD COLUMN sku TEXT")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku)")
+    
+    # Create customers table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            total_bill REAL DEFAULT 0.0,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create bills table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bills (
+            bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_name TEXT,
+            customer_phone TEXT,
+            bill_date TEXT,
+            total_amount REAL,
+            payment_method TEXT
+        )
+    ''')
+    
+    # Create bill_items table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bill_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bill_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER,
+            price REAL,
+            FOREIGN KEY(bill_id) REFERENCES bills(bill_id),
+            FOREIGN KEY(product_id) REFERENCES products(product_id)
+        )
+    ''')
+    
+    # Insert some sample products if table is empty
+    cursor.execute("SELECT COUNT(*) FROM products")
+    if cursor.fetchone()[0] == 0:
+        sample_products = [
+            ("Cotton T-Shirt", "T-Shirt", 149.99, 50, "100% Cotton, Regular Fit", "TS-0001"),
+            ("Denim Jeans", "Pants", 290.99, 30, "Slim Fit, Stretch Denim", "PT-0001"),
+            ("Summer Dress", "Dress", 249.99, 25, "Floral Print, Lightweight", "DR-0001"),
+            ("Formal Shirt", "Shirt", 199.99, 40, "Office Wear, Iron-Free", "SH-0001"),
+            ("Sports Shorts", "Shorts", 140.99, 35, "Quick Dry, Elastic Waist", "SO-0001")
+        ]
+        cursor.executemany(
+            "INSERT INTO products (name, category, price, stock, description, sku) VALUES (?, ?, ?, ?, ?, ?)",
+            sample_products
+        )
+    
+    create_search_index(conn)
+    create_summary_tables(conn)
+    create_customer_index(conn)
+
+def strip_phone_sql(column):
+    """Return an SQL expression for a phone column without the usual separators"""
+    return f"replace(replace(replace(replace(replace(trim({column}), ' ', ''), '-', ''), '(', ''), ')', ''), '.', '')"
+
+def create_customer_index(conn):
+    """Merge customers that share a phone number and make phone unique"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name='idx_customers_phone'")
+    if cursor.fetchone():
+        return
+    
+    # Strip the usual separators so the same number is always stored the same way
+    cursor.execute(f"UPDATE customers SET phone = {strip_phone_sql('phone')}")
+    
+    # Keep the oldest record for each phone and fold the others' totals into it
+    cursor.execute('''
+        UPDATE customers SET total_bill = (
+            SELECT SUM(c.total_bill) FROM customers c WHERE c.phone = customers.phone
+        )
+        WHERE customer_id IN (SELECT MIN(customer_id) FROM customers GROUP BY phone HAVING COUNT(*) > 1)
+    ''')
+    cursor.execute('''
+        DELETE FROM customers
+        WHERE customer_id NOT IN (SELECT MIN(customer_id) FROM customers GROUP BY phone)
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX idx_customers_phone ON customers(phone)")
+
+def create_summary_tables(conn):
+    """Create the daily sales rollup tables and the bill date index"""
+    cursor = conn.cursor()
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bills_bill_date ON bills(bill_date)")
+    
+    # Daily totals per product
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_product_sales (
+            sale_date TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (sale_date, product_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Daily totals per category
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_category_sales (
+            sale_date TEXT NOT NULL,
+            category TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (sale_date, category)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Daily totals per payment method
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_payment_sales (
+            sale_date TEXT NOT NULL,
+            payment_method TEXT NOT NULL,
+            bills INTEGER NOT NULL DEFAULT 0,
+            amount REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (sale_date, payment_method)
+        ) WITHOUT ROWID
+    ''')
+
+def create_search_index(conn):
+    """Create the category index and the full-text product search table"""
+    cursor = conn.cursor()
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
+    
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name='products_fts'")
+    if cursor.fetchone():
+        return True
+    
+    # Trigram tokenizer lets a search term match anywhere inside a word
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE products_fts USING fts5(
+                name, category, description,
+                content='products', content_rowid='product_id',
+                tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5 or trigram support, search falls back to LIKE
+        return False
+    
+    create_search_triggers(conn)
+    cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    return True
+
+def create_search_triggers(conn):
+    """Create the triggers that keep products_fts in step with products"""
+    # One statement each so this can run inside a migration
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name, category, description)
+            VALUES (new.product_id, new.name, new.category, new.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, category, description)
+            VALUES ('delete', old.product_id, old.name, old.category, old.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category, description ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, category, description)
+            VALUES ('delete', old.product_id, old.name, old.category, old.description);
+            INSERT INTO products_fts(rowid, name, category, description)
+            VALUES (new.product_id, new.name, new.category, new.description);
+        END
+    ''')
+
+def drop_search_triggers(conn):
+    """Drop the products_fts triggers, for bulk loads that rebuild the search table afterwards"""
+    cursor = conn.cursor()
+    for trigger in ["products_fts_insert", "products_fts_delete", "products_fts_update"]:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+def copy_table(conn, table, create_sql, select_sql, key, progress=None, batch_size=COPY_BATCH_SIZE):
+    """Replace a table with a new definition, copying rows across in batches of key order"""
+    # create_sql creates {table}, select_sql reads the old rows and filters them with {batch}
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+    cursor.execute(create_sql.format(table=f"{table}_new"))
+    
+    total = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    # Every batch_size-th key ends a batch, the last batch takes whatever is left
+    bounds = [row[0] for row in cursor.execute(
+        f"SELECT {key} FROM (SELECT {key}, row_number() OVER (ORDER BY {key}) AS n FROM {table}) WHERE n % ? = 0",
+        (batch_size,)
+    )]
+    
+    copied = 0
+    lower = None
+    for upper in bounds + [None]:
+        conditions = []
+        params = []
+        if lower is not None:
+            conditions.append(f"{key} > ?")
+            params.append(lower)
+        if upper is not None:
+            conditions.append(f"{key} <= ?")
+            params.append(upper)
+        cursor.execute(
+            f"INSERT INTO {table}_new " + select_sql.format(batch=" AND ".join(conditions) or "1"),
+            params
+        )
+        copied += cursor.rowcount
+        lower = upper
+        if progress:
+            progress(f"  {table}: {copied}/{total} rows")
+    
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def cents_sql(column):
+    """Return an SQL expression converting a money column to whole cents"""
+    return f"CAST(round(COALESCE({column}, 0) * 100) AS INTEGER)"
+
+def migrate_integer_money(conn, progress=None):
+    """Store money as integer cents, link bills to customers by id and index the foreign keys"""
+    cursor = conn.cursor()
+    
+    copy_table(conn, "products", '''
+        CREATE TABLE {table} (
+            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT,
+            price_cents INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            description TEXT,
+            sku TEXT
+        )
+    ''', f'''
+        SELECT product_id, name, category, {cents_sql('price')}, stock, description, sku
+        FROM products WHERE {{batch}}
+    ''', "product_id", progress)
+    
+    # Bills with a phone but no customer record get one, so no phone number is lost below
+    cursor.execute(f'''
+        INSERT INTO customers (name, phone, total_bill)
+        SELECT name, phone, total FROM (
+            SELECT COALESCE(customer_name, '') AS name, {strip_phone_sql('customer_phone')} AS phone,
+                SUM(total_amount) AS total, MAX(bill_id)
+            FROM bills
+            WHERE COALESCE(customer_phone, '') != ''
+            GROUP BY 2
+        )
+        WHERE phone != '' AND phone NOT IN (SELECT phone FROM customers)
+    ''')
+    
+    copy_table(conn, "customers", '''
+        CREATE TABLE {table} (
+            customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            total_bill_cents INTEGER NOT NULL DEFAULT 0,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''', f'''
+        SELECT customer_id, name, phone, {cents_sql('total_bill')}, date
+        FROM customers WHERE {{batch}}
+    ''', "customer_id", progress)
+    
+    # The phone moves to the customer record, the bill keeps the name printed on it for walk-in customers
+    copy_table(conn, "bills", '''
+        CREATE TABLE {table} (
+            bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER REFERENCES customers(customer_id),
+            customer_name TEXT,
+            bill_date TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            payment_method TEXT
+        )
+    ''', f'''
+        SELECT b.bill_id, c.customer_id, b.customer_name, COALESCE(b.bill_date, ''),
+            {cents_sql('b.total_amount')}, b.payment_method
+        FROM bills b
+        LEFT JOIN customers c
+            ON COALESCE(b.customer_phone, '') != '' AND c.phone = {strip_phone_sql('b.customer_phone')}
+        WHERE {{batch}}
+    ''', "bill_id", progress)
+    
+    copy_table(conn, "bill_items", '''
+        CREATE TABLE {table} (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bill_id INTEGER NOT NULL REFERENCES bills(bill_id),
+            product_id INTEGER NOT NULL REFERENCES products(product_id),
+            quantity INTEGER NOT NULL,
+            price_cents INTEGER NOT NULL
+        )
+    ''', f'''
+        SELECT item_id, bill_id, product_id, quantity, {cents_sql('price')}
+        FROM bill_items WHERE {{batch}}
+    ''', "item_id", progress)
+    
+    for table, column, count in [
+        ("daily_product_sales", "product_id INTEGER", "quantity"),
+        ("daily_category_sales", "category TEXT", "quantity"),
+        ("daily_payment_sales", "payment_method TEXT", "bills")
+    ]:
+        name = column.split()[0]
+        copy_table(conn, table, f'''
+            CREATE TABLE {{table}} (
+                sale_date TEXT NOT NULL,
+                {column} NOT NULL,
+                {count} INTEGER NOT NULL DEFAULT 0,
+                amount_cents INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (sale_date, {name})
+            ) WITHOUT ROWID
+        ''', f'''
+            SELECT sale_date, {name}, {count}, {cents_sql('amount')}
+            FROM {table} WHERE {{batch}}
+        ''', "sale_date", progress)
+    
+    # Indexes went with the old tables, joins and date ranges need them back
+    if progress:
+        progress("  rebuilding indexes")
+    cursor.execute("CREATE UNIQUE INDEX idx_products_sku ON products(sku)")
+    cursor.execute("CREATE UNIQUE INDEX idx_customers_phone ON customers(phone)")
+    cursor.execute("CREATE INDEX idx_bills_bill_date ON bills(bill_date)")
+    cursor.execute("CREATE INDEX idx_bills_customer_id ON bills(customer_id)")
+    cursor.execute("CREATE INDEX idx_bill_items_bill_id ON bill_items(bill_id)")
+    cursor.execute("CREATE INDEX idx_bill_items_product_id ON bill_items(product_id)")
+    cursor.execute("DROP TABLE IF EXISTS products_fts")
+    create_search_index(conn)
+
+def add_bill_uuid(conn, progress=None):
+    """Give bills a unique client-generated id so queued bills are written only once"""
+    cursor = conn.cursor()
+    cursor.execute("ALTER TABLE bills ADD COLUMN bill_uuid TEXT")
+    cursor.execute("CREATE UNIQUE INDEX idx_bills_bill_uuid ON bills(bill_uuid)")
+
+def add_pricing_rules(conn, progress=None):
+    """Add promotion and tax slab tables, and the discount and tax applied to each bill line"""
+    cursor = conn.cursor()
+    
+    # Rates are basis points, 1250 is 12.5%; dates and times are local like bill_date
+    cursor.execute('''
+        CREATE TABLE promotions (
+            promotion_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            product_id INTEGER REFERENCES products(product_id),
+            category TEXT,
+            discount_bp INTEGER NOT NULL DEFAULT 0,
+            buy_quantity INTEGER NOT NULL DEFAULT 0,
+            free_quantity INTEGER NOT NULL DEFAULT 0,
+            starts_at TEXT,
+            ends_at TEXT,
+            daily_start TEXT,
+            daily_end TEXT,
+            active INTEGER NOT NULL DEFAULT 1
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE tax_slabs (
+            tax_slab_id INTEGER PRIMARY KEY,
+            category TEXT,
+            min_price_cents INTEGER NOT NULL DEFAULT 0,
+            rate_bp INTEGER NOT NULL
+        )
+    ''')
+    
+    cursor.execute("ALTER TABLE bill_items ADD COLUMN discount_cents INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE bill_items ADD COLUMN tax_cents INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE bill_items ADD COLUMN promotion_id INTEGER REFERENCES promotions(promotion_id)")
+
+def add_change_log(conn, progress=None):
+    """Log changed row ids so other processes can refresh their caches without reloading them"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE change_log (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL
+        )
+    ''')
+    for table, key in LOGGED_TABLES.items():
+        # Bills are only ever added by the tills, archiving deletes are of no interest to the caches
+        events = ["INSERT"] if table == "bills" else ["INSERT", "UPDATE", "DELETE"]
+        for event in events:
+            row = "old" if event == "DELETE" else "new"
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_change_{event.lower()} AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (table_name, row_id) VALUES ('{table}', {row}.{key});
+                END
+            ''')
+
+def prune_change_log(cursor, keep=CHANGE_LOG_KEEP):
+    """Drop all but the newest change_log rows"""
+    cursor.execute(
+        "DELETE FROM change_log WHERE change_id <= (SELECT MAX(change_id) FROM change_log) - ?", (keep,)
+    )
+
+# (version, description, function) in order, each function runs inside its own transaction
+MIGRATIONS = [
+    (1, "base schema", create_base_schema),
+    (2, "integer cents money, customer ids on bills, foreign key indexes", migrate_integer_money),
+    (3, "bill uuids for replaying queued bills", add_bill_uuid),
+    (4, "promotions, tax slabs and per-line discounts", add_pricing_rules),
+    (5, "change log for refreshing caches in place", add_change_log)
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or migrate the shop database")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    conn = connect(args.db)
+    print(f"{args.db}: schema version {schema_version(conn)}")
+    create_database(conn, progress=print)
+    print(f"{args.db}: schema version {schema_version(conn)} ({time.perf_counter() - started:.1f}s)")
+    conn.close()
\ No newline at end of file
@@ -1,24 +1,50 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, PhotoImage
-import sqlite3
 from datetime import datetime
 import os
+import time
+from billing_engine import BillingEngine, BillingError, OutOfStockError, PAGE_SIZE
+from tk_worker import TkWorker
+from bill_queue import BillQueue, BillReplayer
+from receipts import save_receipt
+from sql_stats import enable_slow_log, query_stats
+
+# Most product rows kept in the treeview at once while paging through the catalogue
+PRODUCT_WINDOW_SIZE = PAGE_SIZE * 3
+
+# How often other tills' changes are picked up in the background
+CACHE_REFRESH_MS = 2000
+
+# Category button images, decoded after the window is first drawn
+CATEGORY_IMAGES = {"T-Shirt": "tshirt.png", "Pants": "pants.png", "Dress": "dress.png"}
 
 class ClothShopBillingSystem:
     def __init__(self, root):
+        self.started = time.perf_counter()
+        self.startup_times = {}
         self.root = root
         self.root.title("FashionFabric Billing System")
         self.root.geometry("1200x700")
         self.root.configure(bg="#f0f8ff")
         
-        # Create database and tables if they don't exist
-        self.create_database()
-        
-        # Load images (placeholder paths - replace with your actual image paths)
-        self.logo_img = PhotoImage(file="logo.png").subsample(2, 2) if os.path.exists("logo.png") else None
-        self.tshirt_img = PhotoImage(file="tshirt.png").subsample(4, 4) if os.path.exists("tshirt.png") else None
-        self.pants_img = PhotoImage(file="pants.png").subsample(4, 4) if os.path.exists("pants.png") else None
-        self.dress_img = PhotoImage(file="dress.png").subsample(4, 4) if os.path.exists("dress.png") else None
+        # Billing engine owns the database connection and the cart
+        # Bills the database cannot take right now wait in a local queue until the replayer writes them
+        # The Tk thread only reads loaded caches, the worker checks for changes and reloads them
+        self.engine = BillingEngine(queue=BillQueue(), background_refresh=True)
+        self.replayer = BillReplayer(self.engine)
+        self.replayer.start()
+        
+        # Database calls run in the background so the till stays responsive
+        self.worker = TkWorker(self.root)
+        self.product_request = 0
+        self.cache_refresh = None
+        # Cart actions wait for the first background load, so the Tk thread never loads a cache itself
+        self.caches_ready = False
+        self.bill_pending = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Images are decoded once the window is up (placeholder paths - replace with your actual image paths)
+        self.images = {}
         
         # Create UI elements
         self.create_header()
@@ -26,147 +52,106 @@ class ClothShopBillingSystem:
         self.create_bill_section()
         self.create_customer_section()
         self.create_buttons()
+        self.scan_entry.focus()
         
-        # Initialize variables
-        self.total_items = 0
-        self.total_amount = 0.0
-        self.current_bill_items = []
-    
-    def create_database(self):
-        """Create database and tables if they don't exist"""
-        self.conn = sqlite3.connect('cloth_shop.db')
-        self.cursor = self.conn.cursor()
-        
-        # Create products table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                product_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                category TEXT,
-                price REAL NOT NULL,
-                stock INTEGER NOT NULL,
-                description TEXT
-            )
-        ''')
-        
-        # Create customers table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                total_bill REAL DEFAULT 0.0,
-                date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create bills table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bills (
-                bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_name TEXT,
-                customer_phone TEXT,
-                bill_date TEXT,
-                total_amount REAL,
-                payment_method TEXT
-            )
-        ''')
-        
-        # Create bill_items table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bill_items (
-                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                bill_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER,
-                price REAL,
-                FOREIGN KEY(bill_id) REFERENCES bills(bill_id),
-                FOREIGN KEY(product_id) REFERENCES products(product_id)
-            )
-        ''')
-        
-        # Insert some sample products if table is empty
-        self.cursor.execute("SELECT COUNT(*) FROM products")
-        if self.cursor.fetchone()[0] == 0:
-            sample_products = [
-                ("Cotton T-Shirt", "T-Shirt", 149.99, 50, "100% Cotton, Regular Fit"),
-                ("Denim Jeans", "Pants", 290.99, 30, "Slim Fit, Stretch Denim"),
-                ("Summer Dress", "Dress", 249.99, 25, "Floral Print, Lightweight"),
-                ("Formal Shirt", "Shirt", 199.99, 40, "Office Wear, Iron-Free"),
-                ("Sports Shorts", "Shorts", 140.99, 35, "Quick Dry, Elastic Waist")
-            ]
-            self.cursor.executemany(
-                "INSERT INTO products (name, category, price, stock, description) VALUES (?, ?, ?, ?, ?)",
-                sample_products
-            )
-            self.conn.commit()
+        self.update_clock()
         
-        self.conn.commit()
+        # Images and products load after the first frame so the window appears at once
+        self.root.after_idle(self.finish_startup)
+        self.startup_times["init_ms"] = (time.perf_counter() - self.started) * 1000
     
-    def save_customer(self, name, phone, total_bill):
-        """Save customer information to the database"""
-        try:
-            self.cursor.execute('''
-                INSERT INTO customers (name, phone, total_bill)
-                VALUES (?, ?, ?)
-            ''', (name, phone, total_bill))
-            self.conn.commit()
-            return True
-        except sqlite3.Error as e:
-            messagebox.showerror("Error", f"Failed to save customer: {str(e)}")
-            return False
-    
-    def get_customer_by_phone(self, phone):
-        """Retrieve customer information by phone number"""
-        try:
-            self.cursor.execute('''
-                SELECT * FROM customers WHERE phone = ?
-            ''', (phone,))
-            return self.cursor.fetchone()
-        except sqlite3.Error as e:
-            messagebox.showerror("Error", f"Failed to retrieve customer: {str(e)}")
-            return None
-    
-    def update_customer_bill(self, phone, total_bill):
-        """Update customer's total bill"""
-        try:
-            self.cursor.execute('''
-                UPDATE customers 
-                SET total_bill = total_bill + ?
-                WHERE phone = ?
-            ''', (total_bill, phone))
-            self.conn.commit()
-            return True
-        except sqlite3.Error as e:
-            messagebox.showerror("Error", f"Failed to update customer bill: {str(e)}")
-            return False
+    def load_image(self, path, factor):
+        """Decode and shrink an image the first time it is needed, None if the file is missing"""
+        if path not in self.images:
+            self.images[path] = PhotoImage(file=path).subsample(factor, factor) if os.path.exists(path) else None
+        return self.images[path]
+    
+    def finish_startup(self):
+        """Draw the first frame, then decode images and load the product list"""
+        self.root.update_idletasks()
+        self.startup_times["first_frame_ms"] = (time.perf_counter() - self.started) * 1000
+        
+        logo = self.load_image("logo.png", 2)
+        if logo:
+            self.logo_label.config(image=logo)
+            self.logo_label.pack(side=tk.LEFT, padx=20, before=self.title_label)
+        for category, button in self.category_buttons.items():
+            image = self.load_image(CATEGORY_IMAGES[category], 4)
+            if image:
+                button.config(image=image, compound=tk.TOP)
+        
+        self.refresh_caches()
+        self.filter_products("")
+    
+    def refresh_caches(self):
+        """Load the caches and apply other tills' changes on the worker, then check again in a while"""
+        if self.cache_refresh is None or self.cache_refresh.done():
+            self.cache_refresh = self.worker.submit(
+                self.engine.refresh_caches,
+                on_done=self.caches_refreshed,
+                on_error=lambda error: self.status_label.config(text=f"Could not refresh products: {error}")
+            )
+        self.root.after(CACHE_REFRESH_MS, self.refresh_caches)
+    
+    def caches_refreshed(self, result=None):
+        """Allow cart actions once the caches have been loaded"""
+        if not self.caches_ready:
+            self.caches_ready = True
+            self.scan_status.config(text="", fg="black")
+    
+    def report_startup(self):
+        """Record how long the till took to become usable and show it in the status bar"""
+        self.startup_times["ready_ms"] = (time.perf_counter() - self.started) * 1000
+        self.status_label.config(text=f"Ready in {self.startup_times['ready_ms']:.0f} ms")
+    
+    def on_close(self):
+        """Let a bill that is being saved finish before closing the window"""
+        self.worker.shutdown()
+        self.replayer.stop()
+        self.engine.close()
+        self.root.destroy()
     
     def create_header(self):
         """Create the header section with logo and title"""
         header_frame = tk.Frame(self.root, bg="#4682b4", height=100)
         header_frame.pack(fill=tk.X, padx=10, pady=10)
         
-        if self.logo_img:
-            logo_label = tk.Label(header_frame, image=self.logo_img, bg="#4682b4")
-            logo_label.pack(side=tk.LEFT, padx=20)
+        # Packed in front of the title once the logo has been decoded
+        self.logo_label = tk.Label(header_frame, bg="#4682b4")
         
-        title_label = tk.Label(
+        self.title_label = tk.Label(
             header_frame, 
             text="FashionFabric Billing System", 
             font=("Arial", 24, "bold"), 
             fg="white", 
             bg="#4682b4"
         )
-        title_label.pack(side=tk.LEFT, padx=10)
+        self.title_label.pack(side=tk.LEFT, padx=10)
         
-        date_label = tk.Label(
+        self.date_label = tk.Label(
             header_frame, 
             text=datetime.now().strftime("%d/%m/%Y %H:%M"), 
             font=("Arial", 12), 
             fg="white", 
             bg="#4682b4"
         )
-        date_label.pack(side=tk.RIGHT, padx=20)
+        self.date_label.pack(side=tk.RIGHT, padx=20)
+    
+    def update_clock(self):
+        """Refresh the header clock every second"""
+        self.date_label.config(text=datetime.now().strftime("%d/%m/%Y %H:%M"))
+        self.update_queue_status()
+        self.root.after(1000, self.update_clock)
+    
+    def update_queue_status(self):
+        """Show how many bills are waiting for the database and how long the oldest has waited"""
+        status = self.engine.queue.status()
+        if status["backlog"]:
+            self.queue_label.config(
+                text=f"Offline: {status['backlog']} bills waiting, oldest {status['lag_seconds']:.0f}s"
+            )
+        else:
+            self.queue_label.config(text="")
     
     def create_product_section(self):
         """Create the product selection section"""
@@ -185,21 +170,23 @@ class ClothShopBillingSystem:
         categories_frame.pack(fill=tk.X, pady=5)
         
         category_buttons = [
-            ("T-Shirts", self.tshirt_img, "T-Shirt"),
-            ("Pants", self.pants_img, "Pants"),
-            ("Dresses", self.dress_img, "Dress"),
-            ("All Products", None, "")
+            ("T-Shirts", "T-Shirt"),
+            ("Pants", "Pants"),
+            ("Dresses", "Dress"),
+            ("All Products", "")
         ]
         
-        for text, img, category in category_buttons:
+        self.category_buttons = {}
+        for text, category in category_buttons:
             btn = ttk.Button(
                 categories_frame,
                 text=text,
-                image=img,
-                compound=tk.TOP if img else tk.LEFT,
+                compound=tk.LEFT,
                 command=lambda c=category: self.filter_products(c)
             )
             btn.pack(side=tk.LEFT, padx=5, ipadx=10, ipady=5)
+            if category in CATEGORY_IMAGES:
+                self.category_buttons[category] = btn
         
         # Product search
         search_frame = tk.Frame(product_frame, bg="#f0f8ff")
@@ -208,13 +195,31 @@ class ClothShopBillingSystem:
         tk.Label(search_frame, text="Search:", bg="#f0f8ff").pack(side=tk.LEFT)
         self.search_entry = ttk.Entry(search_frame, width=30)
         self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind("<Return>", lambda e: self.search_products())
         ttk.Button(
             search_frame, 
             text="Search", 
             command=self.search_products
         ).pack(side=tk.LEFT, padx=5)
         
-        # Product treeview
+        # Scan entry, a barcode scanner types the code and presses Return
+        tk.Label(search_frame, text="Scan:", bg="#f0f8ff").pack(side=tk.LEFT, padx=(20, 0))
+        self.scan_entry = ttk.Entry(search_frame, width=20)
+        self.scan_entry.pack(side=tk.LEFT, padx=5)
+        self.scan_entry.bind("<Return>", lambda e: self.scan_item())
+        self.scan_status = tk.Label(search_frame, text="", bg="#f0f8ff")
+        self.scan_status.pack(side=tk.LEFT, padx=5)
+        
+        # Product treeview, rows tracked by product id so updates only touch changed rows
+        self.product_rows = {}
+        self.product_values = {}
+        self.product_order = []
+        
+        # Paging state for category and "All Products" views
+        self.paging_category = None
+        self.has_previous_page = False
+        self.has_next_page = False
+        self.loading_page = False
         self.product_tree = ttk.Treeview(
             product_frame,
             columns=("id", "name", "category", "price", "stock"),
@@ -236,13 +241,10 @@ class ClothShopBillingSystem:
         
         self.product_tree.pack(fill=tk.BOTH, expand=True)
         
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(self.product_tree, orient="vertical", command=self.product_tree.yview)
-        self.product_tree.configure(yscrollcommand=scrollbar.set)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # Populate products
-        self.filter_products("")
+        # Add scrollbar, scrolling near either end of the window loads the next page
+        self.product_scrollbar = ttk.Scrollbar(self.product_tree, orient="vertical", command=self.product_tree.yview)
+        self.product_tree.configure(yscrollcommand=self.on_product_scroll)
+        self.product_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # Bind double click to add product to bill
         self.product_tree.bind("<Double-1>", self.add_to_bill)
@@ -314,6 +316,16 @@ class ClothShopBillingSystem:
             bg="#f0f8ff"
         )
         self.total_amount_label.pack(side=tk.LEFT, padx=5)
+        
+        # Promotion savings and tax included in the total
+        self.discount_label = tk.Label(
+            summary_frame,
+            text="",
+            font=("Arial", 10),
+            bg="#f0f8ff",
+            fg="green"
+        )
+        self.discount_label.pack(side=tk.LEFT, padx=(20, 5))
     
     def create_customer_section(self):
         """Create customer details section"""
@@ -335,8 +347,13 @@ class ClothShopBillingSystem:
             bg="#f0f8ff"
         ).grid(row=0, column=2, padx=5, pady=5, sticky=tk.E)
         
-        self.customer_phone = ttk.Entry(customer_frame, width=20)
+        # The drop-down lists known customers whose number starts with what has been typed
+        self.customer_phone = ttk.Combobox(customer_frame, width=20)
         self.customer_phone.grid(row=0, column=3, padx=5, pady=5)
+        self.customer_phone.bind("<KeyRelease>", self.autocomplete_customer)
+        self.customer_phone.bind("<<ComboboxSelected>>", self.select_customer)
+        self.customer_matches = {}
+        self.autofilled_name = ""
         
         tk.Label(
             customer_frame, 
@@ -352,71 +369,251 @@ class ClothShopBillingSystem:
         self.payment_method.grid(row=0, column=5, padx=5, pady=5)
         self.payment_method.current(0)
     
+    def autocomplete_customer(self, event=None):
+        """List the customers whose phone number starts with what was typed, and fill in the name of an exact match"""
+        if not self.caches_ready:
+            return
+        phone = self.customer_phone.get()
+        self.customer_matches = {
+            f"{customer[2]}  {customer[1]}": customer for customer in self.engine.complete_customers(phone)
+        }
+        self.customer_phone.configure(values=list(self.customer_matches))
+        self.fill_customer_name(self.engine.get_customer_by_phone(phone))
+    
+    def select_customer(self, event=None):
+        """Replace a chosen drop-down entry with the customer's phone number and name"""
+        customer = self.customer_matches.get(self.customer_phone.get())
+        if customer is None:
+            return
+        self.customer_phone.delete(0, tk.END)
+        self.customer_phone.insert(0, customer[2])
+        self.fill_customer_name(customer)
+    
+    def fill_customer_name(self, customer):
+        """Show a known customer's name, or clear a name filled in earlier"""
+        current_name = self.customer_name.get().strip()
+        
+        # Never overwrite a name the cashier typed
+        if current_name and current_name != self.autofilled_name:
+            return
+        name = customer[1] if customer else ""
+        if name != current_name:
+            self.customer_name.delete(0, tk.END)
+            self.customer_name.insert(0, name)
+        self.autofilled_name = name
+    
     def create_buttons(self):
         """Create action buttons"""
         button_frame = tk.Frame(self.root, bg="#f0f8ff")
         button_frame.pack(fill=tk.X, padx=10, pady=10)
         
-        ttk.Button(
-            button_frame, 
-            text="Add to Bill", 
-            command=self.add_to_bill
-        ).pack(side=tk.LEFT, padx=5, ipadx=10, ipady=5)
-        
-        ttk.Button(
+        # Cart buttons are disabled while a bill is being saved
+        self.cart_buttons = []
+        for text, command in [
+            ("Add to Bill", self.add_to_bill),
+            ("Remove Item", self.remove_from_bill),
+            ("Clear Bill", self.clear_bill)
+        ]:
+            button = ttk.Button(button_frame, text=text, command=command)
+            button.pack(side=tk.LEFT, padx=5, ipadx=10, ipady=5)
+            self.cart_buttons.append(button)
+        
+        self.generate_button = ttk.Button(
             button_frame, 
-            text="Remove Item", 
-            command=self.remove_from_bill
-        ).pack(side=tk.LEFT, padx=5, ipadx=10, ipady=5)
+            text="Generate Bill", 
+            command=self.generate_bill,
+            style="Accent.TButton"
+        )
+        self.generate_button.pack(side=tk.RIGHT, padx=5, ipadx=10, ipady=5)
+        self.cart_buttons.append(self.generate_button)
         
         ttk.Button(
-            button_frame, 
-            text="Clear Bill", 
-            command=self.clear_bill
-        ).pack(side=tk.LEFT, padx=5, ipadx=10, ipady=5)
+            button_frame,
+            text="Stock Alerts",
+            command=self.show_stock_alerts
+        ).pack(side=tk.RIGHT, padx=5, ipadx=10, ipady=5)
         
         ttk.Button(
-            button_frame, 
-            text="Generate Bill", 
-            command=self.generate_bill,
-            style="Accent.TButton"
+            button_frame,
+            text="SQL Stats",
+            command=self.show_sql_stats
         ).pack(side=tk.RIGHT, padx=5, ipadx=10, ipady=5)
         
+        self.status_label = tk.Label(button_frame, text="", fg="#4682b4", bg="#f0f8ff")
+        self.status_label.pack(side=tk.RIGHT, padx=10)
+        
+        self.queue_label = tk.Label(button_frame, text="", fg="#d2691e", bg="#f0f8ff")
+        self.queue_label.pack(side=tk.RIGHT, padx=10)
+        
         # Configure accent button style
         style = ttk.Style()
         style.configure("Accent.TButton", foreground="white", background="#4CAF50", font=("Arial", 10, "bold"))
     
     def filter_products(self, category):
-        """Filter products by category"""
-        if category:
-            self.cursor.execute(
-                "SELECT product_id, name, category, price, stock FROM products WHERE category=?",
-                (category,)
-            )
-        else:
-            self.cursor.execute("SELECT product_id, name, category, price, stock FROM products")
+        """Filter products by category, showing the first page"""
+        self.product_request += 1
+        request = self.product_request
+        self.status_label.config(text="Loading products...")
         
-        products = self.cursor.fetchall()
-        self.update_product_tree(products)
+        def show(products):
+            if request != self.product_request:
+                return
+            self.status_label.config(text="")
+            if "ready_ms" not in self.startup_times:
+                self.report_startup()
+            self.paging_category = category
+            self.has_previous_page = False
+            self.has_next_page = len(products) == PAGE_SIZE
+            self.update_product_tree(products)
+            self.product_tree.yview_moveto(0)
+        
+        self.worker.submit(self.engine.products_page, category, on_done=show, on_error=self.show_load_error)
     
     def search_products(self):
         """Search products by name"""
-        search_term = self.search_entry.get()
-        self.cursor.execute(
-            "SELECT product_id, name, category, price, stock FROM products WHERE name LIKE ?",
-            (f"%{search_term}%",)
-        )
-        products = self.cursor.fetchall()
-        self.update_product_tree(products)
+        search_term = self.search_entry.get().strip()
+        if not search_term:
+            self.filter_products("")
+            return
+        
+        self.product_request += 1
+        request = self.product_request
+        self.status_label.config(text="Searching...")
+        
+        def show(products):
+            if request != self.product_request:
+                return
+            self.status_label.config(text="")
+            self.paging_category = None
+            self.update_product_tree(products)
+        
+        self.worker.submit(self.engine.search_products, search_term, on_done=show, on_error=self.show_load_error)
+    
+    def show_load_error(self, error):
+        """Report a failed product load"""
+        self.loading_page = False
+        self.status_label.config(text="")
+        messagebox.showerror("Error", f"Failed to load products: {str(error)}")
+    
+    def on_product_scroll(self, first, last):
+        """Update the scrollbar and load another page when the view nears either end"""
+        self.product_scrollbar.set(first, last)
+        if self.paging_category is None or self.loading_page or not self.product_order:
+            return
+        if float(last) > 0.9 and self.has_next_page:
+            self.loading_page = True
+            self.worker.submit(
+                self.engine.products_page, self.paging_category, self.product_order[-1],
+                on_done=self.show_next_page(self.product_request), on_error=self.show_load_error
+            )
+        elif float(first) < 0.1 and self.has_previous_page:
+            self.loading_page = True
+            self.worker.submit(
+                self.engine.products_page, self.paging_category, 0, self.product_order[0],
+                on_done=self.show_previous_page(self.product_request), on_error=self.show_load_error
+            )
+    
+    def show_next_page(self, request):
+        """Return a callback that appends a page and drops rows from the top"""
+        def show(products):
+            self.loading_page = False
+            if request != self.product_request:
+                return
+            self.has_next_page = len(products) == PAGE_SIZE
+            for product in products:
+                self.insert_product_row(tk.END, product)
+            
+            removed = len(self.product_order) - PRODUCT_WINDOW_SIZE
+            if removed > 0:
+                for product_id in self.product_order[:removed]:
+                    self.delete_product_row(product_id)
+                del self.product_order[:removed]
+                self.has_previous_page = True
+                # Keep the same rows in view after removing rows above them
+                self.product_tree.yview_scroll(-removed, "units")
+        return show
+    
+    def show_previous_page(self, request):
+        """Return a callback that prepends a page and drops rows from the bottom"""
+        def show(products):
+            self.loading_page = False
+            if request != self.product_request:
+                return
+            self.has_previous_page = len(products) == PAGE_SIZE
+            for index, product in enumerate(products):
+                self.insert_product_row(index, product)
+            
+            removed = len(self.product_order) - PRODUCT_WINDOW_SIZE
+            if removed > 0:
+                for product_id in self.product_order[-removed:]:
+                    self.delete_product_row(product_id)
+                del self.product_order[-removed:]
+                self.has_next_page = True
+            # Keep the same rows in view after adding rows above them
+            self.product_tree.yview_scroll(len(products), "units")
+        return show
+    
+    @staticmethod
+    def product_display(product):
+        """Return the treeview values of a product row, with the price in cents shown as money"""
+        product_id, name, category, price_cents, stock = product
+        return (product_id, name, category, f"{price_cents / 100:.2f}", stock)
+    
+    def insert_product_row(self, index, product):
+        """Insert a product row at a treeview position and track it"""
+        product = tuple(product)
+        self.product_rows[product[0]] = self.product_tree.insert("", index, values=self.product_display(product))
+        self.product_values[product[0]] = product
+        if index == tk.END:
+            self.product_order.append(product[0])
+        else:
+            self.product_order.insert(index, product[0])
+    
+    def delete_product_row(self, product_id):
+        """Delete a product row from the treeview, leaving product_order to the caller"""
+        self.product_tree.delete(self.product_rows.pop(product_id))
+        del self.product_values[product_id]
     
     def update_product_tree(self, products):
-        """Update the product treeview with given products"""
-        self.product_tree.delete(*self.product_tree.get_children())
-        for product in products:
-            self.product_tree.insert("", tk.END, values=product)
+        """Update the product treeview with given products, touching only rows that changed"""
+        wanted = {product[0]: tuple(product) for product in products}
+        
+        # Drop rows that are no longer shown
+        for product_id in [pid for pid in self.product_rows if pid not in wanted]:
+            self.delete_product_row(product_id)
+        
+        order = list(wanted)
+        reorder = order != [pid for pid in self.product_order if pid in wanted]
+        for index, (product_id, product) in enumerate(wanted.items()):
+            row = self.product_rows.get(product_id)
+            if row is None:
+                self.product_rows[product_id] = self.product_tree.insert("", index, values=self.product_display(product))
+                self.product_values[product_id] = product
+                continue
+            if self.product_values[product_id] != product:
+                self.product_tree.item(row, values=self.product_display(product))
+                self.product_values[product_id] = product
+            if reorder:
+                self.product_tree.move(row, "", index)
+        self.product_order = order
+    
+    def refresh_product_rows(self, product_ids):
+        """Redraw the given products if they are currently shown"""
+        for product_id in product_ids:
+            row = self.product_rows.get(product_id)
+            product = self.engine.get_product(product_id)
+            if row is not None and product is not None and self.product_values[product_id] != product:
+                self.product_tree.item(row, values=self.product_display(product))
+                self.product_values[product_id] = product
     
     def add_to_bill(self, event=None):
         """Add selected product to the bill"""
+        if self.bill_pending:
+            return
+        if not self.caches_ready:
+            self.root.bell()
+            return
+        
         selected_item = self.product_tree.focus()
         if not selected_item:
             messagebox.showwarning("Warning", "Please select a product to add to bill")
@@ -425,65 +622,82 @@ class ClothShopBillingSystem:
         product_data = self.product_tree.item(selected_item, "values")
         product_id, name, category, price, stock = product_data
         
-        # Check if product already in bill
-        for item in self.current_bill_items:
-            if item["product_id"] == product_id:
-                # Ask for quantity to add
-                quantity = self.ask_quantity(name, current_qty=item["quantity"])
-                if quantity is None:
-                    return
-                
-                # Update existing item
-                item["quantity"] += quantity
-                item["total"] = float(price) * item["quantity"]
-                
-                # Update treeview
-                for child in self.bill_tree.get_children():
-                    if self.bill_tree.item(child, "values")[0] == product_id:
-                        self.bill_tree.item(
-                            child, 
-                            values=(
-                                product_id, 
-                                name, 
-                                price, 
-                                item["quantity"], 
-                                f"{item['total']:.2f}"
-                            )
-                        )
-                        break
-                
-                self.update_totals()
-                return
-        
-        # If product not already in bill
-        quantity = self.ask_quantity(name)
+        # Ask for quantity, starting from the current one if already in bill
+        existing = self.engine.get_item(product_id)
+        quantity = self.ask_quantity(name, current_qty=existing.quantity if existing else 0)
         if quantity is None:
             return
         
-        # Add new item to bill
-        total_price = float(price) * quantity
-        self.current_bill_items.append({
-            "product_id": product_id,
-            "name": name,
-            "price": float(price),
-            "quantity": quantity,
-            "total": total_price
-        })
-        
-        # Add to treeview
-        self.bill_tree.insert(
-            "", 
-            tk.END, 
-            values=(
-                product_id, 
-                name, 
-                price, 
-                quantity, 
-                f"{total_price:.2f}"
-            )
+        try:
+            line = self.engine.add_item(product_id, quantity)
+        except BillingError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        self.show_bill_line(line)
+        self.update_totals()
+    
+    def show_bill_line(self, line):
+        """Update the bill treeview row of a cart line, adding it if it is new"""
+        values = (
+            line.product_id, 
+            line.name, 
+            f"{line.price:.2f}", 
+            line.quantity, 
+            f"{line.total:.2f}"
         )
+        if line.row_id is None:
+            line.row_id = self.bill_tree.insert("", tk.END, values=values)
+        else:
+            self.bill_tree.item(line.row_id, values=values)
+    
+    def scan_item(self):
+        """Add the scanned code to the bill without any dialog"""
+        if not self.caches_ready:
+            # The code stays in the entry, Enter adds it once the products are loaded
+            self.root.bell()
+            self.scan_status.config(text="Loading products...", fg="red")
+            return
+        code = self.scan_entry.get()
+        self.scan_entry.delete(0, tk.END)
+        if self.bill_pending or not code.strip():
+            return
         
+        try:
+            line = self.engine.scan(code)
+        except BillingError as e:
+            # No modal dialog here, the cashier keeps scanning
+            self.root.bell()
+            self.scan_status.config(text=str(e), fg="red")
+            return
+        
+        self.show_bill_line(line)
         self.update_totals()
+        self.scan_status.config(
+            text=f"{line.name} x{line.quantity}  ({self.engine.scan_rate():.1f} scans/s, "
+                 f"{self.engine.scan_ms():.2f} ms avg over {self.engine.scan_count} scans)",
+            fg="black"
+        )
+    
+    def show_sql_stats(self):
+        """Show the most expensive SQL statements run since the till started"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("SQL Statement Stats")
+        dialog.geometry("900x400")
+        
+        text = tk.Text(dialog, font=("Courier", 9), wrap=tk.NONE)
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        text.insert(tk.END, "Startup: " + ", ".join(
+            f"{name} {ms:.0f}" for name, ms in self.startup_times.items()
+        ) + "\n\n")
+        text.insert(tk.END, query_stats.format_summary())
+        text.config(state=tk.DISABLED)
+        
+        ttk.Button(
+            dialog,
+            text="Reset",
+            command=lambda: (query_stats.reset(), dialog.destroy())
+        ).pack(pady=5)
     
     def ask_quantity(self, product_name, current_qty=0):
         """Show dialog to ask for quantity"""
@@ -544,104 +758,182 @@ class ClothShopBillingSystem:
     
     def remove_from_bill(self):
         """Remove selected item from bill"""
+        if self.bill_pending:
+            return
+        
         selected_item = self.bill_tree.focus()
         if not selected_item:
             messagebox.showwarning("Warning", "Please select an item to remove")
             return
         
         product_id = self.bill_tree.item(selected_item, "values")[0]
-        
-        # Remove from current items list
-        self.current_bill_items = [
-            item for item in self.current_bill_items 
-            if str(item["product_id"]) != product_id
-        ]
+        self.engine.remove_item(product_id)
         
         # Remove from treeview
         self.bill_tree.delete(selected_item)
         
         self.update_totals()
     
-    def clear_bill(self):
+    def clear_bill(self, confirm=True):
         """Clear the current bill"""
-        if not self.current_bill_items:
+        if self.bill_pending:
+            return
+        
+        if not self.engine.cart and not self.bill_tree.get_children():
             return
             
-        if messagebox.askyesno(
+        if not confirm or messagebox.askyesno(
             "Confirm", 
             "Are you sure you want to clear the current bill?"
         ):
-            self.current_bill_items = []
+            self.engine.clear_cart()
             self.bill_tree.delete(*self.bill_tree.get_children())
             self.update_totals()
     
     def update_totals(self):
-        """Update the total items and amount labels"""
-        self.total_items = sum(item["quantity"] for item in self.current_bill_items)
-        self.total_amount = sum(item["total"] for item in self.current_bill_items)
-        
-        self.total_items_label.config(text=str(self.total_items))
-        self.total_amount_label.config(text=f"${self.total_amount:.2f}")
+        """Price the lines whose promotions started or ended again and update the totals"""
+        for line in self.engine.price_cart():
+            self.show_bill_line(line)
+        self.total_items_label.config(text=str(self.engine.total_items))
+        self.total_amount_label.config(text=f"${self.engine.total_amount:.2f}")
+        parts = []
+        if self.engine.total_discount:
+            parts.append(f"Saved: ${self.engine.total_discount:.2f}")
+        if self.engine.total_tax:
+            parts.append(f"Tax: ${self.engine.total_tax:.2f}")
+        self.discount_label.config(text="   ".join(parts))
     
     def generate_bill(self):
-        """Generate and save the bill to database"""
-        if not self.current_bill_items:
-            messagebox.showwarning("Warning", "No items in the bill to generate")
+        """Generate and save the bill to database in the background"""
+        if self.bill_pending:
             return
-            
+        
         customer_name = self.customer_name.get().strip()
-        customer_phone = self.customer_phone.get().strip()
-        payment_method = self.payment_method.get()
+        sold_ids = [line.product_id for line in self.engine.cart]
         
-        if not customer_name:
-            messagebox.showwarning("Warning", "Please enter customer name")
-            return
+        # Block a second submit and any cart change until this bill is saved
+        self.set_bill_pending(True)
         
-        try:
-            # Save bill to database
-            bill_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.cursor.execute(
-                "INSERT INTO bills (customer_name, customer_phone, bill_date, total_amount, payment_method) VALUES (?, ?, ?, ?, ?)",
-                (customer_name, customer_phone, bill_date, self.total_amount, payment_method)
-            )
-            bill_id = self.cursor.lastrowid
+        def saved(bill):
+            self.set_bill_pending(False)
             
-            # Save bill items
-            for item in self.current_bill_items:
-                self.cursor.execute(
-                    "INSERT INTO bill_items (bill_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
-                    (bill_id, item["product_id"], item["quantity"], item["price"])
+            # Show success message
+            if bill["queued"]:
+                self.update_queue_status()
+                messagebox.showinfo(
+                    "Success",
+                    f"Bill saved on this till, it will be sent to the database when it is available.\n\n"
+                    f"Reference: {bill['bill_uuid'][:8]}\n"
+                    f"Customer: {customer_name}\n"
+                    f"Total Amount: ${bill['total_amount']:.2f}"
                 )
-                
-                # Update product stock
-                self.cursor.execute(
-                    "UPDATE products SET stock = stock - ? WHERE product_id = ?",
-                    (item["quantity"], item["product_id"])
+            else:
+                messagebox.showinfo(
+                    "Success", 
+                    f"Bill generated successfully!\n\n"
+                    f"Bill ID: {bill['bill_id']}\n"
+                    f"Customer: {customer_name}\n"
+                    f"Total Amount: ${bill['total_amount']:.2f}"
+                    + (f"\nYou saved: ${bill['discount_cents'] / 100:.2f}" if bill["discount_cents"] else "")
                 )
             
-            self.conn.commit()
-            
-            # Show success message
-            messagebox.showinfo(
-                "Success", 
-                f"Bill generated successfully!\n\n"
-                f"Bill ID: {bill_id}\n"
-                f"Customer: {customer_name}\n"
-                f"Total Amount: ${self.total_amount:.2f}"
-            )
-            
             # Clear current bill
-            self.clear_bill()
+            self.clear_bill(confirm=False)
             self.customer_name.delete(0, tk.END)
             self.customer_phone.delete(0, tk.END)
+            self.customer_phone.configure(values=[])
+            self.customer_matches = {}
+            self.autofilled_name = ""
             self.payment_method.current(0)
             
-        except Exception as e:
-            self.conn.rollback()
-            messagebox.showerror("Error", f"Failed to generate bill: {str(e)}")
+            # Refresh stock shown in the product list
+            self.refresh_product_rows(sold_ids)
+            
+            # A queued bill has no bill number yet, its receipt can be reprinted once it is in the database
+            if not bill["queued"]:
+                self.worker.submit(
+                    save_receipt, self.engine.db, bill["bill_id"],
+                    on_done=lambda path: self.status_label.config(text=f"Receipt saved to {path}"),
+                    on_error=lambda error: self.status_label.config(text=f"Receipt not saved: {error}")
+                )
+            
+            # Warn about anything this bill brought close to running out
+            self.worker.submit(self.engine.stock_alerts, sold_ids, on_done=self.show_stock_warning)
+        
+        def failed(error):
+            self.set_bill_pending(False)
+            if isinstance(error, OutOfStockError):
+                # Show the stock that is actually left for the short lines
+                self.refresh_product_rows([line["product_id"] for line in error.short_lines])
+                messagebox.showerror("Out of Stock", str(error))
+            elif isinstance(error, BillingError):
+                messagebox.showwarning("Warning", str(error))
+            else:
+                messagebox.showerror("Error", f"Failed to generate bill: {str(error)}")
+        
+        self.worker.submit(
+            self.engine.generate_bill,
+            customer_name,
+            self.customer_phone.get(),
+            self.payment_method.get(),
+            on_done=saved,
+            on_error=failed
+        )
+    
+    def show_stock_warning(self, alerts):
+        """Show the products that need reordering in the status bar"""
+        if alerts and not self.bill_pending:
+            self.status_label.config(text="Reorder: " + ", ".join(
+                f"{alert['name']} ({alert['stock']} left)" for alert in alerts[:3]
+            ))
+    
+    def show_stock_alerts(self):
+        """Show every low-stock alert with its reorder suggestion"""
+        self.worker.submit(self.engine.stock_alerts, on_done=self.show_stock_dialog, on_error=self.show_load_error)
+    
+    def show_stock_dialog(self, alerts):
+        """Open a window listing stock alerts, soonest to run out first"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Stock Alerts")
+        dialog.geometry("800x400")
+        
+        columns = ("id", "name", "stock", "velocity", "days", "level", "reorder")
+        tree = ttk.Treeview(dialog, columns=columns, show="headings")
+        for column, text, width in [
+            ("id", "ID", 50),
+            ("name", "Product Name", 250),
+            ("stock", "Stock", 70),
+            ("velocity", "Sold/Day", 80),
+            ("days", "Days Left", 80),
+            ("level", "Level", 100),
+            ("reorder", "Reorder Qty", 90)
+        ]:
+            tree.heading(column, text=text)
+            tree.column(column, width=width, anchor=tk.W if column == "name" else tk.CENTER)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        for alert in alerts:
+            tree.insert("", tk.END, values=(
+                alert["product_id"],
+                alert["name"],
+                alert["stock"],
+                f"{alert['velocity']:.1f}",
+                f"{alert['days_of_cover']:.1f}" if alert["velocity"] else "-",
+                alert["level"],
+                alert["reorder_quantity"]
+            ))
+    
+    def set_bill_pending(self, pending):
+        """Show or clear the saving state and enable or disable the cart buttons"""
+        self.bill_pending = pending
+        state = tk.DISABLED if pending else tk.NORMAL
+        for button in self.cart_buttons:
+            button.config(state=state)
+        self.status_label.config(text="Saving bill..." if pending else "")
 
 # Main application
 if __name__ == "__main__":
+    enable_slow_log()
     root = tk.Tk()
     app = ClothShopBillingSystem(root)
     
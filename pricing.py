@@ -0,0 +1,267 @@
+import argparse
+import sqlite3
+from bisect import bisect_right
+from datetime import datetime
+from tabulate import tabulate
+
+from database import ConnectionManager, DB_FILE
+
+PROMOTION_COLUMNS = (
+    "promotion_id, name, product_id, category, discount_bp, buy_quantity, free_quantity, "
+    "starts_at, ends_at, daily_start, daily_end"
+)
+
+def apply_rate(amount_cents, rate_bp):
+    """Return a basis point share of an amount, rounded half up to whole cents"""
+    return (amount_cents * rate_bp + 5000) // 10000
+
+def minute_of_day(time_text):
+    """Convert HH:MM to minutes after midnight"""
+    try:
+        hours, minutes = time_text.split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        raise ValueError(f"invalid time {time_text!r}, expected HH:MM")
+
+class Promotion:
+    """One promotion row, with its time window turned into plain comparisons"""
+    
+    __slots__ = (
+        "promotion_id", "name", "discount_bp", "buy_quantity", "free_quantity",
+        "starts_at", "ends_at", "daily_start", "daily_end"
+    )
+    
+    def __init__(self, promotion_id, name, discount_bp, buy_quantity, free_quantity,
+                 starts_at=None, ends_at=None, daily_start=None, daily_end=None):
+        self.promotion_id = promotion_id
+        self.name = name
+        self.discount_bp = discount_bp
+        self.buy_quantity = buy_quantity
+        self.free_quantity = free_quantity
+        self.starts_at = starts_at
+        self.ends_at = ends_at
+        self.daily_start = minute_of_day(daily_start) if daily_start else None
+        self.daily_end = minute_of_day(daily_end) if daily_end else None
+    
+    def active(self, clock):
+        """Return True if the promotion runs at a (timestamp, minute of day) clock"""
+        stamp, minute = clock
+        if self.starts_at and stamp < self.starts_at:
+            return False
+        if self.ends_at and stamp >= self.ends_at:
+            return False
+        if self.daily_start is None or self.daily_end is None:
+            return True
+        if self.daily_start <= self.daily_end:
+            return self.daily_start <= minute < self.daily_end
+        # A window such as 22:00-02:00 runs past midnight
+        return minute >= self.daily_start or minute < self.daily_end
+    
+    def discount(self, price_cents, quantity):
+        """Return the discount in cents on quantity units at a unit price"""
+        if self.buy_quantity and self.free_quantity:
+            # Buy 2 get 1 means every third unit in a group of three is free
+            return quantity // (self.buy_quantity + self.free_quantity) * self.free_quantity * price_cents
+        return apply_rate(price_cents * quantity, self.discount_bp)
+
+class PriceRules:
+    """Promotions and tax slabs compiled into per-product and per-category lookup tables"""
+    
+    def __init__(self):
+        # product_id -> promotions for that product, category -> promotions for the category
+        self.by_product = {}
+        self.by_category = {}
+        # Promotions on the whole shop
+        self.everywhere = []
+        # category, or None for every other category -> (ascending min_price_cents, rate_bp)
+        self.tax_slabs = {}
+        # (product_id, category) -> every promotion that can apply, filled on first use
+        self.candidates = {}
+        # Bumped by every load, so a cart can tell its lines were priced under older rules
+        self.generation = 0
+        self.loaded = False
+    
+    def load(self, cursor):
+        """Load the active promotions and tax slabs, replacing the compiled tables"""
+        by_product = {}
+        by_category = {}
+        everywhere = []
+        cursor.execute(f"SELECT {PROMOTION_COLUMNS} FROM promotions WHERE active = 1 ORDER BY promotion_id")
+        for (promotion_id, name, product_id, category, discount_bp, buy_quantity, free_quantity,
+             starts_at, ends_at, daily_start, daily_end) in cursor.fetchall():
+            promotion = Promotion(
+                promotion_id, name, discount_bp, buy_quantity, free_quantity,
+                starts_at, ends_at, daily_start, daily_end
+            )
+            if product_id is not None:
+                by_product.setdefault(product_id, []).append(promotion)
+            elif category:
+                by_category.setdefault(category, []).append(promotion)
+            else:
+                everywhere.append(promotion)
+        
+        slabs = {}
+        cursor.execute("SELECT category, min_price_cents, rate_bp FROM tax_slabs ORDER BY category, min_price_cents")
+        for category, min_price_cents, rate_bp in cursor.fetchall():
+            floors, rates = slabs.setdefault(category or None, ([], []))
+            floors.append(min_price_cents)
+            rates.append(rate_bp)
+        
+        self.by_product = by_product
+        self.by_category = by_category
+        self.everywhere = everywhere
+        self.tax_slabs = slabs
+        self.candidates = {}
+        self.generation += 1
+        self.loaded = True
+    
+    @staticmethod
+    def clock(now=None):
+        """Return the (timestamp, minute of day) the promotion windows are checked against"""
+        now = now or datetime.now()
+        return now.strftime("%Y-%m-%d %H:%M:%S"), now.hour * 60 + now.minute
+    
+    def promotions_for(self, product_id, category):
+        """Return every promotion that can apply to a product"""
+        key = (product_id, category)
+        promotions = self.candidates.get(key)
+        if promotions is None:
+            promotions = self.candidates[key] = tuple(
+                self.by_product.get(product_id, []) + self.by_category.get(category, []) + self.everywhere
+            )
+        return promotions
+    
+    def active_promotions(self, clock):
+        """Return the ids of the promotions running at a clock"""
+        promotions = [promotion for group in self.by_product.values() for promotion in group]
+        promotions += [promotion for group in self.by_category.values() for promotion in group]
+        return frozenset(promotion.promotion_id for promotion in promotions + self.everywhere if promotion.active(clock))
+    
+    def tax_rate(self, category, unit_cents):
+        """Return the tax rate in basis points for a unit price in a category"""
+        slabs = self.tax_slabs.get(category) or self.tax_slabs.get(None)
+        if not slabs:
+            return 0
+        index = bisect_right(slabs[0], unit_cents) - 1
+        return slabs[1][index] if index >= 0 else 0
+    
+    def price_line(self, line, clock):
+        """Set the discount, tax and total of a cart line; the best single promotion wins"""
+        gross = line.price_cents * line.quantity
+        best = None
+        discount = 0
+        for promotion in self.promotions_for(line.product_id, line.category):
+            if promotion.active(clock):
+                amount = promotion.discount(line.price_cents, line.quantity)
+                if amount > discount:
+                    best, discount = promotion, amount
+        discount = min(discount, gross)
+        net = gross - discount
+        # Slabs go by the price actually charged per unit
+        unit_cents = net // line.quantity if line.quantity else line.price_cents
+        line.discount_cents = discount
+        line.tax_cents = apply_rate(net, self.tax_rate(line.category, unit_cents))
+        line.promotion_id = best.promotion_id if best else None
+        line.total_cents = net + line.tax_cents
+
+def percent_bp(value):
+    """Convert a percentage such as 12.5 to basis points"""
+    return int(round(float(value) * 100))
+
+def print_rules(conn):
+    """Print the promotions and tax slabs"""
+    promotions = conn.execute(f"SELECT {PROMOTION_COLUMNS}, active FROM promotions ORDER BY promotion_id").fetchall()
+    print("\n=== PROMOTIONS ===")
+    print(tabulate(
+        [
+            (
+                row[0], row[1], row[2] or "", row[3] or "",
+                f"{row[4] / 100:g}%" if row[4] else f"buy {row[5]} get {row[6]}" if row[5] else "",
+                row[7] or "", row[8] or "", f"{row[9]}-{row[10]}" if row[9] and row[10] else "",
+                "yes" if row[11] else "no"
+            )
+            for row in promotions
+        ],
+        headers=['ID', 'Name', 'Product', 'Category', 'Offer', 'From', 'Until', 'Hours', 'Active'],
+        tablefmt='grid'
+    ))
+    slabs = conn.execute(
+        "SELECT tax_slab_id, category, min_price_cents, rate_bp FROM tax_slabs ORDER BY category, min_price_cents"
+    ).fetchall()
+    print("\n=== TAX SLABS ===")
+    print(tabulate(
+        [(slab_id, category or "(all others)", f"{floor / 100:.2f}", f"{rate / 100:g}%") for slab_id, category, floor, rate in slabs],
+        headers=['ID', 'Category', 'From Price', 'Rate'],
+        tablefmt='grid'
+    ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage promotions and tax slabs")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show promotions and tax slabs")
+    
+    promotion = commands.add_parser("add-promotion", help="add a percentage or buy-X-get-Y promotion")
+    promotion.add_argument("name")
+    offer = promotion.add_mutually_exclusive_group(required=True)
+    offer.add_argument("--percent", type=float, help="percentage off")
+    offer.add_argument("--buy-get", nargs=2, type=int, metavar=("BUY", "FREE"), help="buy BUY units and get FREE more free")
+    target = promotion.add_mutually_exclusive_group()
+    target.add_argument("--product", type=int, help="only this product id")
+    target.add_argument("--category", help="only this category")
+    promotion.add_argument("--starts", help="first moment, YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+    promotion.add_argument("--ends", help="end, exclusive, YYYY-MM-DD or YYYY-MM-DD HH:MM:SS")
+    promotion.add_argument("--hours", help="daily window such as 17:00-20:00")
+    
+    tax = commands.add_parser("add-tax", help="add a tax slab")
+    tax.add_argument("rate", type=float, help="tax percentage")
+    tax.add_argument("--category", help="only this category (default: every category without its own slabs)")
+    tax.add_argument("--from-price", type=float, default=0.0, help="unit price the slab starts at")
+    
+    for name in ["end-promotion", "remove-tax"]:
+        commands.add_parser(name).add_argument("id", type=int)
+    args = parser.parse_args()
+    
+    db = ConnectionManager(args.db)
+    try:
+        if args.command == "list":
+            with db.reader() as conn:
+                print_rules(conn)
+        elif args.command == "add-promotion":
+            daily_start = daily_end = None
+            if args.hours:
+                daily_start, _, daily_end = args.hours.partition("-")
+                # Raises ValueError for anything that is not HH:MM
+                minute_of_day(daily_start)
+                minute_of_day(daily_end)
+            buy, free = args.buy_get or (0, 0)
+            with db.transaction() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO promotions (name, product_id, category, discount_bp, buy_quantity, free_quantity, "
+                    "starts_at, ends_at, daily_start, daily_end) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        args.name, args.product, args.category, percent_bp(args.percent or 0), buy, free,
+                        args.starts, args.ends, daily_start, daily_end
+                    )
+                )
+            print(f"Added promotion {cursor.lastrowid}")
+        elif args.command == "add-tax":
+            with db.transaction() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO tax_slabs (category, min_price_cents, rate_bp) VALUES (?, ?, ?)",
+                    (args.category, int(round(args.from_price * 100)), percent_bp(args.rate))
+                )
+            print(f"Added tax slab {cursor.lastrowid}")
+        elif args.command == "end-promotion":
+            # Bill lines keep pointing at the promotion, so it is switched off rather than deleted
+            with db.transaction() as conn:
+                conn.execute("UPDATE promotions SET active = 0 WHERE promotion_id = ?", (args.id,))
+        else:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM tax_slabs WHERE tax_slab_id = ?", (args.id,))
+    except ValueError as e:
+        print(f"Invalid value: {e}")
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
+    finally:
+        db.close()
\ No newline at end of file
@@ -0,0 +1,139 @@
+from bisect import bisect_left
+
+from database import PRODUCT_COLUMNS
+
+class ProductCache:
+    """Process-local copy of the products table with category and name token maps"""
+    
+    def __init__(self):
+        self.products = {}
+        self.by_category = {}
+        self.by_token = {}
+        self.by_sku = {}
+        self.sorted_tokens = []
+        self.tokens_dirty = False
+        self.loaded = False
+    
+    def load(self, cursor):
+        """Load every product from the database, replacing the cached copy"""
+        # Build the new maps aside and swap them in, so readers never see a half-loaded cache
+        fresh = ProductCache()
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS}, sku FROM products ORDER BY product_id")
+        for row in cursor:
+            fresh._index(row[:5])
+            if row[5]:
+                fresh.by_sku[row[5]] = row[0]
+        self.products = fresh.products
+        self.by_category = fresh.by_category
+        self.by_token = fresh.by_token
+        self.by_sku = fresh.by_sku
+        self.tokens_dirty = True
+        self.loaded = True
+    
+    def refresh(self, cursor, product_ids):
+        """Re-read the given products from the database and patch them in place"""
+        product_ids = [int(product_id) for product_id in product_ids]
+        if not product_ids:
+            return []
+        placeholders = ", ".join("?" * len(product_ids))
+        cursor.execute(
+            f"SELECT {PRODUCT_COLUMNS}, sku FROM products WHERE product_id IN ({placeholders})",
+            product_ids
+        )
+        found = []
+        for row in cursor.fetchall():
+            self.put(row[:5], row[5])
+            found.append(row[:5])
+        for product_id in set(product_ids) - {product[0] for product in found}:
+            self.remove(product_id)
+        return found
+    
+    def put(self, product, sku=None):
+        """Add or replace a single product row"""
+        product = tuple(product)
+        if sku:
+            self.by_sku[sku] = product[0]
+        old = self.products.get(product[0])
+        if old is not None:
+            if old[1] == product[1] and old[2] == product[2]:
+                # Name and category unchanged, secondary maps stay valid
+                self.products[product[0]] = product
+                return
+            self._unindex(old)
+        self._index(product)
+    
+    def remove(self, product_id):
+        """Drop a product from the cache and its secondary maps"""
+        product = self.products.pop(product_id, None)
+        if product is not None:
+            self._unindex(product)
+    
+    def set_stock(self, product_id, stock):
+        """Patch the stock of a cached product"""
+        product = self.products.get(int(product_id))
+        if product is not None:
+            self.products[product[0]] = product[:4] + (stock,)
+    
+    def get(self, product_id):
+        """Return a cached product row or None"""
+        return self.products.get(int(product_id))
+    
+    def get_by_sku(self, sku):
+        """Return the cached product with a SKU or barcode, or None"""
+        product_id = self.by_sku.get(sku)
+        return self.products.get(product_id) if product_id is not None else None
+    
+    def filter(self, category=""):
+        """Return products in a category, or all products, ordered by product id"""
+        if not category:
+            return list(self.products.values())
+        return [self.products[product_id] for product_id in sorted(self.by_category.get(category, ()))]
+    
+    def search(self, search_term, limit):
+        """Return products whose name has a word starting with every word of the search term"""
+        matches = None
+        for word in self._tokens(search_term):
+            ids = self._prefix_ids(word)
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        if matches is None:
+            return []
+        results = [self.products[product_id] for product_id in matches]
+        results.sort(key=lambda product: (product[1].lower(), product[0]))
+        return results[:limit]
+    
+    def _prefix_ids(self, prefix):
+        """Return ids of products with a name token starting with prefix"""
+        if self.tokens_dirty:
+            self.sorted_tokens = sorted(token for token, ids in self.by_token.items() if ids)
+            self.tokens_dirty = False
+        ids = set()
+        index = bisect_left(self.sorted_tokens, prefix)
+        while index < len(self.sorted_tokens) and self.sorted_tokens[index].startswith(prefix):
+            ids |= self.by_token[self.sorted_tokens[index]]
+            index += 1
+        return ids
+    
+    def _index(self, product):
+        """Store a product row and add it to the secondary maps"""
+        product = tuple(product)
+        product_id = product[0]
+        self.products[product_id] = product
+        self.by_category.setdefault(product[2], set()).add(product_id)
+        for token in self._tokens(product[1]):
+            if token not in self.by_token:
+                self.by_token[token] = set()
+                self.tokens_dirty = True
+            self.by_token[token].add(product_id)
+    
+    def _unindex(self, product):
+        """Remove a product row from the secondary maps"""
+        self.by_category.get(product[2], set()).discard(product[0])
+        for token in self._tokens(product[1]):
+            self.by_token.get(token, set()).discard(product[0])
+    
+    @staticmethod
+    def _tokens(name):
+        """Split a product name into lower case search tokens"""
+        return set((name or "").lower().replace("-", " ").split())
\ No newline at end of file
@@ -0,0 +1,342 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from archive import attach_archives
+from database import DB_FILE
+
+SHOP_NAME = "Cloth Shop"
+FOOTER = "Thank you for shopping with us!"
+# Characters per line on an 80 mm thermal roll, use 32 for 58 mm rolls
+RECEIPT_WIDTH = 42
+RECEIPT_DIR = 'receipts'
+# Blank lines fed between receipts so each one clears the tear bar
+FEED_LINES = 4
+
+# Bills read and rendered per task sent to a worker process
+BATCH_SIZE = 500
+WORKERS = os.cpu_count() or 1
+# Tasks waiting per worker, enough to keep them busy without holding a whole date range in memory
+TASKS_AHEAD = 2
+
+# Receipt PDFs use the built-in Courier font, so a text line of RECEIPT_WIDTH characters fits 80 mm
+PDF_FONT_SIZE = 8
+PDF_LEADING = 10
+PDF_MARGIN = 12
+# Width of a Courier character as a share of the font size
+COURIER_WIDTH = 0.6
+
+FORMATS = {"text": "txt", "pdf": "pdf"}
+
+BILL_QUERY = '''
+    SELECT b.bill_id, b.bill_date, b.customer_name, c.phone, b.payment_method, b.total_cents
+    FROM bills b
+    LEFT JOIN customers c ON c.customer_id = b.customer_id
+    WHERE b.bill_id IN (SELECT value FROM json_each(?))
+'''
+
+# Lines show the product's current name, bill_items only keeps its id
+ITEM_QUERY = '''
+    SELECT bi.bill_id, COALESCE(p.name, 'Item ' || bi.product_id), bi.quantity, bi.price_cents,
+        bi.discount_cents, bi.tax_cents
+    FROM bill_items bi
+    LEFT JOIN products p ON p.product_id = bi.product_id
+    WHERE bi.bill_id IN (SELECT value FROM json_each(?))
+    ORDER BY bi.bill_id, bi.item_id
+'''
+
+def money(cents):
+    """Format cents as a plain amount such as 1234.50"""
+    return f"{cents / 100:.2f}"
+
+def load_receipts(conn, bill_ids):
+    """Return [(bill row, item rows)] for the bills that exist, in the order of bill_ids"""
+    ids = "[" + ",".join(str(int(bill_id)) for bill_id in bill_ids) + "]"
+    bills = {row[0]: (row, []) for row in conn.execute(BILL_QUERY, (ids,))}
+    for bill_id, *item in conn.execute(ITEM_QUERY, (ids,)):
+        bills[bill_id][1].append(item)
+    return [bills[bill_id] for bill_id in bill_ids if bill_id in bills]
+
+class TextTemplate:
+    """Thermal printer layout for one paper width, with the fixed lines and format strings built once"""
+    
+    extension = "txt"
+    
+    def __init__(self, width=RECEIPT_WIDTH, shop_name=SHOP_NAME, footer=FOOTER):
+        self.width = width
+        self.rule = "-" * width
+        self.header = [shop_name.center(width).rstrip(), self.rule]
+        self.footer = [self.rule, footer.center(width).rstrip()]
+        # A label on the left and an amount of up to 12 characters on the right
+        label = max(width - 12, 1)
+        self.pair = f"{{:<{label}.{label}}}{{:>12}}".format
+        self.clip = f"{{:.{width}}}".format
+    
+    def lines(self, bill, items):
+        """Return the receipt of a bill as a list of text lines"""
+        bill_id, bill_date, customer_name, phone, payment_method, total_cents = bill
+        pair = self.pair
+        lines = list(self.header)
+        lines.append(self.clip(f"Bill: {bill_id}"))
+        lines.append(self.clip(f"Date: {bill_date[:16]}"))
+        lines.append(self.clip(f"Customer: {customer_name or ''}"))
+        if phone:
+            lines.append(self.clip(f"Phone: {phone}"))
+        lines.append(self.rule)
+        
+        quantity = gross = discount = tax = 0
+        for name, item_quantity, price_cents, discount_cents, tax_cents in items:
+            amount = item_quantity * price_cents
+            lines.append(self.clip(name))
+            lines.append(pair(f"  {item_quantity} x {money(price_cents)}", money(amount)))
+            if discount_cents:
+                lines.append(pair("  Offer", money(-discount_cents)))
+            quantity += item_quantity
+            gross += amount
+            discount += discount_cents
+            tax += tax_cents
+        
+        lines.append(self.rule)
+        lines.append(self.clip(f"Items: {quantity}"))
+        lines.append(pair("Subtotal", money(gross)))
+        if discount:
+            lines.append(pair("You saved", money(-discount)))
+        if tax:
+            lines.append(pair("Tax", money(tax)))
+        lines.append(pair("TOTAL", money(total_cents)))
+        lines.append(self.clip(f"Paid by {payment_method or 'Cash'}"))
+        lines.extend(self.footer)
+        return lines
+    
+    def render(self, bill, items):
+        """Return the receipt as text"""
+        return "\n".join(self.lines(bill, items)) + "\n"
+
+class PdfTemplate(TextTemplate):
+    """The thermal layout set in Courier on a receipt-width PDF page, written without a PDF library"""
+    
+    extension = "pdf"
+    
+    def __init__(self, width=RECEIPT_WIDTH, shop_name=SHOP_NAME, footer=FOOTER):
+        super().__init__(width, shop_name, footer)
+        self.page_width = round(width * PDF_FONT_SIZE * COURIER_WIDTH + 2 * PDF_MARGIN)
+        # Objects 1, 2 and 4 never change, only the page size and content stream do
+        self.head = (
+            b"%PDF-1.4\n",
+            b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n",
+            b"2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n"
+        )
+        self.page = (
+            "3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 " + str(self.page_width) + " {}] "
+            "/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>\nendobj\n"
+        ).format
+        self.font = b"4 0 obj\n<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>\nendobj\n"
+        self.text_start = f"BT\n/F1 {PDF_FONT_SIZE} Tf\n{PDF_LEADING} TL\n{PDF_MARGIN} {{}} Td\n".format
+        self.escape = str.maketrans({"\\": "\\\\", "(": "\\(", ")": "\\)"})
+    
+    def render(self, bill, items):
+        """Return the receipt as a one-page PDF"""
+        lines = self.lines(bill, items)
+        height = len(lines) * PDF_LEADING + 2 * PDF_MARGIN
+        # The ' operator moves down one line and shows the string
+        stream = (
+            self.text_start(height - PDF_MARGIN)
+            + "".join(f"({line.translate(self.escape)}) '\n" for line in lines)
+            + "ET\n"
+        ).encode("cp1252", "replace")
+        
+        parts = list(self.head)
+        parts.append(self.page(height).encode("ascii"))
+        parts.append(self.font)
+        parts.append(f"5 0 obj\n<< /Length {len(stream)} >>\nstream\n".encode("ascii") + stream + b"endstream\nendobj\n")
+        offsets = []
+        position = 0
+        for part in parts:
+            offsets.append(position)
+            position += len(part)
+        # Every xref entry is exactly 20 bytes, the first object line starts after the header
+        xref = "xref\n0 6\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets[1:])
+        trailer = f"trailer\n<< /Size 6 /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n"
+        return b"".join(parts) + (xref + trailer).encode("ascii")
+
+TEMPLATE_CLASSES = {"text": TextTemplate, "pdf": PdfTemplate}
+# (format, width) -> compiled template, shared by every receipt rendered in this process
+templates = {}
+
+def template(output_format="text", width=RECEIPT_WIDTH):
+    """Return the compiled template for a format and paper width"""
+    key = (output_format, width)
+    compiled = templates.get(key)
+    if compiled is None:
+        compiled = templates[key] = TEMPLATE_CLASSES[output_format](width)
+    return compiled
+
+def render_receipt(conn, bill_id, output_format="text", width=RECEIPT_WIDTH):
+    """Return one bill's receipt as text or PDF bytes, or None if there is no such bill"""
+    receipts = load_receipts(conn, [bill_id])
+    if not receipts:
+        return None
+    return template(output_format, width).render(*receipts[0])
+
+def write_receipt(path, receipt):
+    """Write a rendered receipt to a file"""
+    if isinstance(receipt, bytes):
+        with open(path, "wb") as f:
+            f.write(receipt)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(receipt)
+
+def save_receipt(db, bill_id, output_format="text", receipt_dir=RECEIPT_DIR, width=RECEIPT_WIDTH):
+    """Render a saved bill's receipt into the receipt folder and return its path"""
+    with db.reader() as conn:
+        receipt = render_receipt(conn, bill_id, output_format, width)
+    if receipt is None:
+        raise ValueError(f"No bill {bill_id}")
+    os.makedirs(receipt_dir, exist_ok=True)
+    path = os.path.join(receipt_dir, f"receipt-{bill_id}.{FORMATS[output_format]}")
+    write_receipt(path, receipt)
+    return path
+
+def open_reader(db_file, archived=False, start=None, end=None):
+    """Open a read-only connection, with the archived months in the range attached if asked"""
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    if archived:
+        attach_archives(conn, start, end)
+    return conn
+
+# The read connection of a worker process, opened once by init_worker
+worker_conn = None
+
+def init_worker(db_file, archived, start, end):
+    """Open the worker process's own read connection"""
+    global worker_conn
+    worker_conn = open_reader(db_file, archived, start, end)
+
+def render_batch(bill_ids, output_format, width, out_dir):
+    """Render a batch of bills in a worker, writing one file each to out_dir or returning the text"""
+    compiled = template(output_format, width)
+    receipts = load_receipts(worker_conn, bill_ids)
+    if out_dir is None:
+        return [compiled.render(bill, items) for bill, items in receipts]
+    for bill, items in receipts:
+        write_receipt(os.path.join(out_dir, f"receipt-{bill[0]}.{compiled.extension}"), compiled.render(bill, items))
+    return len(receipts)
+
+def bill_batches(conn, start=None, end=None, batch_size=BATCH_SIZE):
+    """Yield lists of bill ids dated from start to end inclusive, oldest first"""
+    conditions = []
+    params = []
+    if start:
+        conditions.append("bill_date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("bill_date < ?")
+        params.append((date.fromisoformat(end[:10]) + timedelta(days=1)).isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = conn.execute(f"SELECT bill_id FROM bills {where} ORDER BY bill_date, bill_id", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [row[0] for row in rows]
+
+def render_range(db_file=DB_FILE, start=None, end=None, output_format="text", out_dir=None, out=None,
+                 workers=WORKERS, width=RECEIPT_WIDTH, archived=False, batch_size=BATCH_SIZE, progress=None):
+    """Render every receipt in a date range across worker processes and return counts and timing"""
+    # Text goes to out in bill order when there is no out_dir, PDFs always need one
+    if out_dir is None and output_format != "text":
+        raise ValueError(f"{output_format} receipts need an output directory")
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    out = out or sys.stdout
+    started = time.perf_counter()
+    rendered = 0
+    # Unpacks any archived months before the workers attach them
+    conn = open_reader(db_file, archived, start, end)
+    try:
+        with ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(db_file, archived, start, end)
+        ) as pool:
+            pending = deque()
+            
+            def collect():
+                nonlocal rendered
+                result = pending.popleft().result()
+                if out_dir is None:
+                    feed = "\n" * FEED_LINES
+                    for receipt in result:
+                        out.write(receipt)
+                        out.write(feed)
+                    result = len(result)
+                rendered += result
+                if progress:
+                    progress(f"  {rendered} receipts")
+            
+            # Bill ids are read a batch at a time and results taken in order, so memory stays flat
+            for bill_ids in bill_batches(conn, start, end, batch_size):
+                pending.append(pool.submit(render_batch, bill_ids, output_format, width, out_dir))
+                if len(pending) >= workers * TASKS_AHEAD:
+                    collect()
+            while pending:
+                collect()
+    finally:
+        conn.close()
+    return {"receipts": rendered, "seconds": time.perf_counter() - started}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print, reprint or export bill receipts")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    parser.add_argument("--width", type=int, default=RECEIPT_WIDTH, help="characters per line, 42 for 80 mm paper, 32 for 58 mm")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    show = commands.add_parser("show", help="render one bill")
+    show.add_argument("bill_id", type=int)
+    show.add_argument("--format", dest="output_format", choices=list(FORMATS), default="text")
+    show.add_argument("--output", help="file to write, required for pdf")
+    
+    batch = commands.add_parser("batch", help="reprint or export every bill in a date range")
+    batch.add_argument("--since", help="first day, YYYY-MM-DD")
+    batch.add_argument("--until", help="last day, YYYY-MM-DD")
+    batch.add_argument("--format", dest="output_format", choices=list(FORMATS), default="text")
+    batch.add_argument("--dir", help="write one file per bill here instead of printing the text")
+    batch.add_argument("--output", help="write the text to this file or printer device instead of the screen")
+    batch.add_argument("--workers", type=int, default=WORKERS, help="worker processes")
+    batch.add_argument("--archived", action="store_true", help="include bills moved to the monthly archives")
+    args = parser.parse_args()
+    
+    try:
+        if args.command == "show":
+            if args.output_format == "pdf" and not args.output:
+                parser.error("pdf receipts need --output")
+            conn = open_reader(args.db)
+            try:
+                receipt = render_receipt(conn, args.bill_id, args.output_format, args.width)
+            finally:
+                conn.close()
+            if receipt is None:
+                print(f"No bill {args.bill_id}")
+            elif args.output:
+                write_receipt(args.output, receipt)
+            else:
+                print(receipt, end="")
+        else:
+            out = open(args.output, "w", encoding="utf-8") if args.output else None
+            try:
+                result = render_range(
+                    args.db, args.since, args.until, args.output_format, args.dir, out,
+                    args.workers, args.width, args.archived
+                )
+            finally:
+                if out:
+                    out.close()
+            print(f"Rendered {result['receipts']} receipts in {result['seconds']:.1f}s", file=sys.stderr)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
\ No newline at end of file
@@ -0,0 +1,188 @@
+import argparse
+import sqlite3
+import time
+from tabulate import tabulate
+
+from database import ConnectionManager, DB_FILE, LINE_TOTAL_SQL
+
+SUMMARY_TABLES = ["daily_product_sales", "daily_category_sales", "daily_payment_sales"]
+
+def sale_day(bill_date):
+    """Return the YYYY-MM-DD day of a bill date"""
+    return bill_date[:10]
+
+def record_bill(cursor, bill_date, payment_method, total_cents, items):
+    """Add one bill's cart lines to the daily rollups, run inside the bill's own transaction"""
+    day = sale_day(bill_date)
+    
+    cursor.executemany(
+        '''
+        INSERT INTO daily_product_sales (sale_date, product_id, quantity, amount_cents)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(sale_date, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            amount_cents = amount_cents + excluded.amount_cents
+        ''',
+        [(day, item.product_id, item.quantity, item.total_cents) for item in items]
+    )
+    
+    categories = {}
+    for item in items:
+        category = item.category or ""
+        quantity, amount = categories.get(category, (0, 0))
+        categories[category] = (quantity + item.quantity, amount + item.total_cents)
+    cursor.executemany(
+        '''
+        INSERT INTO daily_category_sales (sale_date, category, quantity, amount_cents)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(sale_date, category) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            amount_cents = amount_cents + excluded.amount_cents
+        ''',
+        [(day, category, quantity, amount) for category, (quantity, amount) in categories.items()]
+    )
+    
+    cursor.execute(
+        '''
+        INSERT INTO daily_payment_sales (sale_date, payment_method, bills, amount_cents)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT(sale_date, payment_method) DO UPDATE SET
+            bills = bills + 1,
+            amount_cents = amount_cents + excluded.amount_cents
+        ''',
+        (day, payment_method or "", total_cents)
+    )
+
+def rebuild_summaries(db, since=None):
+    """Recompute the daily rollups from bills and bill_items, optionally from a date onwards"""
+    started = time.perf_counter()
+    if not since:
+        # Archived months are no longer in bills, so rollups before the oldest live bill are kept as they are
+        with db.reader() as conn:
+            since = conn.execute("SELECT substr(MIN(bill_date), 1, 10) FROM bills").fetchone()[0]
+        if since is None:
+            return {"days": 0, "seconds": time.perf_counter() - started}
+    date_filter = "WHERE b.bill_date >= ?"
+    params = (since,)
+    
+    with db.transaction() as conn:
+        for table in SUMMARY_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE sale_date >= ?", (since,))
+        
+        conn.execute(f'''
+            INSERT INTO daily_product_sales (sale_date, product_id, quantity, amount_cents)
+            SELECT substr(b.bill_date, 1, 10), bi.product_id, SUM(bi.quantity), SUM({LINE_TOTAL_SQL})
+            FROM bill_items bi JOIN bills b ON bi.bill_id = b.bill_id
+            {date_filter}
+            GROUP BY 1, 2
+        ''', params)
+        
+        # Category rollups use each product's current category
+        conn.execute(f'''
+            INSERT INTO daily_category_sales (sale_date, category, quantity, amount_cents)
+            SELECT substr(b.bill_date, 1, 10), COALESCE(p.category, ''), SUM(bi.quantity), SUM({LINE_TOTAL_SQL})
+            FROM bill_items bi
+            JOIN bills b ON bi.bill_id = b.bill_id
+            LEFT JOIN products p ON bi.product_id = p.product_id
+            {date_filter}
+            GROUP BY 1, 2
+        ''', params)
+        
+        conn.execute(f'''
+            INSERT INTO daily_payment_sales (sale_date, payment_method, bills, amount_cents)
+            SELECT substr(b.bill_date, 1, 10), COALESCE(b.payment_method, ''), COUNT(*), SUM(b.total_cents)
+            FROM bills b
+            {date_filter}
+            GROUP BY 1, 2
+        ''', params)
+        
+        days = conn.execute("SELECT COUNT(DISTINCT sale_date) FROM daily_payment_sales").fetchone()[0]
+    
+    return {"days": days, "seconds": time.perf_counter() - started}
+
+def date_range(start=None, end=None):
+    """Return a WHERE clause and parameters for a sale_date range"""
+    conditions = []
+    params = []
+    if start:
+        conditions.append("sale_date >= ?")
+        params.append(start)
+    if end:
+        conditions.append("sale_date <= ?")
+        params.append(end)
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+def daily_totals(conn, start=None, end=None):
+    """Return (date, bills, amount) for each day in the range"""
+    where, params = date_range(start, end)
+    return conn.execute(
+        f"SELECT sale_date, SUM(bills), SUM(amount_cents) / 100.0 FROM daily_payment_sales {where} "
+        "GROUP BY sale_date ORDER BY sale_date",
+        params
+    ).fetchall()
+
+def payment_totals(conn, start=None, end=None):
+    """Return (payment method, bills, amount) over the range"""
+    where, params = date_range(start, end)
+    return conn.execute(
+        f"SELECT payment_method, SUM(bills), SUM(amount_cents) / 100.0 FROM daily_payment_sales {where} "
+        "GROUP BY payment_method ORDER BY 3 DESC",
+        params
+    ).fetchall()
+
+def category_totals(conn, start=None, end=None):
+    """Return (category, quantity, amount) over the range"""
+    where, params = date_range(start, end)
+    return conn.execute(
+        f"SELECT category, SUM(quantity), SUM(amount_cents) / 100.0 FROM daily_category_sales {where} "
+        "GROUP BY category ORDER BY 3 DESC",
+        params
+    ).fetchall()
+
+def top_products(conn, start=None, end=None, limit=10):
+    """Return the best selling products by amount over the range"""
+    where, params = date_range(start, end)
+    return conn.execute(
+        f'''
+        SELECT s.product_id, p.name, s.quantity, s.amount_cents / 100.0 FROM (
+            SELECT product_id, SUM(quantity) AS quantity, SUM(amount_cents) AS amount_cents
+            FROM daily_product_sales {where}
+            GROUP BY product_id
+        ) s LEFT JOIN products p ON s.product_id = p.product_id
+        ORDER BY s.amount_cents DESC
+        LIMIT ?
+        ''',
+        params + [limit]
+    ).fetchall()
+
+def print_report(db, start=None, end=None):
+    """Print the end-of-day style sales report from the rollups"""
+    with db.reader() as conn:
+        print("\n=== DAILY SALES ===")
+        print(tabulate(daily_totals(conn, start, end), headers=['Date', 'Bills', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+        print("\n=== BY PAYMENT METHOD ===")
+        print(tabulate(payment_totals(conn, start, end), headers=['Payment Method', 'Bills', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+        print("\n=== BY CATEGORY ===")
+        print(tabulate(category_totals(conn, start, end), headers=['Category', 'Quantity', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+        print("\n=== TOP PRODUCTS ===")
+        print(tabulate(top_products(conn, start, end), headers=['ID', 'Name', 'Quantity', 'Amount'], tablefmt='grid', floatfmt='.2f'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daily sales rollups for the cloth shop")
+    parser.add_argument("command", choices=["report", "rebuild"])
+    parser.add_argument("--since", help="first day, YYYY-MM-DD")
+    parser.add_argument("--until", help="last day for reports, YYYY-MM-DD")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args()
+    
+    db = ConnectionManager(args.db)
+    try:
+        if args.command == "rebuild":
+            result = rebuild_summaries(db, args.since)
+            print(f"Rebuilt rollups for {result['days']} days in {result['seconds']:.2f}s")
+        else:
+            print_report(db, args.since, args.until)
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
+    finally:
+        db.close()
\ No newline at end of file
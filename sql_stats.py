@@ -0,0 +1,201 @@
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from tabulate import tabulate
+
+SLOW_QUERY_MS = 50
+SLOW_LOG_FILE = 'slow_queries.log'
+SLOW_LOG_BYTES = 1024 * 1024
+SLOW_LOG_BACKUPS = 3
+
+slow_log = logging.getLogger("cloth_shop.slow_sql")
+slow_log.propagate = False
+
+def normalize_sql(sql):
+    """Collapse whitespace and placeholder lists so the same statement always gets the same key"""
+    sql = " ".join(sql.split())
+    return re.sub(r"\?(\s*,\s*\?)+", "?, ...", sql)
+
+class QueryStats:
+    """Per-statement counts, latency and rows returned for every instrumented connection"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = {}
+    
+    def record(self, sql, seconds):
+        """Add one execution of a statement"""
+        key = normalize_sql(sql)
+        with self.lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0}
+            stats["count"] += 1
+            stats["total_ms"] += seconds * 1000
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+        return key
+    
+    def add_rows(self, key, rows):
+        """Add rows fetched from a statement"""
+        with self.lock:
+            self.statements[key]["rows"] += rows
+    
+    def summary(self, top=20, order="total_ms"):
+        """Return (statement, count, total ms, avg ms, max ms, rows) for the most expensive statements"""
+        with self.lock:
+            items = [(sql, dict(stats)) for sql, stats in self.statements.items()]
+        items.sort(key=lambda item: item[1][order], reverse=True)
+        return [
+            (sql, stats["count"], stats["total_ms"], stats["total_ms"] / stats["count"], stats["max_ms"], stats["rows"])
+            for sql, stats in items[:top]
+        ]
+    
+    def format_summary(self, top=20, width=80):
+        """Return the summary as a printable table"""
+        rows = [
+            (sql if len(sql) <= width else sql[:width - 3] + "...",) + row[1:]
+            for row in self.summary(top)
+            for sql in [row[0]]
+        ]
+        return tabulate(
+            rows,
+            headers=['Statement', 'Count', 'Total ms', 'Avg ms', 'Max ms', 'Rows'],
+            tablefmt='grid',
+            floatfmt='.3f'
+        )
+    
+    def reset(self):
+        """Forget every recorded statement"""
+        with self.lock:
+            self.statements = {}
+
+query_stats = QueryStats()
+
+def enable_slow_log(path=SLOW_LOG_FILE, threshold_ms=SLOW_QUERY_MS):
+    """Start writing statements slower than threshold_ms to a rotating log file"""
+    global SLOW_QUERY_MS
+    SLOW_QUERY_MS = threshold_ms
+    if not slow_log.handlers:
+        handler = RotatingFileHandler(path, maxBytes=SLOW_LOG_BYTES, backupCount=SLOW_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.INFO)
+
+def log_slow_statement(conn, sql, params, seconds):
+    """Write a slow statement with its query plan to the slow log"""
+    if not slow_log.handlers:
+        return
+    try:
+        # A plain cursor, so the EXPLAIN itself is not instrumented
+        plan = [row[-1] for row in sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+    except sqlite3.Error:
+        plan = []
+    slow_log.info(json.dumps({
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "ms": round(seconds * 1000, 3),
+        "sql": normalize_sql(sql),
+        "params": repr(params)[:200],
+        "plan": plan
+    }))
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records timing and row counts in query_stats"""
+    
+    statement_key = None
+    
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        super().execute(sql, params)
+        elapsed = time.perf_counter() - started
+        self.statement_key = query_stats.record(sql, elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            log_slow_statement(self.connection, sql, params, elapsed)
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_params)
+        elapsed = time.perf_counter() - started
+        self.statement_key = query_stats.record(sql, elapsed)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            log_slow_statement(self.connection, sql, seq_of_params[0] if seq_of_params else (), elapsed)
+        return self
+    
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self.statement_key:
+            query_stats.add_rows(self.statement_key, 1)
+        return row
+    
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if rows and self.statement_key:
+            query_stats.add_rows(self.statement_key, len(rows))
+        return rows
+    
+    def fetchall(self):
+        rows = super().fetchall()
+        if rows and self.statement_key:
+            query_stats.add_rows(self.statement_key, len(rows))
+        return rows
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        row = super().__next__()
+        if self.statement_key:
+            query_stats.add_rows(self.statement_key, 1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors record every statement in query_stats"""
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+    
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+def summarize_slow_log(path=SLOW_LOG_FILE, top=20):
+    """Group a slow log by statement and return (statement, count, max ms, last plan) rows"""
+    grouped = {}
+    for name in [path] + [f"{path}.{number}" for number in range(1, SLOW_LOG_BACKUPS + 1)]:
+        try:
+            with open(name) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    count, max_ms, plan = grouped.get(entry["sql"], (0, 0.0, []))
+                    grouped[entry["sql"]] = (count + 1, max(max_ms, entry["ms"]), entry["plan"] or plan)
+        except FileNotFoundError:
+            continue
+    rows = [(sql, count, max_ms, "\n".join(plan)) for sql, (count, max_ms, plan) in grouped.items()]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the slow SQL log")
+    parser.add_argument("--log", default=SLOW_LOG_FILE, help="slow log file")
+    parser.add_argument("--top", type=int, default=20, help="statements to show")
+    args = parser.parse_args()
+    
+    rows = summarize_slow_log(args.log, args.top)
+    if rows:
+        print(tabulate(
+            [(sql[:80], count, max_ms, plan) for sql, count, max_ms, plan in rows],
+            headers=['Statement', 'Count', 'Max ms', 'Query Plan'],
+            tablefmt='grid',
+            floatfmt='.3f'
+        ))
+    else:
+        print("No slow statements logged")
\ No newline at end of file
@@ -0,0 +1,154 @@
+import argparse
+import math
+import sqlite3
+from datetime import date, timedelta
+from tabulate import tabulate
+
+from database import ConnectionManager, DB_FILE, PRODUCT_COLUMNS
+
+# Days of sales the velocity is averaged over
+VELOCITY_DAYS = 28
+# Days between placing an order and the stock arriving
+LEAD_TIME_DAYS = 7
+# Extra days of cover kept against a demand spike or a late delivery
+SAFETY_DAYS = 3
+# Days of sales a reorder should cover once it arrives
+REORDER_DAYS = 14
+
+class StockMonitor:
+    """Rolling per-product sales velocity over the last VELOCITY_DAYS, updated from each committed bill"""
+    
+    def __init__(self, window_days=VELOCITY_DAYS):
+        self.window_days = window_days
+        # sale_date -> {product_id: quantity} for the days in the window
+        self.daily = {}
+        # product_id -> quantity sold over the whole window
+        self.totals = {}
+        # sale_date -> uuids of the bills recorded that day, so a bill seen twice is only counted once
+        self.recorded = {}
+        self.window_start = None
+        # Last change_log row covered by the loaded rollups, set by whoever loads the monitor
+        self.change_id = 0
+        self.loaded = False
+    
+    def load(self, cursor, today=None):
+        """Load the window from the daily rollups, replacing the cached copy"""
+        today = today or date.today()
+        window_start = (today - timedelta(days=self.window_days - 1)).isoformat()
+        daily = {}
+        totals = {}
+        # The rollup primary key starts with sale_date, so only the window's rows are read
+        cursor.execute(
+            "SELECT sale_date, product_id, quantity FROM daily_product_sales WHERE sale_date >= ?",
+            (window_start,)
+        )
+        for sale_date, product_id, quantity in cursor:
+            daily.setdefault(sale_date, {})[product_id] = quantity
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        self.daily = daily
+        self.totals = totals
+        self.recorded = {}
+        self.window_start = window_start
+        self.loaded = True
+    
+    def expire(self, today=None):
+        """Drop days that have fallen out of the window"""
+        today = today or date.today()
+        window_start = (today - timedelta(days=self.window_days - 1)).isoformat()
+        if window_start == self.window_start:
+            return
+        for sale_date in [day for day in self.daily if day < window_start]:
+            for product_id, quantity in self.daily.pop(sale_date).items():
+                self.totals[product_id] -= quantity
+                if not self.totals[product_id]:
+                    del self.totals[product_id]
+            self.recorded.pop(sale_date, None)
+        self.window_start = window_start
+    
+    def record(self, bill_date, items, bill_uuid=None):
+        """Add the cart lines of a committed bill, once per bill uuid"""
+        sale_date = bill_date[:10]
+        if self.window_start and sale_date < self.window_start:
+            return
+        if bill_uuid:
+            recorded = self.recorded.setdefault(sale_date, set())
+            if bill_uuid in recorded:
+                return
+            recorded.add(bill_uuid)
+        day = self.daily.setdefault(sale_date, {})
+        for item in items:
+            day[item.product_id] = day.get(item.product_id, 0) + item.quantity
+            self.totals[item.product_id] = self.totals.get(item.product_id, 0) + item.quantity
+    
+    def velocity(self, product_id):
+        """Average units sold per day over the window"""
+        return self.totals.get(product_id, 0) / self.window_days
+    
+    def check(self, product, lead_time=LEAD_TIME_DAYS, safety_days=SAFETY_DAYS, reorder_days=REORDER_DAYS):
+        """Return an alert dict if a (product_id, name, category, price_cents, stock) row needs reordering, else None"""
+        product_id, name, category, price_cents, stock = product[:5]
+        velocity = self.velocity(product_id)
+        days_of_cover = stock / velocity if velocity else math.inf
+        # Alert when the stock runs out before an order placed today would arrive
+        if stock > 0 and days_of_cover > lead_time + safety_days:
+            return None
+        level = "out of stock" if stock <= 0 else "low stock"
+        reorder = math.ceil(velocity * (lead_time + safety_days + reorder_days) - max(stock, 0))
+        return {
+            "product_id": product_id,
+            "name": name,
+            "category": category,
+            "stock": stock,
+            "velocity": velocity,
+            "days_of_cover": days_of_cover,
+            "level": level,
+            "reorder_quantity": max(reorder, 0)
+        }
+    
+    def alerts(self, products, lead_time=LEAD_TIME_DAYS, safety_days=SAFETY_DAYS, reorder_days=REORDER_DAYS):
+        """Return alerts for the given product rows, the soonest to run out first"""
+        self.expire()
+        alerts = []
+        for product in products:
+            alert = self.check(product, lead_time, safety_days, reorder_days)
+            if alert is not None:
+                alerts.append(alert)
+        alerts.sort(key=lambda alert: (alert["days_of_cover"], -alert["velocity"]))
+        return alerts
+
+def print_alerts(alerts):
+    """Print alerts and reorder suggestions as a grid"""
+    print(tabulate(
+        [
+            (a["product_id"], a["name"], a["stock"], a["velocity"], a["days_of_cover"], a["level"], a["reorder_quantity"])
+            for a in alerts
+        ],
+        headers=['ID', 'Name', 'Stock', 'Sold/Day', 'Days Left', 'Level', 'Reorder'],
+        tablefmt='grid',
+        floatfmt='.1f'
+    ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Low-stock alerts and reorder suggestions from sales velocity")
+    parser.add_argument("--lead-time", type=float, default=LEAD_TIME_DAYS, help="days for an order to arrive")
+    parser.add_argument("--safety-days", type=float, default=SAFETY_DAYS, help="extra days of cover to keep")
+    parser.add_argument("--reorder-days", type=float, default=REORDER_DAYS, help="days of sales a reorder covers")
+    parser.add_argument("--window", type=int, default=VELOCITY_DAYS, help="days of sales to average over")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args()
+    
+    db = ConnectionManager(args.db)
+    try:
+        monitor = StockMonitor(args.window)
+        with db.reader() as conn:
+            monitor.load(conn.cursor())
+            products = conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products").fetchall()
+        alerts = monitor.alerts(products, args.lead_time, args.safety_days, args.reorder_days)
+        if alerts:
+            print_alerts(alerts)
+        else:
+            print("No products need reordering")
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
+    finally:
+        db.close()
\ No newline at end of file
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+
+POLL_MS = 20
+
+class TkWorker:
+    """Run database calls on background threads and hand the results back on the Tk thread"""
+    
+    def __init__(self, root, workers=2, poll_ms=POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        # Tk is not thread safe, so finished calls wait here until the Tk thread polls
+        self.results = Queue()
+        self.pending = 0
+        self.polling = False
+    
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        """Run fn(*args) in the background and call on_done(result) or on_error(exc) on the Tk thread"""
+        self.pending += 1
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self.results.put((f, on_done, on_error)))
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self.poll)
+        return future
+    
+    def poll(self):
+        """Deliver finished calls to their callbacks, rescheduling while work is pending"""
+        while True:
+            try:
+                future, on_done, on_error = self.results.get_nowait()
+            except Empty:
+                break
+            self.pending -= 1
+            error = future.exception()
+            if error is not None:
+                if on_error:
+                    on_error(error)
+                else:
+                    self.root.report_callback_exception(type(error), error, error.__traceback__)
+            elif on_done:
+                on_done(future.result())
+        
+        if self.pending:
+            self.root.after(self.poll_ms, self.poll)
+        else:
+            self.polling = False
+    
+    def shutdown(self):
+        """Wait for running calls to finish and stop the threads"""
+        self.executor.shutdown(wait=True)
\ No newline at end of file
@@ -1,53 +1,172 @@
+import argparse
+import csv
+import json
 import sqlite3
+import sys
 from tabulate import tabulate
 
-def view_database():
-    # Connect to the database
-    conn = sqlite3.connect('cloth_shop.db')
-    cursor = conn.cursor()
-    
-    print("\n=== CUSTOMERS ===")
-    cursor.execute("SELECT * FROM customers")
-    customers = cursor.fetchall()
-    if customers:
-        print(tabulate(customers, headers=['ID', 'Name', 'Phone', 'Total Bill', 'Date'], tablefmt='grid'))
-    else:
-        print("No customers found")
+from archive import attach_archives
+from database import DB_FILE
+
+# Rows pulled from SQLite per fetchmany call
+FETCH_SIZE = 500
+PAGE_SIZE = 50
+
+# Each report: title, query, date column used by --since, grid headers
+REPORTS = {
+    "customers": (
+        "CUSTOMERS",
+        "SELECT customer_id, name, phone, total_bill_cents / 100.0 AS total_bill, date FROM customers",
+        "date",
+        ['ID', 'Name', 'Phone', 'Total Bill', 'Date']
+    ),
+    "bills": (
+        "BILLS",
+        """
+        SELECT b.bill_id, b.customer_name, c.phone AS customer_phone, b.bill_date,
+            b.total_cents / 100.0 AS total_amount, b.payment_method
+        FROM bills b
+        LEFT JOIN customers c ON b.customer_id = c.customer_id
+        """,
+        "b.bill_date",
+        ['Bill ID', 'Customer Name', 'Phone', 'Date', 'Amount', 'Payment Method']
+    ),
+    "bill_items": (
+        "BILL ITEMS",
+        """
+        SELECT bi.item_id, bi.bill_id, bi.product_id, bi.quantity, bi.price_cents / 100.0 AS price,
+            bi.discount_cents / 100.0 AS discount, bi.tax_cents / 100.0 AS tax, p.name as product_name
+        FROM bill_items bi
+        JOIN products p ON bi.product_id = p.product_id
+        JOIN bills b ON bi.bill_id = b.bill_id
+        """,
+        "b.bill_date",
+        ['Item ID', 'Bill ID', 'Product ID', 'Quantity', 'Price', 'Discount', 'Tax', 'Product Name']
+    ),
+    "products": (
+        "PRODUCTS",
+        "SELECT product_id, name, category, price_cents / 100.0 AS price, stock, description, sku FROM products",
+        None,
+        ['ID', 'Name', 'Category', 'Price', 'Stock', 'Description', 'SKU']
+    )
+}
+
+def open_database(db_file=DB_FILE):
+    """Open the shop database read-only so reports never block the tills"""
+    return sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+
+def stream_rows(conn, table, since=None, limit=None):
+    """Return a report's column names and a generator of fetchmany batches"""
+    title, query, date_column, headers = REPORTS[table]
+    params = []
+    if since and date_column:
+        query += f" WHERE {date_column} >= ?"
+        params.append(since)
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
     
-    print("\n=== BILLS ===")
-    cursor.execute("SELECT * FROM bills")
-    bills = cursor.fetchall()
-    if bills:
-        print(tabulate(bills, headers=['Bill ID', 'Customer Name', 'Phone', 'Date', 'Amount', 'Payment Method'], tablefmt='grid'))
-    else:
-        print("No bills found")
+    cursor = conn.execute(query, params)
+    columns = [column[0] for column in cursor.description]
     
-    print("\n=== BILL ITEMS ===")
-    cursor.execute("""
-        SELECT bi.*, p.name as product_name 
-        FROM bill_items bi 
-        JOIN products p ON bi.product_id = p.product_id
-    """)
-    bill_items = cursor.fetchall()
-    if bill_items:
-        print(tabulate(bill_items, headers=['Item ID', 'Bill ID', 'Product ID', 'Quantity', 'Price', 'Product Name'], tablefmt='grid'))
-    else:
-        print("No bill items found")
+    def batches():
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
     
-    print("\n=== PRODUCTS ===")
-    cursor.execute("SELECT * FROM products")
-    products = cursor.fetchall()
-    if products:
-        print(tabulate(products, headers=['ID', 'Name', 'Category', 'Price', 'Stock', 'Description'], tablefmt='grid'))
-    else:
-        print("No products found")
+    return columns, batches()
+
+def print_grid(table, batches, page_size=PAGE_SIZE, pause=False, out=sys.stdout):
+    """Print a report as grid tables, one page at a time"""
+    title, query, date_column, headers = REPORTS[table]
+    print(f"\n=== {title} ===", file=out)
     
-    conn.close()
+    page = []
+    page_number = 0
+    for rows in batches:
+        for row in rows:
+            page.append(row)
+            if len(page) == page_size:
+                page_number += 1
+                print_page(page, headers, page_number, pause, out)
+                page = []
+    if page:
+        page_number += 1
+        print_page(page, headers, page_number, False, out)
+    if not page_number:
+        print(f"No {title.lower()} found", file=out)
+
+def print_page(rows, headers, page_number, pause, out):
+    """Print one page of a grid report"""
+    print(tabulate(rows, headers=headers, tablefmt='grid'), file=out)
+    print(f"-- page {page_number} --", file=out)
+    if pause and out.isatty():
+        input("Press Enter for the next page...")
+
+def write_csv(columns, batches, out):
+    """Write report rows as CSV"""
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+
+def write_jsonl(columns, batches, out):
+    """Write report rows as JSON lines"""
+    for rows in batches:
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row))) + "\n")
+
+def view_database(tables=None, since=None, limit=None, output_format="grid", out=None,
+                  page_size=PAGE_SIZE, pause=False, db_file=DB_FILE, archived=False):
+    """Print or export the shop tables without loading them into memory"""
+    out = out or sys.stdout
+    conn = open_database(db_file)
+    try:
+        if archived:
+            attach_archives(conn, since)
+        for table in tables or list(REPORTS):
+            columns, batches = stream_rows(conn, table, since, limit)
+            if output_format == "csv":
+                write_csv(columns, batches, out)
+            elif output_format == "jsonl":
+                write_jsonl(columns, batches, out)
+            else:
+                print_grid(table, batches, page_size, pause, out)
+    finally:
+        conn.close()
+
+def parse_args(argv=None):
+    """Parse command line options for the report"""
+    parser = argparse.ArgumentParser(description="View or export the cloth shop database")
+    parser.add_argument("--table", action="append", choices=list(REPORTS),
+                        help="table to show, may be given more than once (default: all)")
+    parser.add_argument("--since", help="only rows dated on or after this date, e.g. 2025-04-01")
+    parser.add_argument("--limit", type=int, help="maximum rows per table")
+    parser.add_argument("--format", dest="output_format", choices=["grid", "csv", "jsonl"], default="grid")
+    parser.add_argument("--output", help="write to this file instead of the screen")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="rows per page in grid format")
+    parser.add_argument("--pause", action="store_true", help="wait for Enter between grid pages")
+    parser.add_argument("--archived", action="store_true", help="include bills moved to the monthly archives")
+    parser.add_argument("--db", default=DB_FILE, help="database file")
+    args = parser.parse_args(argv)
+    if args.output_format != "grid" and len(args.table or REPORTS) != 1:
+        parser.error(f"{args.output_format} output needs a single --table")
+    return args
 
 if __name__ == "__main__":
+    args = parse_args()
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
     try:
-        view_database()
+        view_database(
+            args.table, args.since, args.limit, args.output_format, out,
+            args.page_size, args.pause, args.db, args.archived
+        )
     except sqlite3.Error as e:
         print(f"Error accessing database: {e}")
     except Exception as e:
-        print(f"An error occurred: {e}") 
\ No newline at end of file
+        print(f"An error occurred: {e}")
+    finally:
+        if args.output:
+            out.close()
\ No newline at end of file
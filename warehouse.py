@@ -0,0 +1,363 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from tabulate import tabulate
+
+from database import SCHEMA_VERSION, connect, schema_version
+
+WAREHOUSE_FILE = 'warehouse.db'
+# Branch bills copied per warehouse transaction, together with their lines and the new high-water mark
+SYNC_BATCH = 2000
+WORKERS = min(4, os.cpu_count() or 1)
+# Branch workers take turns writing to the one warehouse file, so they wait longer for the lock than a till
+BUSY_TIMEOUT_MS = 30000
+
+def create_warehouse(conn):
+    """Create the central tables if they do not exist"""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS stores (
+            store_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            db_file TEXT NOT NULL,
+            last_bill_id INTEGER NOT NULL DEFAULT 0,
+            last_synced TEXT
+        );
+        
+        -- One row per distinct product across the branches, matched by SKU or else by name and category
+        CREATE TABLE IF NOT EXISTS products (
+            product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_key TEXT NOT NULL UNIQUE,
+            sku TEXT,
+            name TEXT NOT NULL,
+            category TEXT
+        );
+        
+        -- Each branch's own product ids, prices and last known stock
+        CREATE TABLE IF NOT EXISTS store_products (
+            store_id INTEGER NOT NULL REFERENCES stores(store_id),
+            branch_product_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL REFERENCES products(product_id),
+            price_cents INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (store_id, branch_product_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_store_products_product_id ON store_products(product_id);
+        
+        CREATE TABLE IF NOT EXISTS bills (
+            bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_id INTEGER NOT NULL REFERENCES stores(store_id),
+            branch_bill_id INTEGER NOT NULL,
+            bill_uuid TEXT,
+            customer_name TEXT,
+            customer_phone TEXT,
+            bill_date TEXT NOT NULL,
+            total_cents INTEGER NOT NULL,
+            payment_method TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_store_bill ON bills(store_id, branch_bill_id);
+        CREATE INDEX IF NOT EXISTS idx_bills_bill_date ON bills(bill_date);
+        
+        CREATE TABLE IF NOT EXISTS bill_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bill_id INTEGER NOT NULL REFERENCES bills(bill_id),
+            product_id INTEGER NOT NULL REFERENCES products(product_id),
+            quantity INTEGER NOT NULL,
+            price_cents INTEGER NOT NULL,
+            discount_cents INTEGER NOT NULL DEFAULT 0,
+            tax_cents INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_bill_items_bill_id ON bill_items(bill_id);
+        CREATE INDEX IF NOT EXISTS idx_bill_items_product_id ON bill_items(product_id);
+    ''')
+
+def open_warehouse(warehouse_file=WAREHOUSE_FILE):
+    """Open the warehouse database in WAL mode and make sure the tables exist"""
+    conn = connect(warehouse_file, BUSY_TIMEOUT_MS)
+    create_warehouse(conn)
+    return conn
+
+@contextmanager
+def write_transaction(conn):
+    """Run one write transaction, taking the warehouse write lock up front"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+def product_key(sku, name, category):
+    """Return the key that matches the same product across branches"""
+    return f"sku:{sku}" if sku else f"name:{category or ''}|{name}"
+
+def json_list(values):
+    """Return values as a JSON array string for json_each"""
+    return json.dumps(list(values))
+
+def sync_products(branch, central, store_id, now):
+    """Copy new products and changed prices or stock from a branch and return {branch product id: product id}, changes"""
+    known = {
+        branch_product_id: (product_id, price_cents, stock)
+        for branch_product_id, product_id, price_cents, stock in central.execute(
+            "SELECT branch_product_id, product_id, price_cents, stock FROM store_products WHERE store_id = ?", (store_id,)
+        )
+    }
+    # Only new products and ones whose price or stock moved since the last sync are written
+    new = []
+    changed = []
+    for branch_product_id, sku, name, category, price_cents, stock in branch.execute(
+        "SELECT product_id, sku, name, category, price_cents, stock FROM products"
+    ):
+        row = known.get(branch_product_id)
+        if row is None:
+            new.append((branch_product_id, product_key(sku, name, category), sku, name, category, price_cents, stock))
+        elif row[1] != price_cents or row[2] != stock:
+            changed.append((price_cents, stock, now, store_id, branch_product_id))
+    
+    mapping = {branch_product_id: row[0] for branch_product_id, row in known.items()}
+    if new or changed:
+        with write_transaction(central):
+            if new:
+                central.executemany(
+                    "INSERT INTO products (product_key, sku, name, category) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(product_key) DO NOTHING",
+                    [(key, sku, name, category) for _, key, sku, name, category, _, _ in new]
+                )
+                ids = dict(central.execute(
+                    "SELECT product_key, product_id FROM products WHERE product_key IN (SELECT value FROM json_each(?))",
+                    (json_list(row[1] for row in new),)
+                ))
+                central.executemany(
+                    "INSERT INTO store_products (store_id, branch_product_id, product_id, price_cents, stock, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (store_id, branch_product_id, ids[key], price_cents, stock, now)
+                        for branch_product_id, key, _, _, _, price_cents, stock in new
+                    ]
+                )
+                mapping.update((row[0], ids[row[1]]) for row in new)
+            central.executemany(
+                "UPDATE store_products SET price_cents = ?, stock = ?, updated_at = ? "
+                "WHERE store_id = ? AND branch_product_id = ?",
+                changed
+            )
+    return mapping, len(new) + len(changed)
+
+def sync_store(warehouse_file, store_id, name, db_file, batch_size=SYNC_BATCH):
+    """Copy one branch's new bills, lines and stock changes into the warehouse and return counts and timing"""
+    started = time.perf_counter()
+    branch = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    central = open_warehouse(warehouse_file)
+    try:
+        version = schema_version(branch)
+        if version < SCHEMA_VERSION:
+            raise ValueError(f"{db_file} is at schema version {version}, run database.py --db {db_file} first")
+        # One read transaction gives a consistent snapshot of the branch while its tills keep selling
+        branch.execute("BEGIN")
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        products, product_changes = sync_products(branch, central, store_id, now)
+        
+        last_bill_id = central.execute("SELECT last_bill_id FROM stores WHERE store_id = ?", (store_id,)).fetchone()[0]
+        bills = items = 0
+        cursor = branch.execute('''
+            SELECT b.bill_id, b.bill_uuid, b.customer_name, c.phone, b.bill_date, b.total_cents, b.payment_method
+            FROM bills b
+            LEFT JOIN customers c ON c.customer_id = b.customer_id
+            WHERE b.bill_id > ?
+            ORDER BY b.bill_id
+        ''', (last_bill_id,))
+        while True:
+            bill_rows = cursor.fetchmany(batch_size)
+            if not bill_rows:
+                break
+            first, last = bill_rows[0][0], bill_rows[-1][0]
+            item_rows = branch.execute(
+                "SELECT bill_id, product_id, quantity, price_cents, discount_cents, tax_cents "
+                "FROM bill_items WHERE bill_id >= ? AND bill_id <= ? ORDER BY item_id",
+                (first, last)
+            ).fetchall()
+            
+            with write_transaction(central):
+                # The mark only moves forward from where this worker started, two syncs of one store cannot both copy a batch
+                moved = central.execute(
+                    "UPDATE stores SET last_bill_id = ? WHERE store_id = ? AND last_bill_id = ?",
+                    (last, store_id, last_bill_id)
+                ).rowcount
+                if not moved:
+                    raise ValueError(f"{name} is being synced by another process")
+                central.executemany(
+                    "INSERT INTO bills (store_id, branch_bill_id, bill_uuid, customer_name, customer_phone, bill_date, "
+                    "total_cents, payment_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(store_id, *row) for row in bill_rows]
+                )
+                bill_ids = dict(central.execute(
+                    "SELECT branch_bill_id, bill_id FROM bills WHERE store_id = ? AND branch_bill_id >= ? AND branch_bill_id <= ?",
+                    (store_id, first, last)
+                ))
+                # Lines of products deleted from the branch get a placeholder product of their own
+                missing = {row[1] for row in item_rows} - products.keys()
+                if missing:
+                    central.executemany(
+                        "INSERT INTO products (product_key, name) VALUES (?, ?) ON CONFLICT(product_key) DO NOTHING",
+                        [(f"store:{store_id}:{product_id}", f"Item {product_id}") for product_id in missing]
+                    )
+                    for product_id in missing:
+                        products[product_id] = central.execute(
+                            "SELECT product_id FROM products WHERE product_key = ?", (f"store:{store_id}:{product_id}",)
+                        ).fetchone()[0]
+                central.executemany(
+                    "INSERT INTO bill_items (bill_id, product_id, quantity, price_cents, discount_cents, tax_cents) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (bill_ids[bill_id], products[product_id], quantity, price_cents, discount_cents, tax_cents)
+                        for bill_id, product_id, quantity, price_cents, discount_cents, tax_cents in item_rows
+                    ]
+                )
+            last_bill_id = last
+            bills += len(bill_rows)
+            items += len(item_rows)
+        
+        with write_transaction(central):
+            central.execute("UPDATE stores SET last_synced = ? WHERE store_id = ?", (now, store_id))
+    finally:
+        branch.close()
+        central.close()
+    return {
+        "store": name, "bills": bills, "items": items, "products": product_changes,
+        "seconds": time.perf_counter() - started
+    }
+
+def sync_stores(warehouse_file=WAREHOUSE_FILE, names=None, workers=WORKERS, batch_size=SYNC_BATCH, progress=None):
+    """Sync every store, or the named ones, in parallel worker processes and return (results, errors)"""
+    conn = open_warehouse(warehouse_file)
+    try:
+        stores = conn.execute("SELECT store_id, name, db_file FROM stores ORDER BY store_id").fetchall()
+    finally:
+        conn.close()
+    if names:
+        stores = [store for store in stores if store[1] in names]
+        unknown = set(names) - {store[1] for store in stores}
+        if unknown:
+            raise ValueError(f"No store named {', '.join(sorted(unknown))}")
+    
+    results = []
+    errors = {}
+    if not stores:
+        return results, errors
+    # Each worker reads its branch on its own, the warehouse lock is only held while a batch is written
+    with ProcessPoolExecutor(min(workers, len(stores))) as pool:
+        futures = {
+            pool.submit(sync_store, warehouse_file, store_id, name, db_file, batch_size): name
+            for store_id, name, db_file in stores
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except (OSError, ValueError, sqlite3.Error) as e:
+                # One unreachable branch does not hold up the others, its mark stays where it was
+                errors[name] = str(e)
+                if progress:
+                    progress(f"  {name}: failed, {e}")
+                continue
+            results.append(result)
+            if progress:
+                progress(
+                    f"  {name}: {result['bills']} bills, {result['items']} lines, "
+                    f"{result['products']} product changes in {result['seconds']:.1f}s"
+                )
+    return results, errors
+
+def store_totals(conn, start=None, end=None):
+    """Return (store, bills, amount, last bill date, last synced) for every store"""
+    conditions = []
+    params = []
+    if start:
+        conditions.append("b.bill_date >= ?")
+        params.append(start)
+    if end:
+        # A bare date includes the whole day
+        conditions.append("b.bill_date <= ?")
+        params.append(end if len(end) > 10 else end + " 23:59:59")
+    join = " AND ".join(["b.store_id = s.store_id"] + conditions)
+    return conn.execute(f'''
+        SELECT s.name, COUNT(b.bill_id), COALESCE(SUM(b.total_cents), 0) / 100.0, MAX(b.bill_date), s.last_synced
+        FROM stores s
+        LEFT JOIN bills b ON {join}
+        GROUP BY s.store_id
+        ORDER BY s.name
+    ''', params).fetchall()
+
+def print_report(conn, start=None, end=None):
+    """Print sales per store and for the whole chain"""
+    rows = store_totals(conn, start, end)
+    print("\n=== SALES BY STORE ===")
+    print(tabulate(
+        rows + [("All stores", sum(row[1] for row in rows), sum(row[2] for row in rows), "", "")],
+        headers=['Store', 'Bills', 'Amount', 'Last Bill', 'Last Synced'],
+        tablefmt='grid',
+        floatfmt='.2f'
+    ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge branch databases into the head office warehouse")
+    parser.add_argument("--warehouse", default=WAREHOUSE_FILE, help="warehouse database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    add = commands.add_parser("add-store", help="register a branch database")
+    add.add_argument("name")
+    add.add_argument("db_file")
+    
+    commands.add_parser("list", help="show the branches and their sync state")
+    
+    sync = commands.add_parser("sync", help="pull new bills and stock from the branches")
+    sync.add_argument("--store", action="append", help="only this store, may be given more than once")
+    sync.add_argument("--workers", type=int, default=WORKERS, help="branches synced at once")
+    sync.add_argument("--batch", type=int, default=SYNC_BATCH, help="bills per warehouse transaction")
+    
+    report = commands.add_parser("report", help="sales per store")
+    report.add_argument("--since", help="first day, YYYY-MM-DD")
+    report.add_argument("--until", help="last day, YYYY-MM-DD")
+    args = parser.parse_args()
+    
+    try:
+        if args.command == "sync":
+            started = time.perf_counter()
+            results, errors = sync_stores(args.warehouse, args.store, args.workers, args.batch, progress=print)
+            print(
+                f"Synced {sum(result['bills'] for result in results)} bills from {len(results)} stores "
+                f"in {time.perf_counter() - started:.1f}s" + (f", {len(errors)} failed" if errors else "")
+            )
+        else:
+            conn = open_warehouse(args.warehouse)
+            try:
+                if args.command == "add-store":
+                    if not os.path.exists(args.db_file):
+                        raise ValueError(f"{args.db_file} does not exist")
+                    with write_transaction(conn):
+                        conn.execute(
+                            "INSERT INTO stores (name, db_file) VALUES (?, ?)", (args.name, os.path.abspath(args.db_file))
+                        )
+                    print(f"Added store {args.name}")
+                elif args.command == "list":
+                    print(tabulate(
+                        conn.execute("SELECT store_id, name, db_file, last_bill_id, last_synced FROM stores ORDER BY store_id").fetchall(),
+                        headers=['ID', 'Store', 'Database', 'Last Bill', 'Last Synced'],
+                        tablefmt='grid'
+                    ))
+                else:
+                    print_report(conn, args.since, args.until)
+            finally:
+                conn.close()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+    except sqlite3.Error as e:
+        print(f"Error accessing database: {e}")
\ No newline at end of file